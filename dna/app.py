@@ -8,9 +8,12 @@ import logging
 from dna.app_functions import check_query_parameter, parse_narrative_query_binding, process_background, \
     process_new_narrative, background_str, detail, error_str, narrative_id, repository, sentences, \
     Metadata, MetadataResults, BackgroundAndNarrativeResults
-from dna.database import add_remove_data, clear_data, construct_graph, query_database
-from dna.database_queries import construct_kg, count_triples, delete_entity, delete_narrative, \
+from dna.corrections_cache import invalidate_corrections
+from dna.database import add_remove_data, clear_data, construct_graph, parse_turtle, query_database
+from dna.database_queries import construct_kg, delete_entity, delete_narrative, \
     delete_repo_metadata, query_background, query_narratives, query_repos, query_repo_graphs, update_narrative
+from dna.dedup import dedup_index
+from dna.ingest_jobs import get_job, start_job_workers, submit_job
 # from dna.query_news import get_article_text, get_matching_articles
 from dna.utilities_and_language_specific import dna_prefix, empty_string, meta_graph
 
@@ -25,6 +28,14 @@ app = Flask(__name__)
 # TODO: (Future) Deal with concurrency, caching, etc. for production; Move to Nginx and WSGI protocol
 
 
+@app.before_request
+def start_ingest_job_workers():
+    # Process any ingest jobs that were queued (or running) before a restart, once the app is serving requests
+    #    (and not when the module is imported); When testing, the workers are only started by an async POST
+    if not app.testing:
+        start_job_workers()
+
+
 @app.route('/dna/v1')
 def index():
     return \
@@ -74,7 +85,7 @@ def repositories():
             return jsonify(dict(values)), scode
         repo = dict(values)[repository]
         logging.info(f'Deleting repository, {repo}')
-        # Delete metadata for the repository in dna db's default graph
+        # Delete metadata (including the corrections version) for the repository in dna db's default graph
         query_database('update', delete_repo_metadata.replace('?repo', f':{repo}'))
         # Delete all the named graphs for the repository
         graph_bindings = query_database('select', query_repo_graphs.replace('?repo', repo))
@@ -83,6 +94,9 @@ def repositories():
         for binding in graph_bindings:
             # Delete the graph
             clear_data(repo, binding['g']['value'].split(f'{repo}_')[1])
+        # Other processes reload their cached corrections, since the corrections version was deleted
+        invalidate_corrections(repo)
+        dedup_index.remove(repo)
         return jsonify({'deleted': repo}), 200
     elif request.method == 'GET':
         logging.info(f'Repository list')
@@ -137,6 +151,7 @@ def background():
         # Delete the entity data in the dna db repository_default graph
         query_database('update', delete_entity.replace('?named', f':{repo}_default')
                        .replace('?text_name', entity_name))
+        invalidate_corrections(repo, True)
         return jsonify({'repository': repo, 'deleted': entity_name}), 200
     elif request.method == 'GET':
         logging.info(f'Background list for {repository}')
@@ -186,7 +201,13 @@ def narratives():
         metadata = Metadata(narr_data['title'], narr_data['published'] if 'published' in narr_data else not_defined,
                             narr_data['source'], narr_data['url'] if 'url' in narr_data else not_defined,
                             number_sentences)
+        if request.args.get('async', 'false').lower() == 'true':
+            # Queue the ingest, returning the job id (the status is available from /dna/v1/jobs/<job_id>)
+            job_id = submit_job(metadata, narr_data['text'], repo)
+            return jsonify({repository: repo, 'jobId': job_id}), 202, {'Location': f'/dna/v1/jobs/{job_id}'}
         narrative_results = process_new_narrative(metadata, narr_data['text'], repo)
+        if narrative_results.http_status == 200:     # Duplicate of a narrative in the repository; Not ingested
+            return jsonify(narrative_results.resp_dict), 200
         if narrative_results.http_status != 201:
             return jsonify({error_str: narrative_results.error_msg}), narrative_results.http_status
         return jsonify(narrative_results.resp_dict), 201
@@ -203,6 +224,7 @@ def narratives():
                        .replace('narr_id', narr_id))
         # Delete the narrative graph
         clear_data(repo, narr_id)
+        dedup_index.remove(repo, narr_id)
         return jsonify({'repository': repo, 'deleted': narr_id}), 200
     elif request.method == 'GET':
         # Get repository name query parameter
@@ -259,6 +281,13 @@ def graphs():
                 {error_str: 'missing',
                  detail: 'A triples element MUST be present in the request body of a /graphs POST.'}), 400
         logging.info(f'Updating narrative, {narr_id}, in {repo}')
+        # Get the number of (distinct) triples
+        try:
+            numb_triples = parse_turtle(' '.join(req_data['triples']))[1]
+        except Exception as parse_err:
+            return jsonify({error_str: 'invalid',
+                            detail: f'The triples in the request body of a /graphs PUT are not valid Turtle: '
+                                    f'{str(parse_err)}'}), 400
         # Add triples to dna db's graph, :repo_test_narrId
         test_msg = add_remove_data('add', ' '.join(req_data['triples']), repo, f'test_{narr_id}')
         if not test_msg:     # Successful
@@ -275,10 +304,6 @@ def graphs():
                 query_database('update', update_narrative.replace('?g', f':{repo}_default')
                                .replace('?s', f':{narr_id}'))
                 modified_at = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-                numb_triples_results = query_database('select', count_triples.replace('?g', f':{repo}_{narr_id}'))
-                numb_triples = 0
-                if len(numb_triples_results) > 0:
-                    numb_triples = int(numb_triples_results[0]['cnt']['value'])
                 new_meta_ttl = [
                     f'@prefix : <{dna_prefix}> . @prefix dc: <http://purl.org/dc/terms/> .',
                     f':{narr_id} dc:modified "{modified_at}"^^xsd:dateTime ; :number_triples {numb_triples} .']
@@ -288,10 +313,22 @@ def graphs():
                                     'numberOfTriples': numb_triples}), 200
                 error = f'Error updating narrative ({narr_id}) metadata from {repo}'
                 return jsonify({error_str: error}), 500
-        error = f'Invalid triples; {test_msg}'
-        return jsonify({error_str: error}), 500
+        return jsonify({error_str: 'invalid',
+                        detail: f'The triples in the request body of a /graphs PUT could not be added: '
+                                f'{test_msg}'}), 400
     return jsonify({error_str: '/repositories/narratives/graphs API only supports GET and PUT requests'}), 405
 
 
+@app.route('/dna/v1/jobs/<job_id>', methods=['GET'])
+def jobs(job_id: str):
+    if request.method == 'GET':
+        logging.info(f'Ingest job {job_id}')
+        job = get_job(job_id)
+        if not job:
+            return jsonify({error_str: f'Job with the id, {job_id}, was not found'}), 404
+        return jsonify(job), 200
+    return jsonify({error_str: '/jobs API only supports GET requests'}), 405
+
+
 if __name__ == '__main__':
     app.run()
@@ -3,15 +3,20 @@
 
 import json
 import logging
+import threading
 from dataclasses import dataclass
+from typing import Callable, Union
 
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from flask import Request, Response, jsonify
 
-from dna.create_narrative_turtle import create_graph, nouns_preload
-from dna.database import add_remove_data, check_server_status, query_database
-from dna.database_queries import count_triples, query_narratives, query_repos
+from dna.corrections_cache import flush_with_corrections, nouns_preload
+from dna.create_narrative_turtle import create_graph, prefetch_narrative_entities
+from dna.database import WriteBuffer, check_server_status, parse_turtle, query_database
+from dna.database_queries import query_narratives, query_repos
+from dna.dedup import NarrativeFingerprint, dedup_enabled, dedup_index
 from dna.nlp import parse_narrative
 from dna.process_entities import process_ner_entities
 from dna.query_openai import access_api, narrative_classification_prompt, narrative_flows, narrative_goals, \
@@ -288,18 +293,47 @@ def process_background(entities: list, repo: str) -> BackgroundAndNarrativeResul
     background_turtle.extend(entities_ttl)
     background_ttl = ' '.join(background_turtle)
     background_ttl = background_ttl.replace(':Correction', ':Background, :Correction')
-    msg = add_remove_data('add', background_ttl, repo)
+    # Add the entities and update the repository's corrections (and its version) in 1 transaction
+    write_buffer = WriteBuffer()
+    write_buffer.add(background_ttl, repo)
+    msg = flush_with_corrections(repo, write_buffer)
     if msg:
         logging.error(f'Error loading the background Turtle, {background_turtle}')
         return BackgroundResults(0, [], f'Error loading background data to {repo}: {msg}', 500)
-    # Add is successful
     resp_dict = {repository: repo,
                  'processedNames': processed_names,
                  'skippedNames': invalid_names}
     return BackgroundAndNarrativeResults(resp_dict, empty_string, 201)
 
 
-def process_new_narrative(metadata: Metadata, narr: str, repo: str) -> BackgroundAndNarrativeResults:
+def check_duplicate(metadata: Metadata, narr: str,
+                    repo: str) -> (Union[NarrativeFingerprint, None], Union[BackgroundAndNarrativeResults, None]):
+    """
+    Check if a narrative is a duplicate or near-duplicate of a narrative in the repository.
+
+    :param metadata: Instance of the Metadata Class holding the narrative/article details
+    :param narr: String holding the narrative text
+    :param repo: String holding the repository name
+    :return: A tuple holding the narrative's NarrativeFingerprint (None if deduplication is disabled) and, if
+             the narrative is an exact duplicate, the BackgroundAndNarrativeResults dataclass (with the
+             http_status, 200, and the id of the duplicated narrative) or None
+    """
+    if not dedup_enabled:
+        return None, None
+    fingerprint = NarrativeFingerprint(narr)
+    match_id, similarity, exact = dedup_index.find_match(repo, fingerprint)
+    if exact:
+        logging.info(f'{metadata.title} duplicates narrative {match_id} in {repo}; Not ingested')
+        return fingerprint, BackgroundAndNarrativeResults({repository: repo, 'duplicateOf': match_id},
+                                                          empty_string, 200)
+    if match_id:
+        logging.info(f'{metadata.title} is a near-duplicate of narrative {match_id} in {repo} '
+                     f'(similarity {similarity:.2f})')
+    return fingerprint, None
+
+
+def process_new_narrative(metadata: Metadata, narr: str, repo: str,
+                          progress: Callable = None) -> BackgroundAndNarrativeResults:
     """
     Performs the sentence and quotation extractions and analysis, adding a narrative to
     the database with the specified name and address.
@@ -308,40 +342,127 @@ def process_new_narrative(metadata: Metadata, narr: str, repo: str) -> Backgroun
                      title, date published, source/publisher, url and number of sentences to ingest
     :param narr: String holding the narrative text
     :param repo: String holding the repository name for the narrative graph
+    :param progress: An optional function called with the name of each processing stage ('parsing', 'metadata',
+                     'graph' and 'loading') when the stage starts (for ex, to report the progress of an ingest job)
     :return: The BackgroundAndNarrativeResults dataclass
     """
-    graph_uuid = str(uuid.uuid4())[:8]   # IRI of the named graph for the narrative, and the narrative itself
     logging.info(f'Ingesting {metadata.title} to {repo}')
+    fingerprint, duplicate_results = check_duplicate(metadata, narr, repo)
+    if duplicate_results:
+        return duplicate_results
+    if progress:
+        progress('parsing')
     sentence_classes, quotation_classes = parse_narrative(narr)
+    return process_parsed_narrative(metadata, narr, repo, sentence_classes, quotation_classes, progress, fingerprint)
+
+
+def process_parsed_narrative(metadata: Metadata, narr: str, repo: str, sentence_classes: list,
+                             quotation_classes: list, progress: Callable = None,
+                             fingerprint: NarrativeFingerprint = None) -> BackgroundAndNarrativeResults:
+    """
+    Performs the processing of process_new_narrative for a narrative that was already parsed (for ex,
+    by parse_narratives in a bulk ingest).
+
+    :param metadata: Instance of the Metadata Class holding the narrative/article details
+    :param narr: String holding the narrative text
+    :param repo: String holding the repository name for the narrative graph
+    :param sentence_classes: Array of the narrative's Sentence instances (from parse_narrative)
+    :param quotation_classes: Array of the narrative's Quotation instances (from parse_narrative)
+    :param progress: An optional function called with the name of each processing stage (as for
+                     process_new_narrative)
+    :param fingerprint: The narrative's NarrativeFingerprint, if already checked by check_duplicate; If not
+                        specified, the narrative is checked here
+    :return: The BackgroundAndNarrativeResults dataclass
+    """
+    if not fingerprint:
+        fingerprint, duplicate_results = check_duplicate(metadata, narr, repo)
+        if duplicate_results:
+            return duplicate_results
+    graph_uuid = str(uuid.uuid4())[:8]   # IRI of the named graph for the narrative, and the narrative itself
+    if fingerprint:
+        # Reserve the narrative's content, so that a duplicate being ingested concurrently is not also ingested
+        duplicate_id = dedup_index.reserve(repo, fingerprint, graph_uuid)
+        if duplicate_id:
+            logging.info(f'{metadata.title} duplicates narrative {duplicate_id} in {repo}; Not ingested')
+            return BackgroundAndNarrativeResults({repository: repo, 'duplicateOf': duplicate_id}, empty_string, 200)
+    try:
+        return _add_parsed_narrative(metadata, narr, repo, sentence_classes, quotation_classes, progress,
+                                     fingerprint, graph_uuid)
+    finally:
+        if fingerprint:
+            dedup_index.release(repo, fingerprint)
+
+
+def _add_parsed_narrative(metadata: Metadata, narr: str, repo: str, sentence_classes: list, quotation_classes: list,
+                          progress: Callable, fingerprint: Union[NarrativeFingerprint, None],
+                          graph_uuid: str) -> BackgroundAndNarrativeResults:
+    """
+    Create the graph of a parsed narrative and add it to the repository (for process_parsed_narrative, while the
+    narrative's content is reserved).
+
+    :param metadata: Instance of the Metadata Class holding the narrative/article details
+    :param narr: String holding the narrative text
+    :param repo: String holding the repository name for the narrative graph
+    :param sentence_classes: Array of the narrative's Sentence instances (from parse_narrative)
+    :param quotation_classes: Array of the narrative's Quotation instances (from parse_narrative)
+    :param progress: An optional function called with the name of each processing stage
+    :param fingerprint: The narrative's NarrativeFingerprint, which is added to the dedup index if the narrative
+                        is added (None if deduplication is disabled)
+    :param graph_uuid: String holding the id of the narrative and its named graph
+    :return: The BackgroundAndNarrativeResults dataclass
+    """
+    # Prefetch the details of the narrative's entities, while the metadata is processed
+    prefetch_cancelled = threading.Event()
+    prefetch_executor = ThreadPoolExecutor(max_workers=1)
+    nouns_future = prefetch_executor.submit(prefetch_narrative_entities, sentence_classes, quotation_classes, repo,
+                                            prefetch_cancelled)
+    prefetch_executor.shutdown(wait=False)
     # Process the metadata and get the main subject areas of the article
     logging.info('Loading metadata')
+    if progress:
+        progress('metadata')
     metadata_results = get_metadata_ttl(repo, graph_uuid, narr, metadata, len(sentence_classes))
     if not metadata_results.success:
+        prefetch_cancelled.set()     # The remaining prefetch requests are not sent
         return BackgroundAndNarrativeResults(dict(), f'Error creating the metadata for {metadata.title}', 500)
+    try:
+        nouns_dictionary = nouns_future.result()
+    except Exception as prefetch_err:     # The entities' details are then retrieved when they are processed
+        logging.error(f'Error prefetching the entities of {metadata.title}: {str(prefetch_err)}')
+        nouns_dictionary = nouns_preload(repo)
+    if progress:
+        progress('graph')
+    # Collect the new entities (for the repo's default graph), the narrative graph and its metadata,
+    #    adding them in 1 transaction
+    write_buffer = WriteBuffer()
     graph_results = \
         create_graph(sentence_classes, quotation_classes, narr, metadata_results.narrative_id,
-                     metadata_results.subject_areas, metadata.number_to_ingest, repo)
+                     metadata_results.subject_areas, metadata.number_to_ingest, repo, write_buffer, nouns_dictionary)
     if not graph_results.success:
         return BackgroundAndNarrativeResults(dict(), f'Error creating the graph for {metadata.title}', 500)
-    logging.info('Loading knowledge graph')
-    msg = add_remove_data('add', ' '.join(graph_results.turtle), repo, graph_uuid)   # Add to dna's repo_graphUUID graph
-    if msg:
-        logging.error(f'Error loading the narrative graph, {graph_results.turtle}')
-        return BackgroundAndNarrativeResults(dict(), f'Error loading the narrative graph {graph_uuid}: {msg}', 500)
+    # Parse the narrative graph locally to remove duplicates and get the number of triples
+    try:
+        graph_triples, numb_triples = parse_turtle(' '.join(graph_results.turtle))
+    except Exception as parse_err:
+        logging.error(f'Error parsing the narrative graph, {graph_results.turtle}: {str(parse_err)}')
+        return BackgroundAndNarrativeResults(dict(), f'Error parsing the narrative graph {graph_uuid}: '
+                                                     f'{str(parse_err)}', 500)
+    write_buffer.add(graph_triples, repo, graph_uuid)   # Add to dna's repo_graphUUID graph
     # Add the details on the number of triples and sentences processed, and add the metadata to the repository
     narr_turtle = metadata_results.turtle[:]
     narr_turtle.append(f'{metadata_results.narrative_id} :number_ingested {graph_results.number_processed} .')
-    narr_id = metadata_results.narrative_id.split('_')[1]
-    numb_triples_results = query_database('select', count_triples.replace('?g', f':{repo}_{narr_id}'))
-    if len(numb_triples_results) > 0:
-        numb_triples = int(numb_triples_results[0]["cnt"]["value"])
-        narr_turtle.append(f':{narr_id} :number_triples {numb_triples} .')
-    else:
-        numb_triples = 0
-        logging.error(f'No triples returned for the graph, :{repo}_{narr_id}')
-    msg = add_remove_data('add', ' '.join(narr_turtle), repo)   # Add to dna db's repo graph
+    narr_turtle.append(f':{graph_uuid} :number_triples {numb_triples} .')
+    write_buffer.add(' '.join(narr_turtle), repo)   # Add to dna db's repo graph
+    logging.info('Loading knowledge graph')
+    if progress:
+        progress('loading')
+    # The narrative's new entities are added to the cached corrections, and their version is updated with the flush
+    msg = flush_with_corrections(repo, write_buffer)
     if msg:
-        return BackgroundAndNarrativeResults(dict(), f'Error adding metadata for {metadata.title}: {msg}', 500)
+        logging.error(f'Error loading the narrative graph, {graph_results.turtle}')
+        return BackgroundAndNarrativeResults(dict(), f'Error loading the narrative graph {graph_uuid}: {msg}', 500)
+    if fingerprint:
+        dedup_index.add(repo, graph_uuid, fingerprint)     # Before its reservation is released
     # All is successful
     resp_dict = {repository: repo,
                  'narrativeDetails': {
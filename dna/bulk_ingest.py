@@ -0,0 +1,284 @@
+# Bulk ingest of narratives/articles into a repository, from JSON Lines files, CSV files and directories
+#    Usage: python -m dna.bulk_ingest <repository> <input> [<input> ...] [--sentences 10] [--workers 4]
+#           [--parse-batch-size 16] [--parse-processes 1] [--checkpoint <file>] [--results <file>]
+#    Each article has the same fields as the body of a /narratives POST (title, source, text and optionally,
+#    published and url). JSON Lines files hold one article per line, and CSV files have a header row naming the
+#    fields. The .jsonl, .csv and .txt files in an input directory are ingested (where a .txt file is one article,
+#    whose title is the file name).
+#    Articles are streamed - Parsed by spaCy in batches and then ingested (metadata, graph creation and database
+#    load) by a pool of workers, holding at most twice the number of workers parsed articles in memory. Each
+#    article's result is appended to a JSON Lines log, and the articles that are ingested are recorded in a
+#    checkpoint database, so that they are skipped when the ingest is re-run. Articles that duplicate a narrative
+#    in the repository, or an earlier article of the ingest that is still being processed, are skipped before
+#    parsing.
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from dna.app_functions import Metadata, check_duplicate, narrative_id, process_parsed_narrative
+from dna.database import check_server_status, query_database
+from dna.database_queries import query_repos
+from dna.dedup import NarrativeFingerprint
+from dna.nlp import parse_narratives
+from dna.utilities_and_language_specific import empty_string
+
+not_defined = 'not defined'
+input_suffixes = ('.jsonl', '.csv', '.txt')
+
+create_table = 'CREATE TABLE IF NOT EXISTS ingested (key TEXT PRIMARY KEY, narrative_id TEXT, ' \
+               'ingested_at TEXT NOT NULL)'
+
+
+class IngestCheckpoint:
+    """
+    Records the keys of the articles that were ingested into a repository (in a SQLite database), so that
+    a re-run of a bulk ingest skips them.
+    """
+
+    def __init__(self, checkpoint_path: str):
+        """
+        :param checkpoint_path: String holding the path of the SQLite database (created if it does not exist)
+        """
+        self._conn = sqlite3.connect(checkpoint_path)
+        self._conn.execute(create_table)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def is_ingested(self, key: str) -> bool:
+        """
+        :param key: String holding the article key
+        :return: True if the article was ingested, False otherwise
+        """
+        return self._conn.execute('SELECT 1 FROM ingested WHERE key = ?', (key,)).fetchone() is not None
+
+    def record(self, key: str, narr_id: str):
+        """
+        :param key: String holding the article key
+        :param narr_id: String holding the id of the narrative graph
+        :return: None
+        """
+        self._conn.execute('INSERT OR REPLACE INTO ingested VALUES (?, ?, ?)',
+                           (key, narr_id, datetime.now().strftime("%Y-%m-%dT%H:%M:%S")))
+        self._conn.commit()
+
+
+def _get_article_key(article: dict) -> str:
+    """
+    Get the key identifying an article (a hash of its fields, so that it does not depend on the input file
+    or the article's position in the file).
+
+    :param article: Dictionary holding the article's title, source, published, url and text
+    :return: String holding the key
+    """
+    details = [article.get(field, empty_string) for field in ('title', 'source', 'published', 'url', 'text')]
+    return hashlib.sha256(json.dumps(details).encode('utf-8')).hexdigest()
+
+
+def _read_file(file_path: Path) -> Iterator:
+    """
+    Read the articles in a JSON Lines, CSV or text file.
+
+    :param file_path: Path of the file
+    :return: A generator yielding a tuple of a string locating the article (the file name and line or
+             row number) and a dictionary holding the article's fields
+    """
+    suffix = file_path.suffix.lower()
+    with open(file_path, encoding='utf-8', newline=empty_string if suffix == '.csv' else None) as in_file:
+        if suffix == '.jsonl':
+            for line_number, line in enumerate(in_file, start=1):
+                if line.strip():
+                    try:
+                        article = json.loads(line)
+                    except json.JSONDecodeError as json_err:
+                        article = {'error': f'Invalid JSON: {str(json_err)}'}
+                    yield f'{file_path}:{line_number}', \
+                        article if isinstance(article, dict) else {'error': 'Article must be a JSON object'}
+        elif suffix == '.csv':
+            for row_number, row in enumerate(csv.DictReader(in_file), start=1):
+                yield f'{file_path}:{row_number}', row
+        else:
+            yield str(file_path), {'title': file_path.stem, 'source': file_path.parent.name, 'text': in_file.read()}
+
+
+def read_articles(input_paths: Iterable) -> Iterator:
+    """
+    Read the articles in the input files and directories (in order, and for a directory, in order of
+    the file names). A path that does not exist is logged, and is returned with an error (so that it is
+    recorded as skipped by ingest_articles) instead of the articles.
+
+    :param input_paths: An iterable of strings holding the file and directory paths
+    :return: A generator yielding a tuple of a string locating the article and a dictionary holding the
+             article's fields
+    """
+    for input_path in input_paths:
+        path = Path(input_path)
+        if not path.exists():
+            logging.error(f'Bulk ingest input path not found: {input_path}')
+            yield str(path), {'error': 'Input path not found'}
+            continue
+        if path.is_dir():
+            file_paths = sorted(file_path for file_path in path.iterdir()
+                                if file_path.suffix.lower() in input_suffixes)
+        else:
+            file_paths = [path]
+        for file_path in file_paths:
+            yield from _read_file(file_path)
+
+
+def _get_metadata(article: dict, number_sentences: int) -> Metadata:
+    return Metadata(article['title'], article.get('published') or not_defined, article['source'],
+                    article.get('url') or not_defined, number_sentences)
+
+
+def _ingest_article(repo: str, article: dict, number_sentences: int, parse_results: tuple,
+                    fingerprint: NarrativeFingerprint) -> dict:
+    """
+    Ingest a parsed article into the repository.
+
+    :param repo: String holding the repository name
+    :param article: Dictionary holding the article's fields
+    :param number_sentences: Integer holding the number of sentences to ingest
+    :param parse_results: Tuple holding the article's Sentence and Quotation instances (from parse_narratives)
+    :param fingerprint: The article's NarrativeFingerprint (from check_duplicate)
+    :return: Dictionary holding the status ('ingested', 'duplicate' or 'failed') and the narrative details,
+             duplicated narrative or error
+    """
+    start = time.perf_counter()
+    try:
+        narrative_results = process_parsed_narrative(_get_metadata(article, number_sentences), article['text'],
+                                                     repo, *parse_results, fingerprint=fingerprint)
+        if 'duplicateOf' in narrative_results.resp_dict:     # Duplicates a narrative ingested concurrently
+            result = {'status': 'duplicate', **narrative_results.resp_dict}
+        elif narrative_results.http_status != 201:
+            result = {'status': 'failed', 'error': narrative_results.error_msg}
+        else:
+            result = {'status': 'ingested', **narrative_results.resp_dict['narrativeDetails']}
+    except Exception as ingest_err:
+        logging.error(f'Error ingesting {article["title"]}: {str(ingest_err)}')
+        result = {'status': 'failed', 'error': str(ingest_err)}
+    result['seconds'] = round(time.perf_counter() - start, 2)
+    return result
+
+
+def ingest_articles(repo: str, articles: Iterable, checkpoint: IngestCheckpoint, results_file,
+                    number_sentences: int = 10, workers: int = 4, parse_batch_size: int = None,
+                    parse_processes: int = None) -> dict:
+    """
+    Stream the articles through parsing and ingest, skipping those that were ingested in a previous run and
+    those that duplicate a narrative in the repository or an earlier article that is being parsed or ingested
+    (which are checked before parsing).
+
+    :param repo: String holding the repository name
+    :param articles: An iterable of tuples of a string locating the article and a dictionary holding the
+                     article's fields (for ex, from read_articles)
+    :param checkpoint: The IngestCheckpoint for the repository
+    :param results_file: Text file to which the result of each article is written (as a line of JSON)
+    :param number_sentences: Integer holding the number of sentences to ingest per article
+    :param workers: Number of articles that are ingested concurrently
+    :param parse_batch_size: Number of articles parsed per batch (if not specified, the spaCy batch size
+                             of parse_narratives)
+    :param parse_processes: Number of spaCy processes (if not specified, the default of parse_narratives)
+    :return: Dictionary holding the number of articles ingested, failed, skipped (invalid), duplicated and
+             already ingested
+    """
+    counts = {'ingested': 0, 'failed': 0, 'skipped': 0, 'duplicate': 0, 'previously_ingested': 0}
+    # Tuples of the article location, key, fields and fingerprint, for the articles whose texts were passed to
+    #    parse_narratives but whose results are not yet returned
+    parsing = deque()
+    # Keyed by the Future of the ingest, with a tuple of the article location, key, fields and fingerprint
+    running = dict()
+    # Keyed by the content hash of the articles that are being parsed or ingested, with the article location;
+    #    Duplicates of these articles are not found by check_duplicate until they are added to the dedup index
+    in_flight = dict()
+
+    def write_result(location: str, key: str, article: dict, result: dict):
+        counts[result['status']] += 1
+        if result['status'] == 'ingested':
+            checkpoint.record(key, result[narrative_id])
+        results_file.write(json.dumps({'location': location, 'key': key, 'title': article.get('title'),
+                                       'url': article.get('url'), **result}) + '\n')
+        results_file.flush()
+
+    def get_texts() -> Iterator:
+        for location, article in articles:
+            if 'error' in article or not all(article.get(field) for field in ('title', 'source', 'text')):
+                write_result(location, empty_string, article,
+                             {'status': 'skipped',
+                              'error': article.get('error', 'A "title", "source" and "text" MUST be specified')})
+                continue
+            key = _get_article_key(article)
+            if checkpoint.is_ingested(key):
+                counts['previously_ingested'] += 1
+                continue
+            fingerprint, duplicate_results = check_duplicate(_get_metadata(article, number_sentences),
+                                                             article['text'], repo)
+            if duplicate_results:
+                write_result(location, key, article, {'status': 'duplicate', **duplicate_results.resp_dict})
+                continue
+            if fingerprint:
+                if fingerprint.content_hash in in_flight:
+                    write_result(location, key, article,
+                                 {'status': 'duplicate', 'duplicateOfLocation': in_flight[fingerprint.content_hash]})
+                    continue
+                in_flight[fingerprint.content_hash] = location
+            parsing.append((location, key, article, fingerprint))
+            yield article['text']
+
+    def wait_for_ingests(max_running: int):
+        while len(running) > max_running:
+            done, not_done = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                location, key, article, fingerprint = running.pop(future)
+                write_result(location, key, article, future.result())
+                if fingerprint:     # Later duplicates are found by check_duplicate, if the article was ingested
+                    in_flight.pop(fingerprint.content_hash, None)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for parse_results in parse_narratives(get_texts(), parse_batch_size, parse_processes):
+            location, key, article, fingerprint = parsing.popleft()
+            wait_for_ingests(2 * workers - 1)    # Bounds the parsed articles held in memory
+            future = executor.submit(_ingest_article, repo, article, number_sentences, parse_results, fingerprint)
+            running[future] = location, key, article, fingerprint
+        wait_for_ingests(0)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest narratives/articles into a DNA repository')
+    parser.add_argument('repository', help='name of an existing repository')
+    parser.add_argument('inputs', nargs='+', help='JSON Lines (.jsonl), CSV and text (.txt) files, or directories')
+    parser.add_argument('--sentences', type=int, default=10, help='number of sentences to ingest per article')
+    parser.add_argument('--workers', type=int, default=4, help='number of articles ingested concurrently')
+    parser.add_argument('--parse-batch-size', type=int, help='number of articles parsed by spaCy per batch')
+    parser.add_argument('--parse-processes', type=int, help='number of spaCy processes (-1 for the number of CPUs)')
+    parser.add_argument('--checkpoint', help='checkpoint database (default, <repository>_ingest.sqlite)')
+    parser.add_argument('--results', help='JSON Lines log of the results (default, <repository>_ingest.jsonl)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, filename='dna.log',
+                        format='%(funcName)s - %(levelname)s - %(asctime)s - %(message)s')
+    if not check_server_status():
+        sys.exit('Database server must be active at the address in the environment variable, STARDOG_ENDPOINT')
+    if not query_database('select', query_repos.replace('?repo', f':{args.repository}')):
+        sys.exit(f'Repository with the name, {args.repository}, was not found')
+    ingest_checkpoint = IngestCheckpoint(args.checkpoint or f'{args.repository}_ingest.sqlite')
+    try:
+        with open(args.results or f'{args.repository}_ingest.jsonl', 'a', encoding='utf-8') as results_log:
+            ingest_counts = ingest_articles(args.repository, read_articles(args.inputs), ingest_checkpoint,
+                                            results_log, args.sentences, args.workers, args.parse_batch_size,
+                                            args.parse_processes)
+    finally:
+        ingest_checkpoint.close()
+    print(', '.join(f'{count} {status.replace("_", " ")}' for status, count in ingest_counts.items()))
@@ -0,0 +1,219 @@
+# In-process cache of the nouns dictionary of each repository (the named entities that are 'Corrections',
+#    created manually or by parsing previous narratives into the repository), used to preload the nouns_dict for
+#    co-reference resolution without querying all the repository's corrections for every ingest
+#    The cache is updated as new corrections are added, and is invalidated when background entities or the
+#    repository are deleted, or when the corrections version in the database's default graph changes (which
+#    indicates that another process added corrections, or that the manual corrections were changed)
+
+import logging
+import os
+import threading
+import uuid
+
+from dna.database import WriteBuffer, query_database, query_turtle
+from dna.database_queries import query_corrections, query_corrections_version, query_manual_corrections, \
+    update_corrections_version
+from dna.nouns_index import NounsDictionary
+from dna.utilities_and_language_specific import dna_prefix, empty_string, ner_dict
+
+corrections_cache_enabled = os.environ.get('CORRECTIONS_CACHE', 'on').lower() != 'off'
+
+_repo_nouns = dict()         # Keyed by repository, with a tuple of the corrections version and the NounsDictionary
+_repo_generations = dict()   # Keyed by repository, incremented when the cached details are updated or invalidated
+_lock = threading.Lock()
+
+
+def _update_nouns(bindings: list, nouns_dictionary: dict):
+    """
+    Iterate through the query bindings and add the results to the nouns_dictionary.
+
+    :param bindings: An array of query result bindings
+    :param nouns_dictionary: A dictionary holding the details of any named entities that could be
+             encountered in a narrative - For reuse of the IRI due to co-reference/multiple reference;
+             Keys are the possible texts for the entity and their value is a tuple that is the spaCy
+             NER type and its IRI
+    :return: None (nouns_dictionary is updated)
+    """
+    for binding_set in bindings:
+        entity_iri = f":{binding_set['s']['value'].split(':')[-1]}"
+        entity_type = f"{binding_set['type']['value'].split(':')[-1]}"
+        if entity_type == 'Correction':
+            continue
+        entity_ner = empty_string
+        for key, value in ner_dict.items():
+            if key == 'NORP':
+                for class_type in (':Ethnicity', ':ReligiousGroup', ':PoliticalGroup',
+                                   ':PoliticalIdeology', ':ReligiousBelief', ':GroupOfAgents'):
+                    if class_type == f':{entity_type}':
+                        entity_ner = class_type
+                        break
+            elif value == f':{entity_type}':   # TODO: (Future) Address class hierarchies such as GovEntity->OrgEntity
+                entity_ner = key
+                break
+        if not entity_ner:
+            continue
+        nouns_dictionary[binding_set['label']['value']] = entity_ner, entity_iri
+    return
+
+
+def _get_corrections_version(repo: str) -> dict:
+    """
+    Get the version of the manual corrections and of the repository's corrections.
+
+    :param repo: String holding the repository name
+    :return: Dictionary keyed by the IRI (the repository or :ManualCorrections) whose value is the version
+             (empty if neither is defined), or None if the query failed
+    """
+    bindings = query_database('select', query_corrections_version.replace('?repo', f':{repo}'))
+    if any(not isinstance(binding, dict) for binding in bindings):     # Query exception
+        return None
+    return {binding['s']['value']: binding['version']['value'] for binding in bindings}
+
+
+def _load_nouns(repo: str) -> NounsDictionary:
+    """
+    Query the manual corrections and the repository's corrections.
+
+    :param repo: String holding the repository name
+    :return: The NounsDictionary holding the corrections
+    """
+    nouns_dict = NounsDictionary()     # Indexed for the substring lookups in check_if_noun_is_known
+    # Manually created corrections are stored in the default db graph
+    corr_bindings = query_database('select', query_manual_corrections)
+    _update_nouns(corr_bindings, nouns_dict)
+    # Corrections recorded by previous parses in the repository's default graph
+    corr_bindings = query_database('select', query_corrections.replace('?named', f':{repo}_default'))
+    _update_nouns(corr_bindings, nouns_dict)
+    return nouns_dict
+
+
+def invalidate_corrections(repo: str = empty_string, update_version: bool = False):
+    """
+    Remove the cached corrections of a repository (for ex, after background entities are deleted), or of all
+    repositories.
+
+    :param repo: String holding the repository name; If not specified, all repositories are invalidated
+    :param update_version: Boolean indicating that the repository's corrections version is updated in the
+                           database, so that other processes also reload their cached corrections
+    :return: None
+    """
+    with _lock:
+        repos = [repo] if repo else list(_repo_nouns.keys())
+        for repo_name in repos:
+            _repo_nouns.pop(repo_name, None)
+            _repo_generations[repo_name] = _repo_generations.get(repo_name, 0) + 1
+    if repo and update_version:
+        query_database('update', update_corrections_version.replace('?repo', f':{repo}')
+                       .replace('?new_version', str(uuid.uuid4())))
+
+
+def nouns_preload(repo: str) -> dict:
+    """
+    Preload the nouns_dictionary with any named entities that are 'Corrections' (created manually or
+    having been encountered in parsing previous narratives into the repository).
+
+    :param repo: String holding the repository name for the narrative graph
+    :return: A dictionary holding the details of any named entities that could be encountered in a
+             narrative - For reuse of the IRI due to co-reference/multiple reference; Keys are the possible
+             texts for the entity and their value is a tuple that is the spaCy NER type and its IRI
+             (the dictionary is a copy, which can be updated by the caller)
+    """
+    if not corrections_cache_enabled:
+        return _load_nouns(repo)
+    version = _get_corrections_version(repo)
+    with _lock:
+        generation = _repo_generations.get(repo, 0)
+        if repo in _repo_nouns and version is not None and _repo_nouns[repo][0] == version:
+            return _repo_nouns[repo][1].copy()
+    nouns_dict = _load_nouns(repo)
+    with _lock:
+        # Not cached if the version is unknown, or if corrections were added or invalidated while loading
+        if version is not None and _repo_generations.get(repo, 0) == generation:
+            _repo_nouns[repo] = version, nouns_dict
+            _repo_generations[repo] = generation + 1
+    return nouns_dict.copy()
+
+
+def _get_new_corrections(repo: str, triples: str) -> list:
+    """
+    Get the corrections defined in Turtle that is added to the repository's default graph.
+
+    :param repo: String holding the repository name
+    :param triples: A string with the Turtle (including the prefixes)
+    :return: An array of the query bindings of the corrections (empty if there are none, or if the cache is
+             not enabled); If the Turtle cannot be parsed, the cached corrections are invalidated
+    """
+    if not corrections_cache_enabled or ':Correction' not in triples:
+        return []
+    try:
+        return query_turtle(triples, query_manual_corrections)
+    except Exception as parse_err:
+        logging.error(f'Error parsing the corrections for {repo}: {str(parse_err)}')
+        invalidate_corrections(repo)
+        return []
+
+
+def _update_cached_corrections(repo: str, corr_bindings: list, version: dict, new_version: str, updated: bool):
+    """
+    Add new corrections to the cached corrections of a repository.
+
+    :param repo: String holding the repository name
+    :param corr_bindings: An array of the query bindings of the corrections
+    :param version: Dictionary holding the corrections versions before the update (see _get_corrections_version)
+    :param new_version: String holding the repository's new corrections version
+    :param updated: Boolean indicating that the corrections and the new version were added to the database
+    :return: None
+    """
+    with _lock:
+        _repo_generations[repo] = _repo_generations.get(repo, 0) + 1
+        # The cached details are updated only if they were current before the update
+        if repo not in _repo_nouns or version is None or _repo_nouns[repo][0] != version or not updated:
+            _repo_nouns.pop(repo, None)
+            return
+        nouns_dict = _repo_nouns[repo][1]
+        _update_nouns(corr_bindings, nouns_dict)
+        _repo_nouns[repo] = {**version, f'{dna_prefix}{repo}': new_version}, nouns_dict
+
+
+def flush_with_corrections(repo: str, write_buffer: WriteBuffer) -> str:
+    """
+    Flush a WriteBuffer, updating the repository's corrections version in the same transaction if new
+    corrections are added to the repository's default graph (so that other processes reload their cached
+    corrections exactly when the corrections are added), and add the new corrections to the cached corrections.
+
+    :param repo: String holding the repository name
+    :param write_buffer: The WriteBuffer holding the Turtle to be added
+    :return: An empty string if successful, or the error details if not (see WriteBuffer's flush)
+    """
+    corr_bindings = _get_new_corrections(repo, write_buffer.get_triples(repo))
+    if not corr_bindings:
+        return write_buffer.flush()
+    version = _get_corrections_version(repo)
+    new_version = str(uuid.uuid4())
+    write_buffer.add_update(update_corrections_version.replace('?repo', f':{repo}')
+                            .replace('?new_version', new_version))
+    msg = write_buffer.flush()
+    _update_cached_corrections(repo, corr_bindings, version, new_version, not msg)
+    return msg
+
+
+def record_corrections(repo: str, triples: str):
+    """
+    Add the corrections defined in Turtle that was added to the repository's default graph to the
+    cached corrections, and update the repository's corrections version (so that other processes reload
+    their cached corrections). The version is updated after the Turtle was added (use flush_with_corrections
+    to update it in the same transaction), and so is best-effort - If the update fails, the repository's
+    cached corrections are invalidated, but other processes are not notified.
+
+    :param repo: String holding the repository name
+    :param triples: A string with the Turtle (including the prefixes) that was added
+    :return: None
+    """
+    corr_bindings = _get_new_corrections(repo, triples)
+    if not corr_bindings:
+        return
+    version = _get_corrections_version(repo)
+    new_version = str(uuid.uuid4())
+    update_results = query_database('update', update_corrections_version.replace('?repo', f':{repo}')
+                                    .replace('?new_version', new_version))
+    _update_cached_corrections(repo, corr_bindings, version, new_version, update_results == ['successful'])
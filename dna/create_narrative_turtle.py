@@ -3,23 +3,26 @@
 #    and the text is analyzed using OpenAI
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
 import openai
 import os
 import re
+import threading
 import traceback
 from typing import List
 
-from dna.database import query_database
-from dna.database_queries import query_corrections, query_manual_corrections
-from dna.process_sentences import EventsAndNouns, get_sentence_details, situation_semantics_processing
+from dna.corrections_cache import nouns_preload
+from dna.database import WriteBuffer
+from dna.process_entities import prefetch_entities
+from dna.process_sentences import EventsAndNouns, get_sentence_details, get_sentence_prompt_futures, \
+    situation_semantics_processing
 from dna.prompting_ontology_details import event_categories, political_event_categories, event_category_texts, \
     political_event_category_texts, political_event_category_replacements, noun_categories, noun_category_texts
 from dna.sentence_classes import Sentence, Punctuation
-from dna.utilities_and_language_specific import empty_string, literal, ner_dict, personal_pronouns, space, \
-    ttl_prefixes, underscore
-from dna.query_openai import access_api, narrative_chronology_prompt
+from dna.utilities_and_language_specific import literal, personal_pronouns, space, ttl_prefixes, underscore
+from dna.query_openai import access_api, narrative_chronology_prompt, openai_max_workers
 
 
 @dataclass
@@ -32,41 +35,9 @@ class GraphResults:
     turtle: list               # List of the Turtle statements encoding the narrative (if successful)
 
 
-def _update_nouns(bindings: list, nouns_dictionary: dict):
-    """
-    Iterate through the query bindings and add the results to the nouns_dictionary.
-
-    :param bindings: An array of query result bindings
-    :param nouns_dictionary: A dictionary holding the details of any named entities that could be
-             encountered in a narrative - For reuse of the IRI due to co-reference/multiple reference;
-             Keys are the possible texts for the entity and their value is a tuple that is the spaCy
-             NER type and its IRI
-    :return: None (nouns_dictionary is updated)
-    """
-    for binding_set in bindings:
-        entity_iri = f":{binding_set['s']['value'].split(':')[-1]}"
-        entity_type = f"{binding_set['type']['value'].split(':')[-1]}"
-        if entity_type == 'Correction':
-            continue
-        entity_ner = empty_string
-        for key, value in ner_dict.items():
-            if key == 'NORP':
-                for class_type in (':Ethnicity', ':ReligiousGroup', ':PoliticalGroup',
-                                   ':PoliticalIdeology', ':ReligiousBelief', ':GroupOfAgents'):
-                    if class_type == f':{entity_type}':
-                        entity_ner = class_type
-                        break
-            elif value == f':{entity_type}':   # TODO: (Future) Address class hierarchies such as GovEntity->OrgEntity
-                entity_ner = key
-                break
-        if not entity_ner:
-            continue
-        nouns_dictionary[binding_set['label']['value']] = entity_ner, entity_iri
-    return
-
-
 def create_graph(sentence_instance_list: list, quotation_instance_list: list, narr: str, narr_id: str,
-                 subject_areas: list, number_sentences: int, repo: str) -> GraphResults:
+                 subject_areas: list, number_sentences: int, repo: str,
+                 write_buffer: WriteBuffer = None, nouns_dictionary: dict = None) -> GraphResults:
     """
     Based on the sentences and quotations, create the Turtle rendering of the details.
 
@@ -78,6 +49,10 @@ def create_graph(sentence_instance_list: list, quotation_instance_list: list, na
     :param number_sentences: An integer indicating the number of sentences to fully ingest (a number
             greater than 1; by default up to 10 sentences are ingested)
     :param repo: String holding the repository name for the narrative graph
+    :param write_buffer: An optional WriteBuffer collecting the new entities' Turtle (for the repository's
+            default graph), to be added in the same transaction as the narrative graph
+    :param nouns_dictionary: An optional dictionary of the named entities known for the repository (for ex,
+            from prefetch_narrative_entities); If not specified, the dictionary is created using nouns_preload
     :return: Instance of the GraphResults dataclass
     """
     logging.info(f'Creating narrative Turtle')
@@ -85,7 +60,18 @@ def create_graph(sentence_instance_list: list, quotation_instance_list: list, na
     # A dictionary holding the named entities encountered in the text - For reuse of the IRIs
     #    due to co-reference/multiple reference
     # Keys = the texts and Values = entity's spaCy NER type and its IRI
-    nouns_dictionary = nouns_preload(repo)
+    nouns_dictionary = nouns_preload(repo) if nouns_dictionary is None else nouns_dictionary
+    # The narrative chronology and sentence/quotation-level prompts are independent of the nouns_dictionary,
+    #    and are sent concurrently (the latter in batches); Their results are processed below in sentence offset
+    #    order, so that the updates to the nouns_dictionary are the same as in sequential processing
+    executor = ThreadPoolExecutor(max_workers=openai_max_workers)
+    chronology_future = executor.submit(access_api, narrative_chronology_prompt.replace("{narr_text}", narr))
+    prompt_futures = get_sentence_prompt_futures(
+        [sentence_instance.text for sentence_instance in sentence_instance_list] +
+        [quote.text for quote in quotation_instance_list], executor)
+    sentence_futures = prompt_futures[:len(sentence_instance_list)]
+    quote_futures = prompt_futures[len(sentence_instance_list):]
+    executor.shutdown(wait=False)    # Submitted prompts are still processed
     for index, sentence_instance in enumerate(sentence_instance_list):
         sentence_iri = sentence_instance.iri
         original_text = sentence_instance.text
@@ -99,7 +85,8 @@ def create_graph(sentence_instance_list: list, quotation_instance_list: list, na
         #     elif punctuation == Punctuation.EXCLAMATION:
         #         sentence_ttl_list.append(f'{sentence_iri} a :ExpressiveAndExclamation .')
         try:
-            get_sentence_details(sentence_instance, sentence_ttl_list,'sentence', nouns_dictionary, repo)
+            get_sentence_details(sentence_instance, sentence_ttl_list, 'sentence', nouns_dictionary, repo,
+                                 write_buffer, sentence_futures[index])
             graph_ttl_list.extend(sentence_ttl_list)
         except Exception as e:
             logging.error(f'Exception ({str(e)}) in getting sentence details for the text, {original_text}')
@@ -107,7 +94,7 @@ def create_graph(sentence_instance_list: list, quotation_instance_list: list, na
             continue
         # if index < number_sentences:    # TODO: Full processing only up to the requested number of sentences
     # Get the events/situations from the narrative
-    chronology_dict = access_api(narrative_chronology_prompt.replace("{narr_text}", narr))
+    chronology_dict = chronology_future.result()
     if 'events_situations' in chronology_dict:
         # Get the event categories given the article's subject_areas
         # TODO: Generalize for all subject areas
@@ -134,33 +121,34 @@ def create_graph(sentence_instance_list: list, quotation_instance_list: list, na
             print(traceback.format_exc())
     logging.info(f'Narrative Turtle created')
     # Add the quotation details to the Turtle
-    for quote in quotation_instance_list:
+    for index, quote in enumerate(quotation_instance_list):
         quote_ttl_list = [f'{quote.iri} a :Quote ; :text {literal(quote.text)} .']
         try:
-            get_sentence_details(quote, quote_ttl_list, 'quote', nouns_dictionary, repo)
+            get_sentence_details(quote, quote_ttl_list, 'quote', nouns_dictionary, repo, write_buffer,
+                                 quote_futures[index])
             graph_ttl_list.extend(quote_ttl_list)
         except Exception as e:    # Triples not added for quote
-            logging.error(f'Exception ({str(e)}) in getting quote details for the text, {quotation.text}')
+            logging.error(f'Exception ({str(e)}) in getting quote details for the text, {quote.text}')
             print(traceback.format_exc())
             continue
     return GraphResults(True, len(sentence_instance_list), graph_ttl_list)
 
 
-def nouns_preload(repo: str) -> dict:
+def prefetch_narrative_entities(sentence_instance_list: list, quotation_instance_list: list, repo: str,
+                                cancelled: threading.Event = None) -> dict:
     """
-    Preload the nouns_dictionary with any named entities that are 'Corrections' (created manually or
-    having been encountered in parsing previous narratives into the repository).
+    Preload the nouns_dictionary for the repository, and prefetch the external details (from GeoNames,
+    Wikipedia, Wikidata and OpenAI) of the new named entities in all the sentences and quotations of
+    a narrative, so that the details are cached before the narrative Turtle is created.
 
+    :param sentence_instance_list: An array of Sentence Class instances extracted from a narrative
+    :param quotation_instance_list: An array of Quotation Class instances extracted from a narrative
     :param repo: String holding the repository name for the narrative graph
-    :return: A dictionary holding the details of any named entities that could be encountered in a
-             narrative - For reuse of the IRI due to co-reference/multiple reference; Keys are the possible
-             texts for the entity and their value is a tuple that is the spaCy NER type and its IRI
+    :param cancelled: An optional Event which is set if the details are no longer needed (the entities whose
+                      requests were not yet sent are then skipped)
+    :return: The nouns_dictionary from nouns_preload (which is passed to create_graph)
     """
-    nouns_dict = dict()
-    # Manually created corrections are stored in the default db graph
-    corr_bindings = query_database('select', query_manual_corrections)
-    _update_nouns(corr_bindings, nouns_dict)
-    # Corrections recorded by previous parses in the repository's default graph
-    corr_bindings = query_database('select', query_corrections.replace('?named', f':{repo}_default'))
-    _update_nouns(corr_bindings, nouns_dict)
+    nouns_dict = nouns_preload(repo)
+    prefetch_entities([(instance.text, instance.entities)
+                       for instance in sentence_instance_list + quotation_instance_list], nouns_dict, cancelled)
     return nouns_dict
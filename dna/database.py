@@ -4,10 +4,16 @@
 #   3) add/remove specific data from a database
 #   4) query or update a database
 #   5) 'construct' the triples in a graph
+#   6) batch the triples for a narrative and add them in a single transaction (WriteBuffer)
+#   7) query Turtle that is parsed locally
+# All Connections are obtained from (and returned to) a module-level, thread-safe pool
 
+from contextlib import contextmanager
 from datetime import datetime
 import logging
 import os
+import threading
+import time
 from rdflib import Graph, Namespace
 import stardog
 from stardog import Connection
@@ -27,6 +33,256 @@ sd_conn_details = {'endpoint': os.environ.get('STARDOG_ENDPOINT'),
 
 full_owl_thing = 'http://www.w3.org/2002/07/owl#Thing'
 
+# Connection pool settings (environment variables are optional)
+pool_size = int(os.environ.get('STARDOG_POOL_SIZE', '8'))                    # Max connections in use at once
+pool_idle_timeout = float(os.environ.get('STARDOG_POOL_IDLE_SECONDS', '300'))  # Idle connections are then closed
+pool_wait_timeout = float(os.environ.get('STARDOG_POOL_WAIT_SECONDS', '60'))   # Max wait for a free connection
+pool_health_interval = float(os.environ.get('STARDOG_POOL_HEALTH_SECONDS', '30'))  # Time between server checks
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of Stardog Connections to the dna_db database, shared by the Flask app and batch tooling.
+    Idle connections are reused (most recently used first) and closed after pool_idle_timeout seconds. The
+    server is validated (using check_server_status) when a connection is created, or when a connection
+    is reused after the health check interval has elapsed.
+    """
+
+    def __init__(self, size: int = pool_size, idle_timeout: float = pool_idle_timeout,
+                 wait_timeout: float = pool_wait_timeout, health_interval: float = pool_health_interval):
+        self.size = max(size, 1)
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.health_interval = health_interval
+        self._idle = []                     # Array of tuples, (connection, time returned to the pool)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._last_health_check = 0.0
+        self.created = 0                    # Statistics on pool usage
+        self.reused = 0
+        self.evicted = 0
+
+    def _close(self, conn: Connection):
+        try:
+            conn.close()
+        except Exception as close_err:
+            logging.info(f'Exception closing pooled connection: {str(close_err)}')
+
+    def _evict_idle(self) -> list:
+        """
+        Remove the idle connections that have exceeded the idle_timeout. Must be called holding the lock.
+
+        :return: An array of the connections that should be closed
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [conn for conn, returned in self._idle if returned < cutoff]
+        self._idle = [(conn, returned) for conn, returned in self._idle if returned >= cutoff]
+        self.evicted += len(expired)
+        return expired
+
+    def _server_is_healthy(self, force: bool) -> bool:
+        now = time.monotonic()
+        if not force and now - self._last_health_check < self.health_interval:
+            return True
+        healthy = check_server_status()
+        if healthy:
+            self._last_health_check = now
+        return healthy
+
+    def acquire(self) -> Connection:
+        """
+        Get a connection from the pool, creating one if no idle connection is available.
+
+        :return: A Stardog Connection (which must be returned to the pool using release)
+        """
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise TimeoutError(f'No database connection available after {self.wait_timeout} seconds')
+        try:
+            with self._lock:
+                expired = self._evict_idle()
+                conn = self._idle.pop()[0] if self._idle else None
+            for expired_conn in expired:
+                self._close(expired_conn)
+            if not self._server_is_healthy(force=conn is None):
+                if conn:
+                    self._close(conn)
+                self.clear()
+                raise ConnectionError('Database server is not available')
+            if conn:
+                self.reused += 1
+                return conn
+            conn = stardog.Connection(dna_db, **sd_conn_details)
+            self.created += 1
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn: Connection, discard: bool = False):
+        """
+        Return a connection to the pool. Any open transaction is rolled back.
+
+        :param conn: The Stardog Connection obtained using acquire
+        :param discard: Boolean indicating that the connection should be closed and not reused
+        :return: None
+        """
+        try:
+            if conn.transaction:
+                try:
+                    conn.rollback()
+                except Exception as rollback_err:
+                    logging.info(f'Exception rolling back pooled connection: {str(rollback_err)}')
+                    discard = True
+            if discard:
+                self._close(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def clear(self):
+        """
+        Close all idle connections (for ex, when the server is unavailable or at shutdown).
+
+        :return: None
+        """
+        with self._lock:
+            idle = [conn for conn, returned in self._idle]
+            self._idle = []
+        for conn in idle:
+            self._close(conn)
+
+    def idle_count(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager providing a pooled connection. If an exception occurs, the connection is discarded.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+
+connection_pool = ConnectionPool()
+
+
+class WriteBuffer:
+    """
+    Unit of work collecting the Turtle to be added to one or more graphs (for ex, the entities for the
+    {repo}_default graph and the narrative's {repo}_{graph_uuid} graph), and any SPARQL updates that must be
+    made with them. All the Turtle is added (and then the updates are executed) in a single transaction when
+    the buffer is flushed; If the flush fails, the transaction is rolled back.
+    If the buffer is never flushed (for ex, due to an ingest error), nothing is written.
+    """
+
+    def __init__(self):
+        self._graphs = dict()    # Keys = graph URIs (empty string for the db's default graph), values = Turtle
+        self._updates = []
+        self._lock = threading.Lock()
+
+    def add(self, triples: str, repo: str, graph: str = empty_string):
+        """
+        Buffer triples for the specified repository and graph (using the same graph naming as add_remove_data).
+
+        :param triples: A string with the triples to be inserted
+        :param repo: The repository name
+        :param graph: An optional ID indicating that triples for a specific narrative/article are added
+        :return: None
+        """
+        graph_uri = _get_graph_uri(repo, graph)
+        with self._lock:
+            if graph_uri not in self._graphs:
+                self._graphs[graph_uri] = []
+            self._graphs[graph_uri].append(triples)
+
+    def add_update(self, update: str):
+        """
+        Buffer a SPARQL update, which is executed (after the triples are added) when the buffer is flushed.
+
+        :param update: A string with the SPARQL update
+        :return: None
+        """
+        with self._lock:
+            self._updates.append(update)
+
+    def get_triples(self, repo: str, graph: str = empty_string) -> str:
+        """
+        Get the buffered triples for the specified repository and graph.
+
+        :param repo: The repository name
+        :param graph: An optional ID indicating the graph of a specific narrative/article
+        :return: A string with the buffered Turtle (empty if no triples are buffered for the graph)
+        """
+        with self._lock:
+            return '\n'.join(self._graphs.get(_get_graph_uri(repo, graph), []))
+
+    def discard(self):
+        """
+        Remove all buffered triples and updates without writing them.
+
+        :return: None
+        """
+        with self._lock:
+            self._graphs = dict()
+            self._updates = []
+
+    def flush(self) -> str:
+        """
+        Add all the buffered triples to Stardog and execute the buffered updates in a single transaction.
+        The buffer is emptied if successful.
+
+        :return: An empty string if successful, or the error details if not
+        """
+        with self._lock:
+            graphs = {graph_uri: '\n'.join(turtle) for graph_uri, turtle in self._graphs.items()}
+            updates = self._updates[:]
+        if not graphs and not updates:
+            return empty_string
+        try:
+            with connection_pool.connection() as flush_conn:
+                flush_conn.begin()
+                try:
+                    for graph_uri, triples in graphs.items():
+                        if graph_uri:
+                            flush_conn.add(stardog.content.Raw(triples.encode('utf-8'), text_turtle),
+                                           graph_uri=graph_uri)
+                        else:
+                            flush_conn.add(stardog.content.Raw(triples.encode('utf-8'), text_turtle))
+                    for update in updates:
+                        flush_conn.update(update)
+                    flush_conn.commit()
+                except Exception:
+                    flush_conn.rollback()
+                    raise
+            self.discard()
+            return empty_string
+        except Exception as flush_err:
+            curr_error = f'Database (batched add) exception for graphs, {", ".join(graphs.keys())}: {str(flush_err)}'
+            logging.error(curr_error)
+            return curr_error
+
+
+def _get_graph_uri(repo: str, graph: str) -> str:
+    """
+    Get the URI of the graph holding a repository's triples, or a narrative's triples.
+
+    :param repo: The repository name (if empty, the db's default graph is used)
+    :param graph: An optional ID indicating a specific narrative/article graph
+    :return: String holding the graph URI, or an empty string for the db's default graph
+    """
+    if not repo:
+        return empty_string
+    return f'{dna_prefix}{repo}_{graph}' if graph else f'{dna_prefix}{repo}_default'
+
 
 def add_remove_data(op_type: str, triples: str, repo: str, graph: str = empty_string) -> str:
     """
@@ -41,30 +297,30 @@ def add_remove_data(op_type: str, triples: str, repo: str, graph: str = empty_st
     if op_type != 'add' and op_type != 'remove':
         return "Invalid op_type"
     try:
-        ar_conn: Connection = stardog.Connection(dna_db, **sd_conn_details)
-        ar_conn.begin()
-        if op_type == 'add':
-            # Remove unnecessary escaping for single quotes
-            # Add to the database
-            if not repo:
-                ar_conn.add(stardog.content.Raw(triples.encode('utf-8'), text_turtle))
-            elif graph:
-                ar_conn.add(stardog.content.Raw(triples.encode('utf-8'), text_turtle),
-                            graph_uri=f'{dna_prefix}{repo}_{graph}')
+        with connection_pool.connection() as ar_conn:
+            ar_conn.begin()
+            if op_type == 'add':
+                # Remove unnecessary escaping for single quotes
+                # Add to the database
+                if not repo:
+                    ar_conn.add(stardog.content.Raw(triples.encode('utf-8'), text_turtle))
+                elif graph:
+                    ar_conn.add(stardog.content.Raw(triples.encode('utf-8'), text_turtle),
+                                graph_uri=f'{dna_prefix}{repo}_{graph}')
+                else:
+                    ar_conn.add(stardog.content.Raw(triples.encode('utf-8'), text_turtle),
+                                graph_uri=f'{dna_prefix}{repo}_default')
             else:
-                ar_conn.add(stardog.content.Raw(triples.encode('utf-8'), text_turtle),
-                            graph_uri=f'{dna_prefix}{repo}_default')
-        else:
-            # Remove from the database
-            if not repo:
-                ar_conn.remove(stardog.content.Raw(triples.encode('utf-8'), text_turtle))
-            elif graph:
-                ar_conn.remove(stardog.content.Raw(triples.encode('utf-8'), text_turtle),
-                               graph_uri=f'{dna_prefix}{repo}_{graph}')
-            else:
-                ar_conn.remove(stardog.content.Raw(triples.encode('utf-8'), text_turtle),
-                               graph_uri=f'{dna_prefix}{repo}_default')
-        ar_conn.commit()
+                # Remove from the database
+                if not repo:
+                    ar_conn.remove(stardog.content.Raw(triples.encode('utf-8'), text_turtle))
+                elif graph:
+                    ar_conn.remove(stardog.content.Raw(triples.encode('utf-8'), text_turtle),
+                                   graph_uri=f'{dna_prefix}{repo}_{graph}')
+                else:
+                    ar_conn.remove(stardog.content.Raw(triples.encode('utf-8'), text_turtle),
+                                   graph_uri=f'{dna_prefix}{repo}_default')
+            ar_conn.commit()
         return empty_string
     except Exception as add_rem_err:
         curr_error = f'Database ({op_type}) exception: {str(add_rem_err)}, turtle: {triples}'
@@ -96,13 +352,13 @@ def clear_data(repo: str, graph: str = empty_string) -> str:
     :return: An empty string if successful, or the error details if not
     """
     try:
-        clear_conn = stardog.Connection(dna_db, **sd_conn_details)
-        clear_conn.begin()
-        if graph:
-            clear_conn.clear(f'{dna_prefix}{repo}_{graph}')
-        else:
-            clear_conn.clear(f'{dna_prefix}{repo}_default')
-        clear_conn.commit()
+        with connection_pool.connection() as clear_conn:
+            clear_conn.begin()
+            if graph:
+                clear_conn.clear(f'{dna_prefix}{repo}_{graph}')
+            else:
+                clear_conn.clear(f'{dna_prefix}{repo}_default')
+            clear_conn.commit()
         return empty_string
     except Exception as clear_err:
         if graph:
@@ -122,8 +378,8 @@ def construct_graph(construct: str) -> (bool, list):
     """
     rdf_graph = Graph()
     try:
-        const_conn = stardog.Connection(dna_db, **sd_conn_details)
-        construct_results = const_conn.graph(construct, content_type='text/turtle')
+        with connection_pool.connection() as const_conn:
+            construct_results = const_conn.graph(construct, content_type='text/turtle')
         turtle_details = rdf_graph.parse(format='text/turtle', data=construct_results)
         turtle_details.bind('dna', DNA)
         turtle_details.bind('owl', OWL)
@@ -180,6 +436,19 @@ def create_delete_database(op_type: str, database: str) -> str:
         return curr_error
 
 
+def parse_turtle(triples: str) -> (str, int):
+    """
+    Parse Turtle locally, removing any duplicate triples, and count the (distinct) triples.
+
+    :param triples: A string with the Turtle to be parsed
+    :return: A tuple holding the de-duplicated triples (serialized as N-Triples, which is also valid Turtle)
+             and the number of triples; An exception is raised if the Turtle is invalid
+    """
+    rdf_graph = Graph()
+    rdf_graph.parse(data=triples, format='turtle')
+    return rdf_graph.serialize(format='nt'), len(rdf_graph)
+
+
 def query_database(query_type: str, query: str) -> list:
     """
     Process a SELECT or UPDATE query
@@ -192,10 +461,10 @@ def query_database(query_type: str, query: str) -> list:
         logging.error(f'Invalid query_type {query_type} for query_db')
         return []
     try:
-        query_conn = stardog.Connection(dna_db, **sd_conn_details)
         if query_type == 'select':
             # Select query, which will return results, if successful
-            query_results = query_conn.select(query, content_type='application/sparql-results+json')
+            with connection_pool.connection() as query_conn:
+                query_results = query_conn.select(query, content_type='application/sparql-results+json')
             # noinspection PyTypeChecker
             if 'results' in query_results and 'bindings' in query_results['results']:
                 # noinspection PyTypeChecker
@@ -204,9 +473,28 @@ def query_database(query_type: str, query: str) -> list:
                 return []
         else:
             # Update query; No results (either success or failure)
-            query_conn.update(query)
+            with connection_pool.connection() as query_conn:
+                query_conn.update(query)
             return ['successful']
     except Exception as query_err:
         curr_error = f'Query exception for {query}: {str(query_err)}'
         logging.error(curr_error)
         return [curr_error]
+
+
+def query_turtle(triples: str, query: str) -> list:
+    """
+    Process a SELECT query against Turtle parsed locally (for ex, Turtle that was just added to the database).
+
+    :param triples: A string with the Turtle to be queried
+    :param query: The text of a SPARQL query
+    :return: The bindings array from the query results, in the same format as query_database (dictionaries
+             keyed by the variable name, whose values are dictionaries with a 'value' key); Unbound variables
+             are not included
+    """
+    rdf_graph = Graph()
+    rdf_graph.parse(data=triples, format='turtle')
+    bindings = []
+    for row in rdf_graph.query(query):
+        bindings.append({str(var): {'value': str(value)} for var, value in row.asdict().items()})
+    return bindings
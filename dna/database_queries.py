@@ -15,8 +15,9 @@ delete_narrative = 'prefix : <urn:ontoinsights:dna:> WITH ?named ' \
                    'WHERE {:narr_id ?graph_p ?graph_o . :Narrative_narr_id ?narr_p ?narr_o}'
 
 delete_repo_metadata = 'prefix : <urn:ontoinsights:dna:> prefix dc: <http://purl.org/dc/terms/> ' \
-                       'DELETE {?repo a :Database ; dc:created ?created} ' \
-                       'WHERE {?repo a :Database ; dc:created ?created}'
+                       'DELETE {?repo a :Database ; dc:created ?created ; :corrections_version ?version} ' \
+                       'WHERE {?repo a :Database ; dc:created ?created ' \
+                       'OPTIONAL {?repo :corrections_version ?version}}'
 
 query_background = 'prefix : <urn:ontoinsights:dna:> SELECT ?name ?type ?plural WHERE { GRAPH ?named { ' \
                    '?s a :Background; :text ?name . OPTIONAL {?s a :Collection. BIND(true as ?plural)} ' \
@@ -28,6 +29,10 @@ query_background = 'prefix : <urn:ontoinsights:dna:> SELECT ?name ?type ?plural
 query_corrections = \
     'prefix : <urn:ontoinsights:dna:> SELECT * WHERE { GRAPH ?named {?s a :Correction; a ?type ; rdfs:label ?label}}'
 
+query_corrections_version = \
+    'prefix : <urn:ontoinsights:dna:> SELECT ?s ?version WHERE ' \
+    '{VALUES ?s {?repo :ManualCorrections} ?s :corrections_version ?version}'
+
 query_manual_corrections = \
     'prefix : <urn:ontoinsights:dna:> SELECT * WHERE {?s a :Correction; a ?type ; rdfs:label ?label}'
 
@@ -43,6 +48,10 @@ query_repos = 'prefix : <urn:ontoinsights:dna:> prefix dc: <http://purl.org/dc/t
 query_repo_graphs = 'prefix : <urn:ontoinsights:dna:> prefix dc: <http://purl.org/dc/terms/> ' \
                    'SELECT distinct ?g WHERE { GRAPH ?g {?s ?p ?o} FILTER (CONTAINS(str(?g), "?repo")) }'
 
+update_corrections_version = \
+    'prefix : <urn:ontoinsights:dna:> DELETE {?repo :corrections_version ?old} ' \
+    'INSERT {?repo :corrections_version "?new_version"} WHERE {OPTIONAL {?repo :corrections_version ?old}}'
+
 update_narrative = \
     'prefix : <urn:ontoinsights:dna:> prefix dc: <http://purl.org/dc/terms/> WITH ?g ' \
     'DELETE {?s :number_triples ?numbTriples} WHERE {' \
@@ -0,0 +1,240 @@
+# Detection of duplicate and near-duplicate narratives (for ex, the same wire story published by several outlets)
+#    before they are ingested, using MinHash signatures of the normalized word shingles of each narrative and a
+#    locality-sensitive hashing (LSH) index per repository, stored in a SQLite database in the cache directory
+#    Exact duplicates (of a narrative in the repository) are not ingested; Near-duplicates are ingested, where the
+#    sentence-level prompt results of their matching sentences are reused from the sentence cache (see
+#    process_sentences' sentence_cache) so that only the differing sentences are sent to OpenAI
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import struct
+import threading
+from array import array
+from typing import Union
+
+from dna.response_cache import cache_dir
+
+dedup_enabled = os.environ.get('DEDUP', 'on').lower() != 'off'
+near_duplicate_threshold = float(os.environ.get('DEDUP_THRESHOLD', 0.8))   # Estimated Jaccard similarity
+dedup_file = 'dedup.sqlite'
+
+shingle_size = 5          # Number of words in a shingle
+number_permutations = 64
+number_bands = 8          # LSH bands of number_permutations / number_bands rows; Candidates are found if they share
+                          #    a band, which is likely for similarities above approx (1 / bands) ** (1 / rows) = 0.77
+mersenne_prime = (1 << 61) - 1
+max_hash = (1 << 32) - 1
+
+create_tables = [
+    'CREATE TABLE IF NOT EXISTS fingerprints (repository TEXT NOT NULL, narrative_id TEXT NOT NULL, '
+    'content_hash TEXT NOT NULL, signature BLOB NOT NULL, PRIMARY KEY (repository, narrative_id))',
+    'CREATE INDEX IF NOT EXISTS fingerprints_hash ON fingerprints (repository, content_hash)',
+    'CREATE TABLE IF NOT EXISTS bands (repository TEXT NOT NULL, band INTEGER NOT NULL, bucket TEXT NOT NULL, '
+    'narrative_id TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS bands_bucket ON bands (repository, band, bucket)']
+
+
+def _get_permutations() -> list:
+    # Deterministic coefficients of the hash functions, (a * x + b) mod mersenne_prime, simulating permutations
+    coefficients = []
+    for index in range(number_permutations):
+        digest = hashlib.sha256(f'dna-minhash-{index}'.encode('utf-8')).digest()
+        a, b = struct.unpack('<QQ', digest[:16])
+        coefficients.append((a % (mersenne_prime - 1) + 1, b % mersenne_prime))
+    return coefficients
+
+
+permutations = _get_permutations()
+
+
+class NarrativeFingerprint:
+    """
+    The content hash (of the normalized text) and MinHash signature of a narrative.
+    """
+
+    def __init__(self, narr_text: str):
+        """
+        :param narr_text: String holding the narrative text
+        """
+        words = normalize_text(narr_text).split()
+        self.content_hash = hashlib.sha256(' '.join(words).encode('utf-8')).hexdigest()
+        shingles = {' '.join(words[i:i + shingle_size]) for i in range(max(len(words) - shingle_size + 1, 1))}
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little')
+                  for shingle in shingles]
+        self.signature = array('I', [min(((a * value + b) % mersenne_prime) & max_hash for value in hashes)
+                                     if hashes else max_hash for a, b in permutations])
+
+    def get_buckets(self) -> list:
+        """
+        :return: Array of strings identifying the LSH bucket of each band of the signature
+        """
+        rows = number_permutations // number_bands
+        return [hashlib.sha1(self.signature[band * rows:(band + 1) * rows].tobytes()).hexdigest()
+                for band in range(number_bands)]
+
+    def get_similarity(self, signature: array) -> float:
+        """
+        :param signature: The MinHash signature of another narrative
+        :return: The estimated Jaccard similarity of the narratives' shingles
+        """
+        return sum(1 for value, other in zip(self.signature, signature) if value == other) / number_permutations
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text for fingerprinting, ignoring case, punctuation and whitespace differences.
+
+    :param text: String holding the text
+    :return: The normalized text (words separated by a single space)
+    """
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text.casefold()).split())
+
+
+class DedupIndex:
+    """
+    Persistent index of the fingerprints of the narratives in each repository. The index is thread-safe, and
+    errors accessing it are logged and treated as no match, so that ingest continues without deduplication.
+    The contents of the narratives being ingested (by this process) are reserved, so that concurrent
+    duplicates are not ingested before the first narrative is added to the index.
+    """
+
+    def __init__(self, db_path=None):
+        """
+        :param db_path: Path of the SQLite database (by default, dedup.sqlite in the cache_dir)
+        """
+        self.db_path = db_path if db_path else cache_dir / dedup_file
+        self._conn = None
+        self._lock = threading.Lock()
+        self._reserved = dict()     # Keyed by the repository and content hash, with the id of the narrative
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # Must be called holding the lock; The database is created on first use
+        if not self._conn:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            for create_table in create_tables:
+                self._conn.execute(create_table)
+            self._conn.commit()
+        return self._conn
+
+    def find_match(self, repo: str, fingerprint: NarrativeFingerprint) -> (Union[str, None], float, bool):
+        """
+        Find the narrative in the repository that is most similar to a fingerprinted narrative.
+
+        :param repo: String holding the repository name
+        :param fingerprint: The NarrativeFingerprint of the narrative
+        :return: A tuple holding the id of the most similar narrative, its estimated similarity and a boolean
+                 indicating that it is an exact duplicate (its content hash matches), or None, 0.0 and False if
+                 no narrative is above the near_duplicate_threshold; Note that the estimated similarity of a
+                 near-duplicate can be 1.0
+        """
+        try:
+            with self._lock:
+                conn = self._get_connection()
+                row = conn.execute('SELECT narrative_id FROM fingerprints WHERE repository = ? AND content_hash = ?',
+                                   (repo, fingerprint.content_hash)).fetchone()
+                if row:
+                    return row[0], 1.0, True
+                candidates = set()
+                for band, bucket in enumerate(fingerprint.get_buckets()):
+                    candidates.update(narr_id for narr_id, in conn.execute(
+                        'SELECT narrative_id FROM bands WHERE repository = ? AND band = ? AND bucket = ?',
+                        (repo, band, bucket)))
+                best_id, best_similarity = None, 0.0
+                for narr_id in sorted(candidates):
+                    row = conn.execute('SELECT signature FROM fingerprints WHERE repository = ? AND narrative_id = ?',
+                                       (repo, narr_id)).fetchone()
+                    similarity = fingerprint.get_similarity(array('I', row[0])) if row else 0.0
+                    if similarity >= near_duplicate_threshold and similarity > best_similarity:
+                        best_id, best_similarity = narr_id, similarity
+                return best_id, best_similarity, False
+        except sqlite3.Error as sql_err:
+            logging.error(f'Dedup index exception for {repo}: {str(sql_err)}')
+            return None, 0.0, False
+
+    def add(self, repo: str, narr_id: str, fingerprint: NarrativeFingerprint):
+        """
+        Add a narrative's fingerprint to the repository's index.
+
+        :param repo: String holding the repository name
+        :param narr_id: String holding the narrative id
+        :param fingerprint: The NarrativeFingerprint of the narrative
+        :return: None
+        """
+        try:
+            with self._lock:
+                conn = self._get_connection()
+                conn.execute('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)',
+                             (repo, narr_id, fingerprint.content_hash, fingerprint.signature.tobytes()))
+                conn.executemany('INSERT INTO bands VALUES (?, ?, ?, ?)',
+                                 [(repo, band, bucket, narr_id)
+                                  for band, bucket in enumerate(fingerprint.get_buckets())])
+                conn.commit()
+        except sqlite3.Error as sql_err:
+            logging.error(f'Dedup index exception adding {narr_id} to {repo}: {str(sql_err)}')
+
+    def reserve(self, repo: str, fingerprint: NarrativeFingerprint, narr_id: str) -> Union[str, None]:
+        """
+        Reserve the content of a narrative that is being ingested, unless the content is already reserved or the
+        repository has an exact duplicate. The reservation is released (using release) once the narrative is
+        added to the index, or if its ingest fails.
+
+        :param repo: String holding the repository name
+        :param fingerprint: The NarrativeFingerprint of the narrative
+        :param narr_id: String holding the id of the narrative
+        :return: None if the content was reserved, or the id of the narrative being ingested (or in the
+                 repository) with the same content
+        """
+        key = (repo, fingerprint.content_hash)
+        with self._lock:
+            if key in self._reserved:
+                return self._reserved[key]
+            try:
+                row = self._get_connection().execute(
+                    'SELECT narrative_id FROM fingerprints WHERE repository = ? AND content_hash = ?',
+                    (repo, fingerprint.content_hash)).fetchone()
+            except sqlite3.Error as sql_err:
+                logging.error(f'Dedup index exception for {repo}: {str(sql_err)}')
+                row = None
+            if row:
+                return row[0]
+            self._reserved[key] = narr_id
+            return None
+
+    def release(self, repo: str, fingerprint: NarrativeFingerprint):
+        """
+        Release the reservation of a narrative's content.
+
+        :param repo: String holding the repository name
+        :param fingerprint: The NarrativeFingerprint of the narrative
+        :return: None
+        """
+        with self._lock:
+            self._reserved.pop((repo, fingerprint.content_hash), None)
+
+    def remove(self, repo: str, narr_id: str = None):
+        """
+        Remove a narrative (or all the narratives of a repository) from the index.
+
+        :param repo: String holding the repository name
+        :param narr_id: String holding the narrative id; If not specified, the repository's index is removed
+        :return: None
+        """
+        condition, parameters = ('repository = ? AND narrative_id = ?', (repo, narr_id)) if narr_id \
+            else ('repository = ?', (repo,))
+        try:
+            with self._lock:
+                conn = self._get_connection()
+                conn.execute(f'DELETE FROM fingerprints WHERE {condition}', parameters)
+                conn.execute(f'DELETE FROM bands WHERE {condition}', parameters)
+                conn.commit()
+        except sqlite3.Error as sql_err:
+            logging.error(f'Dedup index exception removing {narr_id if narr_id else "all"} from {repo}: '
+                          f'{str(sql_err)}')
+
+
+dedup_index = DedupIndex()
@@ -0,0 +1,99 @@
+# Shared HTTP sessions (one per host) for the requests to external sources, with connection pooling, keep-alive,
+#    default timeouts and (optionally) conditional requests using the ETag/Last-Modified headers of cached responses
+
+import base64
+import os
+import threading
+from typing import Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from dna.response_cache import ResponseCache
+
+http_connect_timeout = float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECONDS', 5))
+http_read_timeout = float(os.environ.get('HTTP_READ_TIMEOUT_SECONDS', 30))
+http_pool_size = int(os.environ.get('HTTP_POOL_SIZE', 16))      # Maximum connections kept alive per host
+# Conditionally requested responses are revalidated when used, and are removed if not accessed within the ttl
+http_cache = ResponseCache('http', ttl=float(os.environ.get('HTTP_CACHE_TTL_SECONDS', 90 * 24 * 60 * 60)),
+                           max_entries=int(os.environ.get('HTTP_CACHE_MAX_ENTRIES', 200000)),
+                           enabled=os.environ.get('HTTP_CACHE', 'on').lower() != 'off')
+
+_sessions = dict()
+_lock = threading.Lock()
+
+
+def _get_cached_response(url: str, cached: dict) -> requests.Response:
+    """
+    Create a response from the cached details of a previous response (after a 304 Not Modified response).
+
+    :param url: String holding the request URL
+    :param cached: Dictionary holding the status code, headers and (base64-encoded) content of the response
+    :return: The response
+    """
+    response = requests.Response()
+    response.url = url
+    response.status_code = cached['status_code']
+    response.headers = CaseInsensitiveDict(cached['headers'])
+    response.encoding = cached['encoding']
+    response._content = base64.b64decode(cached['content'])
+    return response
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Get the shared session for the host of the URL, creating it on first use.
+
+    :param url: String holding the request URL
+    :return: The requests Session for the host
+    """
+    parts = urlsplit(url)
+    host = f'{parts.scheme}://{parts.netloc}'
+    with _lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=http_pool_size)
+            session.mount(f'{host}/', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'    # Decompressed transparently by requests
+            _sessions[host] = session
+        return _sessions[host]
+
+
+def http_get(url: str, headers: dict = None, timeout: Union[float, tuple] = None,
+             conditional: bool = False) -> requests.Response:
+    """
+    Send a GET request using the shared session for the URL's host. Exceptions are raised as for requests.get.
+
+    :param url: String holding the request URL
+    :param headers: Dictionary of the request headers
+    :param timeout: Seconds to wait for the response (or a tuple of the connect and read timeouts); If not
+                    specified, http_connect_timeout and http_read_timeout
+    :param conditional: Boolean indicating that successful responses with an ETag or Last-Modified header are
+                        cached, and revalidated using If-None-Match/If-Modified-Since when requested again
+    :return: The response
+    """
+    timeout = timeout if timeout else (http_connect_timeout, http_read_timeout)
+    request_headers = dict(headers) if headers else dict()
+    cache_key = ResponseCache.make_key(url, headers) if conditional else None
+    cached = None
+    if conditional:
+        found, cached = http_cache.get(cache_key)
+        if found and cached.get('etag'):
+            request_headers['If-None-Match'] = cached['etag']
+        if found and cached.get('last_modified'):
+            request_headers['If-Modified-Since'] = cached['last_modified']
+    response = get_session(url).get(url, headers=request_headers, timeout=timeout)
+    if conditional and response.status_code == 304 and cached:
+        return _get_cached_response(url, cached)
+    if conditional and response.status_code == 200 and \
+            (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+        http_cache.put(cache_key, {'etag': response.headers.get('ETag'),
+                                   'last_modified': response.headers.get('Last-Modified'),
+                                   'status_code': response.status_code,
+                                   'headers': {key: value for key, value in response.headers.items()
+                                               if key.lower() in ('content-type', 'etag', 'last-modified')},
+                                   'encoding': response.encoding,
+                                   'content': base64.b64encode(response.content).decode('ascii')})
+    return response
@@ -0,0 +1,213 @@
+# Asynchronous ingest of narratives, where a /narratives POST (with async=true) queues an ingest job and returns
+#    immediately, and the job's status is retrieved using GET /dna/v1/jobs/<job_id>
+#    Jobs are stored in a SQLite database in the cache directory, so that queued jobs (and jobs that were running
+#    when the process stopped) are processed after a restart. A pool of worker threads processes the jobs in the
+#    order that they were queued, recording the start time of each stage of process_new_narrative.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict
+from datetime import datetime
+from typing import Union
+
+from dna.app_functions import Metadata, process_new_narrative
+from dna.response_cache import cache_dir
+
+ingest_job_workers = int(os.environ.get('INGEST_JOB_WORKERS', 2))
+# Running jobs whose progress was not updated within this time are assumed to be abandoned (for ex, due to a
+#    restart) and are queued again
+ingest_job_stale_seconds = float(os.environ.get('INGEST_JOB_STALE_SECONDS', 60 * 60))
+# Interval to update the progress time of a running job, so that a long processing stage is not seen as abandoned
+ingest_job_heartbeat_seconds = min(60.0, ingest_job_stale_seconds / 4)
+ingest_job_poll_seconds = 5       # Interval to check for jobs queued by other processes
+jobs_file = 'ingest_jobs.sqlite'
+
+create_table = 'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, repository TEXT NOT NULL, ' \
+               'status TEXT NOT NULL, request TEXT NOT NULL, stage TEXT, stages TEXT NOT NULL, result TEXT, ' \
+               'error TEXT, created REAL NOT NULL, started REAL, finished REAL, updated REAL NOT NULL)'
+create_index = 'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)'
+
+_conn = None
+_lock = threading.Lock()
+_queued = threading.Condition(_lock)
+_workers = []
+
+
+def _get_connection() -> sqlite3.Connection:
+    # Must be called holding the lock; The database is created on first use
+    global _conn
+    if not _conn:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(str(cache_dir / jobs_file), timeout=30, check_same_thread=False,
+                                isolation_level=None)
+        _conn.execute('PRAGMA journal_mode=WAL')
+        _conn.execute(create_table)
+        _conn.execute(create_index)
+    return _conn
+
+
+def _format_time(timestamp: float) -> Union[str, None]:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%S") if timestamp else None
+
+
+def _claim_job() -> Union[tuple, None]:
+    """
+    Get the oldest queued job (or abandoned running job), and mark it as running.
+
+    :return: A tuple holding the job id, repository and request details, or None if no job is queued
+    """
+    now = time.time()
+    with _lock:
+        conn = _get_connection()
+        conn.execute('BEGIN IMMEDIATE')     # Claim is atomic across processes
+        try:
+            row = conn.execute('SELECT id, repository, request FROM jobs WHERE status = ? OR '
+                               '(status = ? AND updated < ?) ORDER BY created LIMIT 1',
+                               ('queued', 'running', now - ingest_job_stale_seconds)).fetchone()
+            if row:
+                conn.execute('UPDATE jobs SET status = ?, stage = NULL, stages = ?, started = ?, updated = ? '
+                             'WHERE id = ?', ('running', '[]', now, now, row[0]))
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+    return row
+
+
+def _update_job(job_id: str, **columns):
+    # Updates the columns (if any) and the progress time of a job
+    with _lock:
+        assignments = ''.join(f'{column} = ?, ' for column in columns)
+        _get_connection().execute(f'UPDATE jobs SET {assignments}updated = ? WHERE id = ?',
+                                  (*columns.values(), time.time(), job_id))
+
+
+def _send_heartbeats(job_id: str, finished: threading.Event):
+    # Heartbeat thread for a running job, updating its progress time until the job is finished
+    while not finished.wait(ingest_job_heartbeat_seconds):
+        try:
+            _update_job(job_id)
+        except sqlite3.Error as sql_err:
+            logging.error(f'Ingest job {job_id} heartbeat exception: {str(sql_err)}')
+
+
+def _run_job(job_id: str, repo: str, request: dict):
+    """
+    Ingest the narrative of a job, recording the start of each processing stage and the results.
+
+    :param job_id: String holding the job id
+    :param repo: String holding the repository name
+    :param request: Dictionary holding the narrative's metadata and text
+    :return: None
+    """
+    stages = []
+
+    def record_stage(stage: str):
+        stages.append({'stage': stage, 'started': time.time()})
+        _update_job(job_id, stage=stage, stages=json.dumps(stages))
+
+    finished = threading.Event()
+    threading.Thread(target=_send_heartbeats, args=(job_id, finished), name=f'ingest-job-heartbeat-{job_id}',
+                     daemon=True).start()
+    try:
+        results = process_new_narrative(Metadata(**request['metadata']), request['text'], repo, record_stage)
+        if results.http_status in (200, 201):     # Ingested, or a duplicate that was not ingested
+            _update_job(job_id, status='completed', stage=None, result=json.dumps(results.resp_dict),
+                        finished=time.time())
+        else:
+            _update_job(job_id, status='failed', error=results.error_msg, finished=time.time())
+    except Exception as job_err:
+        logging.error(f'Ingest job {job_id} exception: {str(job_err)}')
+        _update_job(job_id, status='failed', error=str(job_err), finished=time.time())
+    finally:
+        finished.set()
+
+
+def _process_jobs():
+    # Worker thread, processing jobs until the process exits
+    while True:
+        try:
+            job = _claim_job()
+        except sqlite3.Error as sql_err:
+            logging.error(f'Ingest job queue exception: {str(sql_err)}')
+            job = None
+        if job:
+            try:
+                _run_job(job[0], job[1], json.loads(job[2]))
+            except Exception as job_err:     # For ex, the job's status could not be updated; The worker continues
+                logging.error(f'Ingest job {job[0]} exception updating its status: {str(job_err)}')
+            continue
+        with _queued:
+            _queued.wait(ingest_job_poll_seconds)
+
+
+def start_job_workers():
+    """
+    Start the worker threads (if not already started), which process the queued jobs.
+
+    :return: None
+    """
+    if len(_workers) >= ingest_job_workers:     # Already started (checked for each request to the app)
+        return
+    with _lock:
+        while len(_workers) < ingest_job_workers:
+            worker = threading.Thread(target=_process_jobs, name=f'ingest-job-{len(_workers)}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def submit_job(metadata: Metadata, narr: str, repo: str) -> str:
+    """
+    Queue a job to ingest a narrative (using process_new_narrative).
+
+    :param metadata: Instance of the Metadata Class holding the narrative/article details
+    :param narr: String holding the narrative text
+    :param repo: String holding the repository name for the narrative graph
+    :return: String holding the job id
+    """
+    job_id = str(uuid.uuid4())
+    now = time.time()
+    with _lock:
+        _get_connection().execute('INSERT INTO jobs (id, repository, status, request, stages, created, updated) '
+                                  'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  (job_id, repo, 'queued', json.dumps({'metadata': asdict(metadata), 'text': narr}),
+                                   '[]', now, now))
+        _queued.notify()
+    start_job_workers()
+    return job_id
+
+
+def get_job(job_id: str) -> Union[dict, None]:
+    """
+    Get the status of a job.
+
+    :param job_id: String holding the job id
+    :return: Dictionary holding the job id, repository, status ('queued', 'running', 'completed' or 'failed'),
+             current stage, the start time and duration (in seconds) of each stage, the created, started
+             and finished times, and the narrativeDetails (if completed), duplicateOf (if completed without
+             ingesting a duplicate narrative) or error (if failed); None if the job is not found
+    """
+    with _lock:
+        row = _get_connection().execute('SELECT repository, status, stage, stages, result, error, created, '
+                                        'started, finished FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if not row:
+        return None
+    repo, status, stage, stages, result, error, created, started, finished = row
+    stages = json.loads(stages)
+    end_times = [details['started'] for details in stages[1:]] + [finished if finished else time.time()]
+    job = {'jobId': job_id, 'repository': repo, 'status': status, 'stage': stage,
+           'stages': [{'stage': details['stage'], 'started': _format_time(details['started']),
+                       'seconds': round(end_time - details['started'], 2)}
+                      for details, end_time in zip(stages, end_times)],
+           'created': _format_time(created), 'started': _format_time(started), 'finished': _format_time(finished)}
+    if result:
+        result = json.loads(result)
+        job.update({key: result[key] for key in ('narrativeDetails', 'duplicateOf') if key in result})
+    if error:
+        job['error'] = error
+    return job
@@ -0,0 +1,312 @@
+# Local stand-in for the GeoNames, Wikidata and Wikipedia APIs, answering lookups from a SQLite index
+#    The index is built (see build_index) from the GeoNames dump files, a Wikidata JSON dump (or extract) and
+#    a JSON lines file of Wikipedia page summaries, and is used by query_sources when DNA_SOURCE_BACKEND is 'local'
+#    To build the index: python -m dna.local_sources --geonames allCountries.txt ... [--db local_sources.sqlite]
+
+import argparse
+import bz2
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import xml.etree.ElementTree as etree
+from pathlib import Path
+from typing import Union
+
+local_sources_path = Path(os.environ.get('DNA_LOCAL_SOURCES', Path(__file__).resolve().parent.parent /
+                                         'cache' / 'local_sources.sqlite'))
+batch_rows = 10000   # Number of rows inserted in a single executemany call when building the index
+
+# The unique constraints ensure that rebuilding the index (for ex, adding a newer dump) does not duplicate rows
+create_statements = (
+    'CREATE TABLE IF NOT EXISTS geonames (geonameid INTEGER PRIMARY KEY, name TEXT, ascii_name TEXT, '
+    'country_code TEXT, fcl TEXT, fcode TEXT, population INTEGER)',
+    'CREATE TABLE IF NOT EXISTS geonames_names (name_key TEXT, geonameid INTEGER, is_primary INTEGER, '
+    'UNIQUE (name_key, geonameid))',
+    'CREATE TABLE IF NOT EXISTS geonames_alt_names (geonameid INTEGER, lang TEXT, name TEXT, '
+    'UNIQUE (geonameid, lang, name))',
+    'CREATE TABLE IF NOT EXISTS countries (country_code TEXT PRIMARY KEY, country_name TEXT)',
+    'CREATE TABLE IF NOT EXISTS wikipedia (title_key TEXT PRIMARY KEY, summary TEXT)',
+    'CREATE TABLE IF NOT EXISTS wikidata_labels (qid TEXT, label TEXT, UNIQUE (qid, label))',
+    'CREATE TABLE IF NOT EXISTS wikidata_claims (qid TEXT, property TEXT, value TEXT, '
+    'UNIQUE (qid, property, value))')
+insert_statements = {
+    'geonames': 'INSERT OR REPLACE INTO geonames VALUES (?, ?, ?, ?, ?, ?, ?)',
+    # A name that is both the primary and an alternate name of a location is recorded as primary
+    'geonames_names': 'INSERT INTO geonames_names VALUES (?, ?, ?) ON CONFLICT (name_key, geonameid) '
+                      'DO UPDATE SET is_primary = max(is_primary, excluded.is_primary)',
+    'wikidata_labels': 'INSERT OR IGNORE INTO wikidata_labels VALUES (?, ?)',
+    'wikidata_claims': 'INSERT OR IGNORE INTO wikidata_claims VALUES (?, ?, ?)'}
+
+# Wikidata's instance of, subclass of, start time and end time properties
+claim_properties = ('P31', 'P279', 'P580', 'P582')
+# Recursive query for the superclasses of the types (P31) of an item (equivalent to ?item wdt:P31/wdt:P279* ?super)
+superclasses_query = \
+    "WITH RECURSIVE supers(qid) AS (SELECT value FROM wikidata_claims WHERE qid = ? AND property = 'P31' " \
+    "UNION SELECT c.value FROM wikidata_claims c JOIN supers s ON c.qid = s.qid AND c.property = 'P279') " \
+    "SELECT 1 FROM supers WHERE qid = ? LIMIT 1"
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _execute(query: str, parameters: tuple) -> list:
+    """
+    Execute a query against the local index, opening the (read-only) database on first use.
+
+    :param query: String holding the SQL query
+    :param parameters: Tuple of the query parameters
+    :return: Array of the rows returned by the query, or an empty array if the index is not available
+    """
+    global _conn
+    try:
+        with _lock:
+            if not _conn:
+                _conn = sqlite3.connect(f'{local_sources_path.as_uri()}?mode=ro', uri=True, check_same_thread=False)
+            return _conn.execute(query, parameters).fetchall()
+    except sqlite3.Error as sql_err:
+        logging.error(f'Local sources index ({local_sources_path}) exception: {str(sql_err)}')
+        return []
+
+
+def _get_name_key(name: str) -> str:
+    """
+    Normalize a location name or page title for lookup in the index.
+
+    :param name: String holding the name or title
+    :return: The lower-cased name, with underscores and multiple spaces replaced by a single space
+    """
+    return ' '.join(name.replace('_', ' ').split()).casefold()
+
+
+def _open_file(file_name: str):
+    # Open a (possibly compressed) UTF-8 text file
+    if file_name.endswith('.bz2'):
+        return bz2.open(file_name, 'rt', encoding='utf-8')
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, 'rt', encoding='utf-8')
+    return open(file_name, 'r', encoding='utf-8')
+
+
+def _insert_rows(conn: sqlite3.Connection, statement: str, rows):
+    # Insert the rows (from an iterable) in batches
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            conn.executemany(statement, batch)
+            batch = []
+    if batch:
+        conn.executemany(statement, batch)
+
+
+def _insert_table_rows(conn: sqlite3.Connection, table_rows):
+    # Insert the rows (from an iterable of tuples of the table name and row) in batches per table, using the
+    #    table's insert_statements
+    batches = dict()
+    for table, row in table_rows:
+        batch = batches.setdefault(table, [])
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            conn.executemany(insert_statements[table], batch)
+            batch.clear()
+    for table, batch in batches.items():
+        if batch:
+            conn.executemany(insert_statements[table], batch)
+
+
+def _read_country_info(file_name: str):
+    # countryInfo.txt - ISO code is column 0 and the country name is column 4; Comments start with '#'
+    with _open_file(file_name) as country_file:
+        for line in country_file:
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\n').split('\t')
+            yield fields[0], fields[4]
+
+
+def _read_geonames(file_name: str):
+    # allCountries.txt (or a country file) - geonameid, name, asciiname, alternatenames, latitude, longitude,
+    #    feature class, feature code, country code, cc2, admin1-4 codes, population, ...
+    #    Yields the geonames and geonames_names rows
+    with _open_file(file_name) as geonames_file:
+        for line in geonames_file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 15:
+                continue
+            geonameid = int(fields[0])
+            yield 'geonames', (geonameid, fields[1], fields[2], fields[8], fields[6], fields[7],
+                               int(fields[14]) if fields[14].isdigit() else 0)
+            yield 'geonames_names', (_get_name_key(fields[1]), geonameid, 1)
+            for alt_name in {fields[2], *fields[3].split(',')} - {fields[1], ''}:
+                yield 'geonames_names', (_get_name_key(alt_name), geonameid, 0)
+
+
+def _read_alternate_names(file_name: str):
+    # alternateNamesV2.txt - alternateNameId, geonameid, isolanguage (or 'link' for URLs), alternate name, ...
+    with _open_file(file_name) as alt_names_file:
+        for line in alt_names_file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 4 and (fields[2] == 'en' or (fields[2] == 'link' and 'en.wikipedia' in fields[3])):
+                yield int(fields[1]), fields[2], fields[3]
+
+
+def _read_wikipedia(file_name: str):
+    # JSON lines where each line is a page summary, in the format of the Wikipedia REST API's page/summary
+    with _open_file(file_name) as wiki_file:
+        for line in wiki_file:
+            if not line.strip():
+                continue
+            summary = json.loads(line)
+            if 'title' in summary:
+                yield _get_name_key(summary['title']), json.dumps(summary, ensure_ascii=False)
+
+
+def _read_wikidata(file_name: str, language_tags: tuple):
+    # Wikidata JSON dump - An array of entities with one entity per line (the first and last lines are '[' and ']')
+    #    Yields the wikidata_labels and wikidata_claims rows
+    with _open_file(file_name) as wikidata_file:
+        for line in wikidata_file:
+            line = line.strip().rstrip(',')
+            if not line.startswith('{'):
+                continue
+            entity = json.loads(line)
+            qid = entity.get('id', '')
+            for tag in language_tags:
+                if tag in entity.get('labels', dict()):
+                    yield 'wikidata_labels', (qid, entity['labels'][tag]['value'])
+                for alias in entity.get('aliases', dict()).get(tag, []):
+                    yield 'wikidata_labels', (qid, alias['value'])
+            for prop in claim_properties:
+                for claim in entity.get('claims', dict()).get(prop, []):
+                    data_value = claim.get('mainsnak', dict()).get('datavalue', dict()).get('value')
+                    if isinstance(data_value, dict) and ('id' in data_value or 'time' in data_value):
+                        yield 'wikidata_claims', \
+                            (qid, prop, data_value['id'] if 'id' in data_value else data_value['time'].lstrip('+'))
+
+
+def build_index(db_path: Path = None, country_info: str = None, geonames: str = None, alternate_names: str = None,
+                wikipedia: str = None, wikidata: str = None, language_tags: tuple = ('en',)):
+    """
+    Build (or add to) the local index from the GeoNames, Wikipedia and Wikidata files. Files that are not
+    specified are skipped, so that the index can be built incrementally.
+
+    :param db_path: Path of the SQLite database (by default, local_sources_path)
+    :param country_info: File name of the GeoNames countryInfo.txt file
+    :param geonames: File name of the GeoNames allCountries.txt file (or a country file)
+    :param alternate_names: File name of the GeoNames alternateNamesV2.txt file
+    :param wikipedia: File name of a JSON lines file of Wikipedia page summaries
+    :param wikidata: File name of a Wikidata JSON dump or extract
+    :param language_tags: Tuple of the language tags of the Wikidata labels and aliases to be loaded
+    :return: None
+    """
+    db_path = db_path if db_path else local_sources_path
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path))
+    for statement in create_statements:
+        conn.execute(statement)
+    if country_info:
+        _insert_rows(conn, 'INSERT OR REPLACE INTO countries VALUES (?, ?)', _read_country_info(country_info))
+    if geonames:
+        _insert_table_rows(conn, _read_geonames(geonames))
+    if alternate_names:
+        _insert_rows(conn, 'INSERT OR IGNORE INTO geonames_alt_names VALUES (?, ?, ?)',
+                     _read_alternate_names(alternate_names))
+    if wikipedia:
+        _insert_rows(conn, 'INSERT OR REPLACE INTO wikipedia VALUES (?, ?)', _read_wikipedia(wikipedia))
+    if wikidata:
+        _insert_table_rows(conn, _read_wikidata(wikidata, language_tags))
+    conn.commit()
+    conn.close()
+
+
+def get_geonames_element(loc_text: str) -> Union[etree.Element, None]:
+    """
+    Get the details of a location, formatted as a GeoNames search response (with style=full and maxRows=1).
+    If the location text contains commas, the text after the first comma must match the country name.
+    An exact match of the location's name is preferred over an alternate name, and then the more populous
+    location is returned.
+
+    :param loc_text: String holding the location text
+    :return: The root of the XML tree or None if the location is not found
+    """
+    name, *qualifiers = [_get_name_key(part) for part in loc_text.split(',')]
+    rows = _execute(
+        'SELECT g.geonameid, g.name, g.ascii_name, c.country_name, g.fcl, g.fcode FROM geonames_names n '
+        'JOIN geonames g ON n.geonameid = g.geonameid LEFT JOIN countries c ON g.country_code = c.country_code '
+        'WHERE n.name_key = ? ORDER BY n.is_primary DESC, g.population DESC', (name,))
+    for geonameid, toponym_name, ascii_name, country_name, fcl, fcode in rows:
+        if qualifiers and _get_name_key(country_name or '') not in qualifiers:
+            continue
+        root = etree.Element('geonames')
+        geoname = etree.SubElement(root, 'geoname')
+        for tag, value in (('toponymName', toponym_name), ('name', toponym_name), ('asciiName', ascii_name),
+                           ('countryName', country_name or ''), ('fcl', fcl), ('fcode', fcode)):
+            etree.SubElement(geoname, tag).text = value
+        for lang, alt_name in _execute('SELECT lang, name FROM geonames_alt_names WHERE geonameid = ?',
+                                       (geonameid,)):
+            etree.SubElement(geoname, 'alternateName', lang=lang).text = alt_name
+        return root
+    return None
+
+
+def get_wikidata_labels(wikidata_id: str) -> list:
+    """
+    Get the labels and aliases of a Wikidata item.
+
+    :param wikidata_id: String holding the Q ID of the Wikidata item
+    :return: Array of strings holding the labels (in the order that they were loaded)
+    """
+    return [row[0] for row in _execute('SELECT label FROM wikidata_labels WHERE qid = ? ORDER BY rowid',
+                                       (wikidata_id,))]
+
+
+def get_wikidata_times(wikidata_id: str) -> (str, str):
+    """
+    Get the start (P580) and end (P582) times of a Wikidata item.
+
+    :param wikidata_id: String holding the Q ID of the Wikidata item
+    :return: A tuple with strings holding the start and end times if defined; Otherwise, empty strings
+    """
+    times = {prop: value for prop, value in _execute(
+        "SELECT property, value FROM wikidata_claims WHERE qid = ? AND property IN ('P580', 'P582')",
+        (wikidata_id,))}
+    return times.get('P580', ''), times.get('P582', '')
+
+
+def get_wikipedia_summary(title: str) -> dict:
+    """
+    Get the summary of a Wikipedia page.
+
+    :param title: String holding the page title (spaces may be replaced by underscores)
+    :return: Dictionary holding the page summary (in the format of the Wikipedia REST API's page/summary) or
+             an empty dictionary if the page is not found
+    """
+    rows = _execute('SELECT summary FROM wikipedia WHERE title_key = ?', (_get_name_key(title),))
+    return json.loads(rows[0][0]) if rows else dict()
+
+
+def is_instance_of(wikidata_id: str, superclass: str) -> bool:
+    """
+    Check whether a Wikidata item is an instance of the superclass (or one of its subclasses).
+
+    :param wikidata_id: String holding the Q ID of the Wikidata item
+    :param superclass: String holding the Q ID of the superclass
+    :return: True if the item is an instance of the superclass, False otherwise
+    """
+    return bool(_execute(superclasses_query, (wikidata_id, superclass)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the local index of GeoNames, Wikipedia and Wikidata details')
+    parser.add_argument('--db', type=Path, default=local_sources_path, help='path of the SQLite index')
+    parser.add_argument('--country-info', help='GeoNames countryInfo.txt')
+    parser.add_argument('--geonames', help='GeoNames allCountries.txt (or a country file)')
+    parser.add_argument('--alternate-names', help='GeoNames alternateNamesV2.txt')
+    parser.add_argument('--wikipedia', help='JSON lines file of Wikipedia page summaries')
+    parser.add_argument('--wikidata', help='Wikidata JSON dump or extract')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    build_index(args.db, args.country_info, args.geonames, args.alternate_names, args.wikipedia, args.wikidata)
@@ -4,22 +4,34 @@
 #    process_new_narrative in app_functions.py)
 
 import logging
+import os
 import re
+import threading
 import uuid
 from dataclasses import dataclass
-
-import spacy
-from spacy.tokens import Doc
-from spacy.tokenizer import Tokenizer
+from typing import TYPE_CHECKING, Iterable, Iterator
 
 from dna.query_openai import access_api, attribution_prompt
 from dna.sentence_classes import Entity, Sentence, Quotation, Punctuation
 from dna.utilities_and_language_specific import empty_string, modals, ner_types, space
 
-nlp = spacy.load('en_core_web_trf')
+if TYPE_CHECKING:    # spaCy is imported when the model is loaded, since importing spaCy is slow
+    from spacy.language import Language
+    from spacy.tokens import Doc
+
+# spaCy model (for ex, en_core_web_trf, en_core_web_lg or en_core_web_sm), loaded on first use by get_nlp
+spacy_model = os.environ.get('DNA_SPACY_MODEL', 'en_core_web_trf')
+# Defaults for parse_narratives - the number of narratives buffered per batch and the number of processes
+spacy_batch_size = int(os.environ.get('SPACY_BATCH_SIZE', 16))
+spacy_n_process = int(os.environ.get('SPACY_N_PROCESS', 1))
+
+# Pipeline components that are not needed (and are disabled, if present in the model) for each type of processing
+entities_disabled = ('tagger', 'morphologizer', 'attribute_ruler', 'lemmatizer', 'parser', 'senter')
+narrative_disabled = ('tagger', 'morphologizer', 'attribute_ruler', 'lemmatizer')   # Sentences and entities
+quotations_disabled = ('ner', 'lemmatizer')                                          # Parts of speech and dependencies
 
-spacy_stopwords = nlp.Defaults.stop_words
-spacy_stopwords.clear()
+_nlp = None
+_nlp_lock = threading.Lock()
 
 quotation_mark_dict = {"\u0022": "\u0022",     # Holding the corresponding left/right quotation marks
                        "\u2018": "\u2019",     # Where the key is the left-hand mark
@@ -29,6 +41,27 @@ left_quotation_marks = list(quotation_mark_dict.keys())
 modals_without_space = [modal[:-1] for modal in modals]
 
 
+def _get_disabled(components: tuple) -> list:
+    """
+    Get the pipeline components (of those specified) that are in the loaded model, for use in the 'disable'
+    parameter of the nlp and nlp.pipe calls.
+
+    :param components: Tuple of the names of the components that are not needed
+    :return: Array of the names of the components to disable
+    """
+    return [name for name in components if name in get_nlp().pipe_names]
+
+
+def _clean_narrative(narr_text: str) -> str:
+    """
+    Remove line feeds and double spaces from the narrative text.
+
+    :param narr_text: The narrative text
+    :return: The updated text
+    """
+    return narr_text.replace('\n', space).replace("  ", space).strip()
+
+
 def _get_original_text(sent_text: str, quotation_instances: list, partial_quotations: list, left_quote: str) -> str:
     """
     Reassemble the original text to maintain/use it plus support the removal of the quoted text.
@@ -91,6 +124,31 @@ def _get_quotation_attribution(complete_text: str, quotation: str) -> str:
     return empty_string
 
 
+def _get_sentences(doc: 'Doc') -> list:
+    """
+    Split the narrative's Doc into sentences, creating a Sentence instance (with its named entities) for each.
+
+    :param doc: The spaCy Doc for the narrative
+    :return: A list of instances of the Sentence class
+    """
+    sentence_instance_list = []
+    sentence_offset = 0
+    for sentence in doc.sents:
+        sentence_offset += 1
+        sentence_text = _update_token_separation(sentence.text.strip())
+        # TODO: Determine if special punctuation is present (question mark, exclamation, other?)
+        # punctuations = _get_punctuations(sentence_text)
+        # Short sentences are mainly for reader effect and result in parsing problems - capture but ignore processing
+        if len(sentence_text) < 3 or not any(c.isalnum() for c in sentence_text):
+            # No NER
+            sentence_instance_list.append(Sentence(sentence_text, sentence_offset, [], []))
+            continue
+        # The sentence's entities are taken from the narrative's Doc, rather than parsing the sentence again
+        sentence_instance_list.append(
+            Sentence(sentence_text, sentence_offset, _get_span_entities(sentence), []))
+    return sentence_instance_list
+
+
 def _resolve_quotations(narr: str) -> (str, list):
     """
     Capture the quotations in the text.
@@ -117,8 +175,9 @@ def _resolve_quotations(narr: str) -> (str, list):
         return -1, []
     # Create an array of Quotation class instances
     quotations = []
-    for quote in quotes:    # Process the individual quotations
-        quote_doc = nlp(quote)
+    # Process the individual quotations
+    for quote, quote_doc in zip(quotes,
+                                get_nlp().pipe(quotes, disable=_get_disabled(quotations_disabled))):
         quote_verbs = [wd for wd in list(quote_doc) if wd.pos_ in ('VERB', 'AUX')]  # Root verb may be AUX
         verb_and_subj = False
         for quote_verb in quote_verbs:   # If any verb has a subject, then likely is a full quotation
@@ -130,6 +189,21 @@ def _resolve_quotations(narr: str) -> (str, list):
     return index_max, quotations
 
 
+def _get_span_entities(span) -> list:
+    """
+    Get the 'named entities' in a spaCy Doc or Span (for ex, a sentence in the narrative's Doc).
+
+    :param span: The spaCy Doc or Span
+    :return: List of named entities (except for TIME, which is handled separately in the Turtle processing)
+    """
+    entities = []
+    for ent in span.ents:
+        # Ignoring 'TIME'
+        if ent.label_ in ner_types and ent.label_ != 'TIME':    # Using strings for now to aid in debug
+            entities.append(Entity(_update_token_separation(ent.text), ent.label_, []))
+    return entities
+
+
 def _update_token_separation(sentence_text: str) -> str:
     """
     Reset spacy's separation of tokens
@@ -151,13 +225,24 @@ def get_entities(text: str) -> list:
     :param text: String holding the sentence text
     :return: List of named entities (except for TIME, which is handled separately in the Turtle processing)
     """
-    doc = nlp(text)
-    entities = []
-    for ent in doc.ents:
-        # Ignoring 'TIME'
-        if ent.label_ in ner_types and ent.label_ != 'TIME':    # Using strings for now to aid in debug
-            entities.append(Entity(ent.text, ent.label_, []))
-    return entities
+    return _get_span_entities(get_nlp()(text, disable=_get_disabled(entities_disabled)))
+
+
+def get_nlp() -> 'Language':
+    """
+    Get the spaCy pipeline, loading the spacy_model on first use.
+
+    :return: The spaCy Language instance
+    """
+    global _nlp
+    with _nlp_lock:
+        if _nlp is None:
+            import spacy
+            logging.info(f'Loading spaCy model, {spacy_model}')
+            nlp = spacy.load(spacy_model)
+            nlp.Defaults.stop_words.clear()
+            _nlp = nlp
+        return _nlp
 
 
 def parse_narrative(narr_text: str) -> (list, list):
@@ -171,22 +256,26 @@ def parse_narrative(narr_text: str) -> (list, list):
     :return: A tuple holding a list of instances of the Sentence class and a list of instances
              of the Quotation class
     """
-    narrative = narr_text.replace('\n', space).replace("  ", space).strip()
+    narrative = _clean_narrative(narr_text)
     quotation_mark, quotations = _resolve_quotations(narrative)
     # TODO: Use the quotation_mark info (0 = \u0022, 1 = \u2018, 2 = \u201c) to find all quotes
-    doc = nlp(narrative)
-    sentence_instance_list = []
-    sentence_offset = 0
-    for sentence in doc.sents:
-        sentence_offset += 1
-        sentence_text = _update_token_separation(sentence.text.strip())
-        # TODO: Determine if special punctuation is present (question mark, exclamation, other?)
-        # punctuations = _get_punctuations(sentence_text)
-        # Short sentences are mainly for reader effect and result in parsing problems - capture but ignore processing
-        if len(sentence_text) < 3 or not any(c.isalnum() for c in sentence_text):
-            # No NER
-            sentence_instance_list.append(Sentence(sentence_text, sentence_offset, [], []))
-            continue
-        sentence_instance_list.append(
-            Sentence(sentence_text, sentence_offset, get_entities(sentence_text), []))
-    return sentence_instance_list, quotations
+    return _get_sentences(get_nlp()(narrative, disable=_get_disabled(narrative_disabled))), quotations
+
+
+def parse_narratives(narr_texts: Iterable, batch_size: int = None, n_process: int = None) -> Iterator:
+    """
+    Bulk version of parse_narrative, streaming the narratives through spaCy's nlp.pipe (so that they are
+    processed in batches, and optionally in multiple processes).
+
+    :param narr_texts: An iterable of strings holding the narrative texts
+    :param batch_size: The number of narratives buffered per batch (if not specified, spacy_batch_size)
+    :param n_process: The number of processes (if not specified, spacy_n_process; -1 indicates the number of CPUs)
+    :return: A generator yielding a tuple holding a list of instances of the Sentence class and a list of
+             instances of the Quotation class for each narrative (in the order of narr_texts)
+    """
+    narratives = (_clean_narrative(narr_text) for narr_text in narr_texts)
+    for doc in get_nlp().pipe(narratives, batch_size=batch_size if batch_size else spacy_batch_size,
+                              n_process=n_process if n_process else spacy_n_process,
+                              disable=_get_disabled(narrative_disabled)):
+        quotation_mark, quotations = _resolve_quotations(doc.text)
+        yield _get_sentences(doc), quotations
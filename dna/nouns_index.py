@@ -0,0 +1,156 @@
+# Indexed dictionary of the nouns/named entities encountered in a narrative (the nouns_dict), supporting the
+#    substring lookups of process_entities' check_if_noun_is_known without scanning all the keys
+#    Known texts that occur in a query are found by walking a character trie from each position of the query, and
+#    known texts that contain a query are found by intersecting the postings of the query's character trigrams
+
+from typing import Union
+
+ngram_size = 3
+
+
+class NounsDictionary(dict):
+    """
+    Dictionary of the nouns/named entities (keyed by text), which maintains a trie and an n-gram index of its keys
+    as entries are added or removed. Lookups return the first matching key in the dictionary's insertion order,
+    the same result as scanning the keys.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._trie = dict()            # Nested dictionaries keyed by character; None key holds the key's number
+        self._ngrams = dict()          # Keyed by n-gram, with a set of the key numbers containing the n-gram
+        self._key_numbers = dict()     # Insertion number of each key
+        self._keys = dict()            # Key for each insertion number
+        self._next_number = 0
+        self.update(*args, **kwargs)
+
+    def __reduce__(self):
+        # Copies and pickles are rebuilt from the entries, so that the index is recreated
+        return self.__class__, (dict(self),)
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._add_key(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._remove_key(key)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        nouns_dict = self.copy()
+        nouns_dict.update(other)
+        return nouns_dict
+
+    def __ror__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        nouns_dict = self.__class__(other)
+        nouns_dict.update(self)
+        return nouns_dict
+
+    def _add_key(self, key: str):
+        number = self._next_number
+        self._next_number += 1
+        self._key_numbers[key] = number
+        self._keys[number] = key
+        node = self._trie
+        for char in key:
+            node = node.setdefault(char, dict())
+        node[None] = number
+        for ngram in _get_ngrams(key):
+            self._ngrams.setdefault(ngram, set()).add(number)
+
+    def _remove_key(self, key: str):
+        number = self._key_numbers.pop(key)
+        del self._keys[number]
+        node = self._trie
+        for char in key:
+            node = node[char]
+        del node[None]     # Empty trie nodes are left in place
+        for ngram in _get_ngrams(key):
+            self._ngrams[ngram].discard(number)
+
+    def clear(self):
+        super().clear()
+        self._trie = dict()
+        self._ngrams = dict()
+        self._key_numbers = dict()
+        self._keys = dict()
+
+    def copy(self):
+        return self.__class__(self)
+
+    def pop(self, key, *args):
+        if key in self:
+            value = super().pop(key)
+            self._remove_key(key)
+            return value
+        return super().pop(key, *args)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._remove_key(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def find_key_in(self, text: str) -> Union[str, None]:
+        """
+        Find the first key (in insertion order) that is a substring of the text.
+
+        :param text: String holding the text
+        :return: The key or None if no key is a substring of the text
+        """
+        first = None
+        for start in range(len(text) + 1):
+            node = self._trie
+            if None in node and (first is None or node[None] < first):
+                first = node[None]
+            for char in text[start:]:
+                node = node.get(char)
+                if node is None:
+                    break
+                if None in node and (first is None or node[None] < first):
+                    first = node[None]
+        return None if first is None else self._keys[first]
+
+    def find_key_containing(self, text: str) -> Union[str, None]:
+        """
+        Find the first key (in insertion order) that contains the text.
+
+        :param text: String holding the text
+        :return: The key or None if no key contains the text
+        """
+        ngrams = _get_ngrams(text)
+        if not ngrams:     # Text is shorter than the n-grams
+            return next((key for key in self if text in key), None)
+        postings = sorted((self._ngrams.get(ngram, set()) for ngram in ngrams), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        for number in sorted(candidates):
+            if text in self._keys[number]:
+                return self._keys[number]
+        return None
+
+
+def _get_ngrams(text: str) -> set:
+    """
+    Get the character n-grams of a text.
+
+    :param text: String holding the text
+    :return: Set of the n-grams (empty if the text is shorter than ngram_size)
+    """
+    return {text[i:i + ngram_size] for i in range(len(text) - ngram_size + 1)}
@@ -1,13 +1,19 @@
 # Processing related to spaCy Named Entities (PERSON, NORP, ORG, GPE, LOC, FAC, EVENT, DATE, LAW,
 #    PRODUCT, TIME, WORK_OF_ART)
 
+import logging
+import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from unidecode import unidecode
 
 from dna.create_entities_turtle import create_agent_ttl, create_location_ttl, create_named_entity_ttl, create_norp_ttl
+from dna.nouns_index import NounsDictionary
 from dna.prompting_ontology_details import event_categories
-from dna.query_openai import access_api, noun_events_prompt
-from dna.query_sources import get_event_details_from_wikidata, get_wikipedia_description
+from dna.query_openai import access_api, noun_events_prompt, openai_cache
+from dna.query_sources import get_event_details_from_wikidata, get_geonames_location, get_wikipedia_description, \
+    source_backend, sources_cache_enabled
 from dna.sentence_classes import Entity
 from dna.utilities_and_language_specific import add_unique_to_array, check_name_gender, days, empty_string, \
     literal, months, names_to_geo_dict, ner_dict, ner_types, underscore
@@ -25,6 +31,50 @@ year_pattern = re.compile('[0-9]{4}')
 day_pattern1 = re.compile('[0-9] | [0-9],|[0-2][0-9] |[0-2][0-9],|3[0-1] |3[0-1],')
 day_pattern2 = re.compile('|'.join(days))
 
+# Maximum number of entities whose external details (GeoNames, Wikipedia, Wikidata, OpenAI) are prefetched concurrently
+entity_max_workers = int(os.environ.get('ENTITY_MAX_WORKERS', 8))
+
+
+def _combine_locations(sentence_text: str, entities: list) -> list:
+    """
+    Handle location words occurring together - for ex, 'Paris, Texas' - which are returned as 2 separate entities.
+
+    :param sentence_text: String holding the sentence
+    :param entities: An array of instances of the Entity Class
+    :return: An array of instances of the Entity Class, where adjacent locations are combined
+    """
+    if not sentence_text or len(entities) < 2:
+        return list(entities)
+    new_entities = []
+    offset = 0
+    while offset < (len(entities) - 1):
+        if not ('GPE' in entities[offset].ner_type or 'LOC' in entities[offset].ner_type):
+            new_entities.append(entities[offset])
+            offset += 1
+        else:
+            if f'{entities[offset].text}, {entities[offset + 1].text}' in sentence_text and \
+                    (entities[offset].ner_type == entities[offset + 1].ner_type):  # Types same
+                new_entities.append(Entity(f'{entities[offset].text},{entities[offset + 1].text}',
+                                           entities[offset].ner_type, []))
+                offset += 2
+            else:
+                new_entities.append(entities[offset])
+                offset += 1
+    if offset == (len(entities) - 1):
+        new_entities.append(entities[offset])   # Add last entity
+    return new_entities
+
+
+def _get_base_type(noun_type: str) -> str:
+    """
+    Remove the gender and number details from an entity type - for ex, FEMALESINGPERSON becomes PERSON.
+
+    :param noun_type: String holding the entity type
+    :return: The spaCy NER type
+    """
+    return noun_type.replace('PLURAL', empty_string).replace('SING', empty_string).\
+        replace('FEMALE', empty_string).replace('MALE', empty_string)
+
 
 def _get_names(agent_text: str) -> list:
     """
@@ -59,8 +109,7 @@ def _get_noun_ttl(sentence_text: str, noun_text: str, noun_entity: Entity, nouns
     """
     labels = []
     noun_type = noun_entity.ner_type
-    base_type = noun_type.replace('PLURAL', empty_string).replace('SING', empty_string).\
-        replace('FEMALE', empty_string).replace('MALE', empty_string)
+    base_type = _get_base_type(noun_type)
     class_map = f'{ner_dict[base_type]}, :Correction'     # Identifying as possible Correction for co-ref resolution
     class_map = f'{class_map}, :Collection' if 'PLURAL' in noun_type and ':Collection' not in class_map else class_map
     if base_type == 'DATE':
@@ -126,6 +175,73 @@ def _get_noun_ttl(sentence_text: str, noun_text: str, noun_entity: Entity, nouns
     return noun_type, noun_iri, noun_ttl
 
 
+def _normalize_entity_text(text: str) -> str:
+    """
+    Normalize the text of an entity - removing periods, leading articles, trailing conjunctions, leading
+    lower case words and possessives.
+
+    :param text: String holding the entity text (as returned by spaCy)
+    :return: The normalized text, or an empty string if the result is less than 2 characters
+    """
+    # Remove '.' to easily disambiguate (e.g.) US Supreme Court and U.S. Supreme Court
+    entity_text = unidecode(text.replace('.', empty_string))
+    # Remove articles and conjunctions
+    for article in ('a ', 'A ', 'an ', 'An ', 'the ', 'The '):
+        if entity_text.startswith(article):
+            entity_text = entity_text[len(article):].strip()
+            break
+    for conj in (' and', ' or'):
+        if entity_text.endswith(conj):
+            entity_text = entity_text[:len(conj) * -1].strip()
+            break
+    # Does the entity start with a capital letter (e.g., is it a proper noun)?
+    if entity_text and not entity_text[0].isupper():
+        found = -1
+        for i, char in enumerate(entity_text):
+            if char.isupper():
+                found = i
+                break
+        entity_text = entity_text[found:].strip()
+    if len(entity_text) < 2:
+        return empty_string
+    # Remove "apostrophe" or "apostrophe s" at the end of the entity text (spaCy includes possessive)
+    if re.findall(r"\u0027$", entity_text) or re.findall(r"\u2019$", entity_text):
+        entity_text = entity_text[0:-1]
+    elif re.findall(r"\u0027\u0073$", entity_text) or re.findall(r"\u2019\u0073$", entity_text):
+        entity_text = entity_text[0:-2]
+    return entity_text
+
+
+def _prefetch_entity_details(entity_text: str, base_type: str, sentence_text: str,
+                             cancelled: threading.Event = None):
+    """
+    Send the external requests that _get_noun_ttl will make for an entity, so that their results are cached.
+
+    :param entity_text: String holding the normalized entity text
+    :param base_type: The spaCy NER type of the entity
+    :param sentence_text: String holding the sentence where the entity was found
+    :param cancelled: An optional Event which is set if the prefetch is no longer needed
+    :return: None
+    """
+    if cancelled and cancelled.is_set():
+        return
+    try:
+        if base_type in ('GPE', 'LOC', 'FAC', 'ORG'):
+            geonames_details = get_geonames_location(entity_text)
+            if geonames_details.location_class:
+                get_wikipedia_description(entity_text, base_type, geonames_details.wiki_link)
+                return
+        if base_type in ('PERSON', 'NORP', 'ORG'):
+            get_wikipedia_description(entity_text, base_type)
+        elif base_type == 'EVENT':
+            if openai_cache.enabled:     # Otherwise, the prompt would be sent again when the entity is processed
+                access_api(noun_events_prompt.replace('{sent_text}', sentence_text)
+                           .replace('{noun_texts}', entity_text))
+            get_event_details_from_wikidata(entity_text)
+    except Exception as e:     # Prefetching is an optimization; Errors are handled when the entity is processed
+        logging.warning(f'Exception prefetching details for entity, {entity_text}: {str(e)}')
+
+
 def check_if_noun_is_known(noun_text: str, noun_type: str, nouns_dict: dict) -> (str, str):
     """
     Determines if the noun text has already been seen/processed and so is identified in the nouns_dict.
@@ -163,15 +279,21 @@ def check_if_noun_is_known(noun_text: str, noun_type: str, nouns_dict: dict) ->
                     break
                 base_words = f'{noun_word} {base_words}'.strip()
     noun_string = noun_text if not base_words else base_words
-    # Check for a substring match in base_words
-    matches = [noun for noun in nouns_dict.keys() if noun in noun_string]   # E.g., "Cheney" in "Rep. Liz Cheney"
-    if len(matches) >= 1:
-        return nouns_dict[matches[0]]
+    # Check for a substring match in base_words - e.g., "Cheney" in "Rep. Liz Cheney"
+    if isinstance(nouns_dict, NounsDictionary):
+        match = nouns_dict.find_key_in(noun_string)
+    else:
+        match = next((noun for noun in nouns_dict.keys() if noun in noun_string), None)
+    if match is not None:
+        return nouns_dict[match]
     # TODO: else: Return most recent match
     # Check for the base_word in the encountered nouns - e.g., "campaign" in "Biden-Harris campaign"
-    matches = [noun for noun in nouns_dict.keys() if noun_string in noun]
-    if len(matches) >= 1:
-        return nouns_dict[matches[0]]
+    if isinstance(nouns_dict, NounsDictionary):
+        match = nouns_dict.find_key_containing(noun_string)
+    else:
+        match = next((noun for noun in nouns_dict.keys() if noun_string in noun), None)
+    if match is not None:
+        return nouns_dict[match]
     # TODO: else: Return most recent match
     return noun_type, empty_string
 
@@ -207,6 +329,42 @@ def create_time_iri(before_after_str: str, str_text: str, ymd_required: bool) ->
            + (f'_Day{day_search2.group()}' if day_search2 else empty_string)
 
 
+def prefetch_entities(sentence_entities: list, nouns_dict: dict, cancelled: threading.Event = None):
+    """
+    Concurrently send the external requests (to GeoNames, Wikipedia, Wikidata and OpenAI) for the new entities
+    in one or more sentences, so that their results are cached before the entities are processed. The entities
+    are deduplicated by their normalized text and type. Nothing is prefetched if the source lookups are not
+    cached, and the OpenAI prompts of events are not prefetched if the OpenAI responses are not cached (since
+    the requests would be repeated).
+
+    :param sentence_entities: An array of tuples consisting of a sentence's text and an array of instances of
+                              the Entity Class (for the entities in the sentence)
+    :param nouns_dict: A dictionary holding the nouns/named entities encountered in the narrative (entities
+                       that are already known are not prefetched)
+    :param cancelled: An optional Event which is set if the prefetch is no longer needed (the entities whose
+                      requests were not yet sent are then skipped)
+    :return: None
+    """
+    if not sources_cache_enabled or source_backend == 'local':
+        return
+    new_entities = dict()
+    for sentence_text, entities in sentence_entities:
+        for entity in _combine_locations(sentence_text, entities):
+            entity_text = _normalize_entity_text(entity.text)
+            base_type = _get_base_type(entity.ner_type)
+            if not entity_text or base_type == 'DATE' or \
+                    check_if_noun_is_known(entity_text, entity.ner_type, nouns_dict)[1]:
+                continue
+            # The event prompt includes the sentence text, so events are deduplicated per sentence
+            key = (entity_text, base_type, sentence_text if base_type == 'EVENT' else empty_string)
+            new_entities.setdefault(key, sentence_text)
+    if len(new_entities) < 2:     # Not worth prefetching; The entity is processed immediately
+        return
+    with ThreadPoolExecutor(max_workers=entity_max_workers) as executor:
+        for (entity_text, base_type, event_sentence), sentence_text in new_entities.items():
+            executor.submit(_prefetch_entity_details, entity_text, base_type, sentence_text, cancelled)
+
+
 def process_ner_entities(sentence_text: str, entities: list, nouns_dict: dict) -> (list, list):
     """
     Handle entities identified by spaCy's NER.
@@ -220,56 +378,15 @@ def process_ner_entities(sentence_text: str, entities: list, nouns_dict: dict) -
     :return: A tuple consisting of two arrays: (1) the IRIs of the entities identified in the sentence,
              and 2) Turtle statements defining them (also the nouns_dict is likely updated)
     """
-    new_entities = []
-    # Handle location words occurring together - for ex, 'Paris, Texas' - which are returned as 2 separate entities
-    if sentence_text and len(entities) > 1:
-        offset = 0
-        while offset < (len(entities) - 1):
-            if not ('GPE' in entities[offset].ner_type or 'LOC' in entities[offset].ner_type):
-                new_entities.append(entities[offset])
-                offset += 1
-            else:
-                if f'{entities[offset].text}, {entities[offset + 1].text}' in sentence_text and \
-                        (entities[offset].ner_type == entities[offset + 1].ner_type):  # Types same
-                    new_entities.append(Entity(f'{entities[offset].text},{entities[offset + 1].text}',
-                                               entities[offset].ner_type, []))
-                    offset += 2
-                else:
-                    new_entities.append(entities[offset])
-                    offset += 1
-        if offset == (len(entities) - 1):
-            new_entities.append(entities[offset])   # Add last entity
-    else:
-        new_entities.extend(entities)
+    # The external details of the entities are retrieved concurrently, and then the entities are processed in order
+    prefetch_entities([(sentence_text, entities)], nouns_dict)
+    new_entities = _combine_locations(sentence_text, entities)
     entities_ttl = []
     entity_iris = []
     for new_entity in new_entities:
-        # Remove '.' to easily disambiguate (e.g.) US Supreme Court and U.S. Supreme Court
-        entity_text = unidecode(new_entity.text.replace('.', empty_string))
-        # Remove articles and conjunctions
-        for article in ('a ', 'A ', 'an ', 'An ', 'the ', 'The '):
-            if entity_text.startswith(article):
-                entity_text = entity_text[len(article):].strip()
-                break
-        for conj in (' and', ' or'):
-            if entity_text.endswith(conj):
-                entity_text = entity_text[:len(article) * -1].strip()
-                break
-        # Does the entity start with a capital letter (e.g., is it a proper noun)?
-        if not entity_text[0].isupper():
-            found = -1
-            for i, char in enumerate(entity_text):
-                if char.isupper():
-                    found = i
-                    break
-            entity_text = entity_text[found:].strip()
-        if len(entity_text) < 2:
+        entity_text = _normalize_entity_text(new_entity.text)
+        if not entity_text:
             continue
-        # Remove "apostrophe" or "apostrophe s" at the end of the entity text (spaCy includes possessive)
-        if re.findall(r"\u0027$", entity_text) or re.findall(r"\u2019$", entity_text):
-            entity_text = entity_text[0:-1]
-        elif re.findall(r"\u0027\u0073$", entity_text) or re.findall(r"\u2019\u0073$", entity_text):
-            entity_text = entity_text[0:-2]
         entity_type, entity_iri = check_if_noun_is_known(entity_text, new_entity.ner_type, nouns_dict)
         if not entity_iri:
             # Need to define the Turtle for a new entity
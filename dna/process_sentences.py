@@ -1,17 +1,25 @@
 # Processing of Sentence instances using OpenAI
 
 import copy
+import json
 import logging
+import os
 import re
 import uuid
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
+from functools import partial
 from typing import Union
 from unidecode import unidecode
 
-from dna.database import add_remove_data
+from dna.corrections_cache import record_corrections
+from dna.database import WriteBuffer, add_remove_data
 from dna.nlp import get_entities
 from dna.process_entities import agent_classes, check_if_noun_is_known, create_time_iri, process_ner_entities
-from dna.query_openai import access_api, noun_categories_prompt, rhetorical_devices, sentence_prompt, situation_prompt
+from dna.query_openai import access_api, access_api_batch, model_engine, noun_categories_prompt, openai_cache, \
+    openai_max_workers, rhetorical_devices, sentence_batch_prompt, sentence_batch_size, sentence_batch_tokens, \
+    sentence_prompt, situation_prompt
+from dna.response_cache import ResponseCache
 from dna.sentence_classes import Sentence, Quotation, Entity
 from dna.utilities_and_language_specific import empty_string, honorifics, literal, modals, ner_dict, ttl_prefixes
 
@@ -39,6 +47,14 @@ specific_mapping_dict = {'person': ':Person', 'geopolitical entity': ':Geopoliti
 specific_spacy_dict = {'person': 'PERSON', 'geopolitical entity': 'LOC',
                        'location': 'LOC', 'occupation': ''}
 
+sentence_result_tokens = 150    # Estimate of the tokens in the sentence_prompt results for a sentence
+# Cache of the sentence-level prompt results for each sentence (with the ttl and maximum entries of the cache of
+#    OpenAI responses, but enabled separately), so that a sentence that recurs in another narrative (for ex, a
+#    near-duplicate of an article from another outlet) is not sent again, although the other sentences in its
+#    batch differ
+sentence_cache = ResponseCache('sentences', ttl=openai_cache.ttl, max_entries=openai_cache.max_entries,
+                               enabled=os.environ.get('SENTENCE_CACHE', 'on').lower() != 'off')
+
 # TODO: Add "effect"
 semantic_roles = ("affiliation", "agent", "patient", "content", "theme", "experiencer", "instrument", "cause",
                   "location", "time", "goal", "source", "state", "subject", "purpose", "recipient",
@@ -137,6 +153,99 @@ def _deal_with_nouns(event_iri: str, event_classes: list, sit_nouns_dict: dict,
     return nouns_ttl
 
 
+def _get_sentence_cache_key(sentence_text: str) -> str:
+    """
+    Get the sentence_cache key for a sentence, where differences in whitespace are ignored.
+
+    :param sentence_text: String holding the sentence/quotation text
+    :return: String holding the key
+    """
+    return ResponseCache.make_key(' '.join(sentence_text.split()), sentence_prompt, sentence_batch_prompt,
+                                  model_engine)
+
+
+def _get_sentence_batches(sentence_texts: list) -> list:
+    """
+    Group sentences into batches for the sentence_batch_prompt, where the size of a batch is limited by the
+    number of sentences (sentence_batch_size) and the estimated tokens for the sentences and their results
+    (sentence_batch_tokens).
+
+    :param sentence_texts: Array of strings holding the sentence/quotation texts
+    :return: Array of batches, where each batch is an array of indices of the sentence_texts
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for index, sentence_text in enumerate(sentence_texts):
+        tokens = len(sentence_text) // 4 + sentence_result_tokens
+        if batch and (len(batch) >= sentence_batch_size or batch_tokens + tokens > sentence_batch_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _is_valid_sentence_result(sent_result: dict) -> bool:
+    """
+    Validate an entry in the "sentences" array returned by the sentence_batch_prompt.
+
+    :param sent_result: Dictionary holding the entry (see query_openai's sentence_batch_result)
+    :return: True if the entry has an integer grade level and well-formed rhetorical devices, False otherwise
+    """
+    if not isinstance(sent_result, dict) or type(sent_result.get('grade_level')) is not int:
+        return False
+    devices = sent_result.get('rhetorical_devices', [])
+    return isinstance(devices, list) and \
+        all(isinstance(device, dict) and 'device_number' in device and 'explanation' in device for device in devices)
+
+
+def _set_sentence_futures(sentence_futures: list, batch_future: Future):
+    """
+    Set the results (or exception) of the Futures for each sentence in a batch, when the batch is complete.
+
+    :param sentence_futures: Array of the Futures for the sentences in the batch
+    :param batch_future: The Future of the get_sentence_prompt_results_batched call for the batch
+    :return: None
+    """
+    if batch_future.exception():
+        for sentence_future in sentence_futures:
+            sentence_future.set_exception(batch_future.exception())
+        return
+    for sentence_future, sent_dict in zip(sentence_futures, batch_future.result()):
+        sentence_future.set_result(sent_dict)
+
+
+def _cache_sentence_results(sentence_texts: list, results: list):
+    """
+    Add the (non-empty) sentence-level prompt results of a set of sentences to the sentence_cache.
+
+    :param sentence_texts: Array of strings holding the sentence/quotation texts
+    :param results: Array of dictionaries (in the order of the sentence_texts) holding the prompt results
+    :return: None
+    """
+    for sentence_text, sent_dict in zip(sentence_texts, results):
+        if sent_dict:
+            sentence_cache.put(_get_sentence_cache_key(sentence_text), sent_dict)
+
+
+def _get_noun_roles(sentence: dict) -> dict:
+    """
+    Get the semantic roles of the nouns in a simpler sentence returned by the situation prompt.
+
+    :param sentence: See query_openai's situation_result for a single list entry for the key,
+                     "simpler_sentences"
+    :return: Dictionary whose keys are the noun phrases, and whose values are their semantic role
+    """
+    noun_roles_dict = dict()
+    for noun in sentence['nouns']:
+        noun_roles_dict[noun['noun_text']] = noun['semantic_role']
+    return noun_roles_dict
+
+
 def _get_noun_details(noun_details: dict, event_classes: list, events_and_nouns: EventsAndNouns,
                       nouns_dict: dict) -> (str, str, list):
     """
@@ -273,7 +382,8 @@ def _get_predicate(noun_details: dict, noun_class_name: str, noun_roles_dict: di
 
 
 def get_sentence_details(sentence_or_quotation: Union[Sentence, Quotation], ttl_list: list,
-                         sentence_type: str, nouns_dict: dict, repo: str):
+                         sentence_type: str, nouns_dict: dict, repo: str, write_buffer: WriteBuffer = None,
+                         sent_dict_future: Future = None):
     """
     Retrieve sentence or quotation details (such as rhetorical devices and quotation attribution)
     using the OpenAI API and create the Turtle representation of this information.
@@ -287,6 +397,10 @@ def get_sentence_details(sentence_or_quotation: Union[Sentence, Quotation], ttl_
              of the spaCy entity type and the noun's IRI. An IRI value may be associated with
              more than 1 text.
     :param repo: String holding the repository name for the narrative graph
+    :param write_buffer: An optional WriteBuffer collecting the Turtle for the narrative ingest; If not
+             specified, new entities are immediately added to the repository's default graph
+    :param sent_dict_future: An optional Future (for ex, from get_sentence_prompt_futures)
+             providing the results of the sentence-level prompt; If not specified, the prompt is sent when needed
     :return: N/A (the ttl_list is updated with the details from OpenAI)
     """
     sentence_iri = sentence_or_quotation.iri
@@ -321,9 +435,14 @@ def get_sentence_details(sentence_or_quotation: Union[Sentence, Quotation], ttl_
         ner_ttl = ttl_prefixes[:]
         ner_ttl.extend(entity_ttls)
         # Add new entities to the repo's default graph
-        msg = add_remove_data('add', ' '.join(ner_ttl), repo)
-        if msg:
-            logging.error('Error adding new entity: ', ner_ttl)
+        if write_buffer:
+            write_buffer.add(' '.join(ner_ttl), repo)
+        else:
+            msg = add_remove_data('add', ' '.join(ner_ttl), repo)
+            if msg:
+                logging.error('Error adding new entity: ', ner_ttl)
+            else:
+                record_corrections(repo, ' '.join(ner_ttl))
     for entity_iri in entity_iris:
         ttl_list.append(f'{sentence_iri} :mentions {entity_iri} .')
     # Capture a quotation's attribution
@@ -338,7 +457,7 @@ def get_sentence_details(sentence_or_quotation: Union[Sentence, Quotation], ttl_
         if attrib_iri:
             ttl_list.append(f'{sentence_iri} :attributed_to {attrib_iri} .')
     # Process the sentence-level prompt
-    sent_dict = access_api(sentence_prompt.replace("{sent_text}", sentence_text))   # Deref
+    sent_dict = sent_dict_future.result() if sent_dict_future else get_sentence_prompt_results(sentence_text)
     if sent_dict:   # Might not get reply from OpenAI
         if type(sent_dict['grade_level']) is int:
             ttl_list.append(f'{sentence_iri} :grade_level {sent_dict["grade_level"]} .')
@@ -359,6 +478,82 @@ def get_sentence_details(sentence_or_quotation: Union[Sentence, Quotation], ttl_
     return
 
 
+def get_sentence_prompt_results(sentence_text: str) -> dict:
+    """
+    Send the sentence-level prompt (to get grade level and rhetorical devices) for a sentence or quotation.
+    The prompt does not use or update the nouns dictionary, and can be sent concurrently for all sentences.
+
+    :param sentence_text: String holding the sentence or quotation text
+    :return: Dictionary holding the prompt results (based on the sentence_result format), or an empty
+             dictionary if an error occurred
+    """
+    return access_api(sentence_prompt.replace("{sent_text}", sentence_text))
+
+
+def get_sentence_prompt_futures(sentence_texts: list, executor: Executor) -> list:
+    """
+    Send the sentence-level prompts for a set of sentences/quotations in batches, using the executor.
+
+    :param sentence_texts: Array of strings holding the sentence/quotation texts
+    :param executor: The Executor (for ex, a ThreadPoolExecutor) which sends the batches
+    :return: Array of Futures (in the order of the sentence_texts) providing the results of the sentence-level
+             prompt for each text (based on the sentence_result format); The results of sentences in the
+             sentence_cache are set immediately, and only the other sentences are batched
+    """
+    sentence_futures = [Future() for sentence_text in sentence_texts]
+    uncached = []
+    for index, sentence_text in enumerate(sentence_texts):
+        found, sent_dict = sentence_cache.get(_get_sentence_cache_key(sentence_text))
+        if found:
+            sentence_futures[index].set_result(sent_dict)
+        else:
+            uncached.append(index)
+    for batch in _get_sentence_batches([sentence_texts[i] for i in uncached]):
+        batch_indices = [uncached[i] for i in batch]
+        batch_future = executor.submit(get_sentence_prompt_results_batched, [sentence_texts[i] for i in batch_indices])
+        batch_future.add_done_callback(partial(_set_sentence_futures, [sentence_futures[i] for i in batch_indices]))
+    return sentence_futures
+
+
+def get_sentence_prompt_results_batched(sentence_texts: list) -> list:
+    """
+    Send the sentence-level prompt for a set of sentences/quotations in a single request, where the sentences
+    are keyed by their number in the request. Each result is validated, and any sentence whose result is missing
+    or invalid is sent individually (using the sentence_prompt).
+
+    :param sentence_texts: Array of strings holding the sentence/quotation texts
+    :return: Array of dictionaries (in the order of the sentence_texts) holding the prompt results (based on
+             the sentence_result format), where a dictionary is empty if an error occurred; Non-empty results
+             are added to the sentence_cache
+    """
+    if len(sentence_texts) == 1:
+        results = [get_sentence_prompt_results(sentence_texts[0])]
+        _cache_sentence_results(sentence_texts, results)
+        return results
+    sentences_json = json.dumps({str(number): text for number, text in enumerate(sentence_texts, start=1)},
+                                ensure_ascii=False)
+    batch_dict = access_api(sentence_batch_prompt.replace('{sentences_json}', sentences_json))
+    results = [None] * len(sentence_texts)
+    batch_results = batch_dict.get('sentences', []) if isinstance(batch_dict.get('sentences'), list) else []
+    for sent_result in batch_results:
+        number = sent_result.get('sentence_number') if isinstance(sent_result, dict) else None
+        if type(number) is str and number.isdigit():
+            number = int(number)
+        if type(number) is int and 0 < number <= len(sentence_texts) and results[number - 1] is None \
+                and _is_valid_sentence_result(sent_result):
+            results[number - 1] = {'grade_level': sent_result['grade_level'],
+                                   'rhetorical_devices': sent_result.get('rhetorical_devices', [])}
+    failed = [index for index, result in enumerate(results) if result is None]
+    if failed:
+        logging.info(f'Batched sentence prompt returned {len(failed)} invalid results; Sending them individually')
+        fallback_dicts = access_api_batch(
+            [sentence_prompt.replace("{sent_text}", sentence_texts[index]) for index in failed])
+        for index, fallback_dict in zip(failed, fallback_dicts):
+            results[index] = fallback_dict
+    _cache_sentence_results(sentence_texts, results)
+    return results
+
+
 def situation_semantics_processing(situations: list, events_and_nouns: EventsAndNouns, narr_id: str,
                                    subject_areas: list, nouns_dict: dict) -> list:
     """
@@ -395,7 +590,22 @@ def situation_semantics_processing(situations: list, events_and_nouns: EventsAnd
         subject_area_text = empty_string
     sit_prompt = sit_prompt.replace('{subject_area_text}', subject_area_text)
     nouns_prompt = nouns_prompt.replace('{subject_area_text}', subject_area_text)
-    # Process the situations one by one; OpenAI has issues with analyzing too many sentences
+    # Process the situations one by one (OpenAI has issues with analyzing too many sentences), using a pipeline -
+    #    1) the situation prompts are sent concurrently, and 2) as each situation is returned, the noun category
+    #    prompts for its simpler sentences are sent; The Turtle is then assembled in the original situation order
+    executor = ThreadPoolExecutor(max_workers=openai_max_workers)
+    situation_futures = {executor.submit(access_api, sit_prompt.replace('{sit_text}', situation)): index
+                         for index, situation in enumerate(situations)}
+    situation_dicts = [dict() for situation in situations]
+    nouns_futures = [[] for situation in situations]      # Array of Futures for each situation's simpler sentences
+    for situation_future in as_completed(situation_futures):
+        index = situation_futures[situation_future]
+        situation_dicts[index] = situation_future.result()
+        for sentence in situation_dicts[index].get('simpler_sentences', []):
+            nouns_futures[index].append(
+                executor.submit(access_api, nouns_prompt.replace('{noun_phrases}',
+                                                                 " ** ".join(_get_noun_roles(sentence).keys()))))
+    executor.shutdown(wait=False)    # Submitted prompts are still processed
     for index, situation in enumerate(situations):
         # Assemble the Turtle for the sentence
         sit_iri = f':NarrativeEvent_{str(uuid.uuid4())[:13]}'
@@ -403,9 +613,9 @@ def situation_semantics_processing(situations: list, events_and_nouns: EventsAnd
         semantics_ttl.extend([f'{narr_id} :describes {sit_iri} .',
                               f'{sit_iri} a :NarrativeEvent ; :offset {index} .',
                               f'{sit_iri} :text {literal(situation)} .'])
-        situation_dict = access_api(sit_prompt.replace('{sit_text}', situation))
+        situation_dict = situation_dicts[index]
         prev_event = empty_string
-        for sentence in situation_dict['simpler_sentences']:
+        for sent_index, sentence in enumerate(situation_dict['simpler_sentences']):
             event_iri = f':Event_{str(uuid.uuid4())[:13]}'
             sent_text = sentence["text"]
             if sent_text.endswith(' something.'):
@@ -450,12 +660,9 @@ def situation_semantics_processing(situations: list, events_and_nouns: EventsAnd
                     # TODO: Pending pystardog fix: Change line above to using RDF star property
                 if event_state["same_or_opposite"] == 'opposite':
                     semantics_ttl.append(f'{event_iri} :negated-{event_class_name[1:]} true .')
-            noun_roles_dict = dict()
-            for noun in sentence['nouns']:
-                noun_roles_dict[noun['noun_text']] = noun['semantic_role']
+            noun_roles_dict = _get_noun_roles(sentence)
             # Get noun categories and details, and assemble the Turtle for the nouns
-            situation_nouns_dict = access_api(nouns_prompt.
-                                              replace('{noun_phrases}', " ** ".join(noun_roles_dict.keys())))
+            situation_nouns_dict = nouns_futures[index][sent_index].result()
             noun_ttl = _deal_with_nouns(event_iri, event_classes, situation_nouns_dict, noun_roles_dict,
                                         events_and_nouns, nouns_dict)
             semantics_ttl.extend(noun_ttl)
@@ -7,6 +7,7 @@ import requests
 
 from bs4 import BeautifulSoup
 
+from dna.http_sessions import http_get
 from dna.utilities_and_language_specific import add_to_dictionary_values, empty_string, space
 
 news_key = os.environ.get('NEWS_API_KEY', 'None')
@@ -141,7 +142,7 @@ def _get_nyt(dictionary: dict, nyt_request: str, page_number: int):
     """
     request = nyt_request.replace('{page}', str(page_number))
     try:
-        resp = requests.get(request, timeout=10)
+        resp = http_get(request, timeout=10)
     except requests.exceptions.ConnectTimeout:
         logging.error(f'NYT API timeout: Query={request}')
         return
@@ -180,7 +181,7 @@ def _get_wsj(request_details: dict, wsj_request: str):
     :return: N/A (the dictionary is updated)
     """
     try:
-        web_page = requests.get(wsj_request, headers=headers, timeout=10)
+        web_page = http_get(wsj_request, headers=headers, timeout=10)
     except requests.exceptions.ConnectTimeout:
         logging.error(f'WSJ search timeout, {url}')
         return empty_string
@@ -261,7 +262,7 @@ def _process_html(url: str) -> str:
     # elif '.wsj.' in url:      TODO: Return _wsj_text(url)
     # else:
     try:
-        web_page = requests.get(url, headers=headers, timeout=10)
+        web_page = http_get(url, headers=headers, timeout=10)
     except requests.exceptions.ConnectTimeout:
         logging.error(f'News text timeout for url, {url}')
         return empty_string
@@ -318,7 +319,7 @@ def get_articles(dictionary: dict, news_request: str, source_list: str, page_num
     """
     request = news_request.replace('{sources}', source_list).replace('{page}', str(page_number))
     try:
-        resp = requests.get(request, timeout=10)
+        resp = http_get(request, timeout=10)
     except requests.exceptions.ConnectTimeout:
         logging.error(f'NewsAPI timeout: Query={request}')
         return
@@ -360,7 +361,7 @@ def get_article_text(url: str) -> str:
     if 'removed.com' in url or _check_excluded(url):
         return empty_string
     elif url.startswith('https://news.google.com/'):
-        interim_soup = BeautifulSoup(requests.get(url).text, 'html.parser')
+        interim_soup = BeautifulSoup(http_get(url).text, 'html.parser')
         # Future: FinancialTimes url ref not in og:url but = www.ft.com/content/id,
         #   where id in <script> LD, trackingData->pageDescription->rootContentId
         new_url = interim_soup.find_all('meta', {'property': 'og:url'})
@@ -1,18 +1,46 @@
 # Query for details using OpenAI
 # Constants, prompts (titled xxx_prompt) and JSON formats (titled xxx_result)
 
+import asyncio
 import json
 import logging
 import os
-
-from openai import OpenAI
+import random
+import re
+import threading
+import time
+from typing import Union
+
+import openai
+from openai import AsyncOpenAI, OpenAI
 from dna.prompting_ontology_details import base_event_category_texts
+from dna.response_cache import ResponseCache
 from dna.utilities_and_language_specific import modals
-# from tenacity import *
 
 openai_api_key = os.environ.get('OPENAI_API_KEY')
 model_engine = "gpt-4o"
-client = OpenAI()
+_client = None    # OpenAI client, created on first use (see get_client)
+_client_lock = threading.Lock()
+# Maximum number of OpenAI requests issued concurrently for a narrative (using threads), and
+#    the maximum number of requests in flight for a batch (using asyncio)
+openai_max_workers = int(os.environ.get('OPENAI_MAX_WORKERS', '8'))
+openai_max_in_flight = int(os.environ.get('OPENAI_MAX_IN_FLIGHT', '16'))
+# Account rate limits (requests and tokens per minute) and the number of retries of a request
+openai_requests_per_minute = int(os.environ.get('OPENAI_REQUESTS_PER_MINUTE', '500'))
+openai_tokens_per_minute = int(os.environ.get('OPENAI_TOKENS_PER_MINUTE', '300000'))
+openai_max_retries = int(os.environ.get('OPENAI_MAX_RETRIES', '6'))
+expected_response_tokens = 1000    # Estimate of the tokens in a response (for rate limiting)
+# Maximum number of sentences, and estimated tokens for the sentences and their results, in a batched sentence_prompt
+sentence_batch_size = int(os.environ.get('OPENAI_SENTENCE_BATCH_SIZE', '10'))
+sentence_batch_tokens = int(os.environ.get('OPENAI_SENTENCE_BATCH_TOKENS', '3000'))
+# Sampling parameters for all requests
+response_format = {"type": "json_object"}
+temperature = 0.05
+top_p = 0.1
+# Cache of the responses, keyed by the prompt, model_engine and sampling parameters
+openai_cache = ResponseCache('openai', ttl=float(os.environ.get('OPENAI_CACHE_TTL_SECONDS', str(30 * 24 * 3600))),
+                             max_entries=int(os.environ.get('OPENAI_CACHE_MAX_ENTRIES', '200000')),
+                             enabled=os.environ.get('OPENAI_CACHE', 'on').lower() != 'off')
 
 any_boolean = 'true/false'
 interpretation_views = 'conservative, liberal or neutral'
@@ -212,6 +240,9 @@ narrative_classification_result = '{"subject_areas": [int], ' \
 sentence_result = '{"grade_level": int, ' \
                   '"rhetorical_devices": [{"device_number": int, "explanation": "string"}]}'
 
+sentence_batch_result = '{"sentences": [{"sentence_number": int, "grade_level": int, ' \
+                        '"rhetorical_devices": [{"device_number": int, "explanation": "string"}]}]}'
+
 situation_result = '{"simpler_sentences": [{' \
                    '"text": "string", "future_tense": bool, "modal": "string", ' \
                    '"semantics": [{ ' \
@@ -342,7 +373,7 @@ narrative_classification_prompt = \
 
 # Sentence-level prompting
 sentence_prompt = \
-    f'<Task: You are ChatGPT, a large language model trained by OpenAI using the GPT-4 architecture, with expertise ' \
+    '<Task: You are ChatGPT, a large language model trained by OpenAI using the GPT-4 architecture, with expertise ' \
     'in linguistics and natural language processing (NLP). Your objective is to analyze a sentence from a narrative ' \
     'or news article.> ' + \
     '<Instructions: 1. Input Formats: a) You are given the text of a sentence from an article, where ' \
@@ -355,6 +386,23 @@ sentence_prompt = \
     '<Inputs: 1. Sentence text: {sent_text} ** ' + \
     f'2. Rhetorical devices: {rhetorical_device_texts}> ' \
     f'<Output: Return the results as a JSON object using the following structure: {sentence_result}>'
+
+# Sentence-level prompting for a set of sentences (where each sentence is analyzed as in the sentence_prompt)
+sentence_batch_prompt = \
+    '<Task: You are ChatGPT, a large language model trained by OpenAI using the GPT-4 architecture, with expertise ' \
+    'in linguistics and natural language processing (NLP). Your objective is to analyze a set of sentences from a ' \
+    'narrative or news article.> ' + \
+    '<Instructions: 1. Input Formats: a) You are given a JSON object whose keys are sentence numbers and whose ' \
+    'values are the texts of sentences from an article. The JSON object ends with the string "**" which is ' \
+    'ignored. b) A numbered list of rhetorical devices that may be used in the sentences, is also provided. ' \
+    '2. Sentence Analysis: Analyze EACH sentence independently of the other sentences. a) Indicate the grade ' \
+    'level that is expected of a reader to understand the sentence semantics. b) Provide the numbers of the ' \
+    'various rhetorical devices used in the sentence, and explain why they are identified. If there are no ' \
+    'rhetorical devices used, return an empty array for the "rhetorical_devices" JSON key, specified in the ' \
+    'Output. 3. Return exactly one entry in the "sentences" array for each sentence number. > ' \
+    '<Inputs: 1. Sentences: {sentences_json} ** ' + \
+    f'2. Rhetorical devices: {rhetorical_device_texts}> ' \
+    f'<Output: Return the results as a JSON object using the following structure: {sentence_batch_result}>'
 # Sentence analysis - c) Create a summary of the sentence using 15 ' \
 #     'words or less, ONLY if the input sentence has more than 10 words. If the input sentence is 10 words or ' \
 #     'less, do not return a summary. When creating a summary, do not use figurative language or idioms, and ' \
@@ -412,33 +460,284 @@ situation_prompt = \
     f'<Output: Return the results as a JSON object using the following structure: {situation_result}>'
 
 
-# @retry(stop=stop_after_delay(20) | stop_after_attempt(2), wait=(wait_fixed(3) + wait_random(0, 2)))
-def access_api(content: str) -> dict:
+class RateLimiter:
+    """
+    Token buckets for the OpenAI requests/minute and tokens/minute limits, shared by all threads and
+    asyncio tasks. Callers reserve capacity before sending a request and wait for the returned time.
+    The buckets are adjusted using the rate limit headers of each response, and all callers are paused
+    when a 'too many requests' (429) error is returned.
     """
-    Surrounding the calls to the OpenAI API with retry logic.
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_second = requests_per_minute / 60
+        self.tokens_per_second = tokens_per_minute / 60
+        self.request_capacity = float(requests_per_minute)
+        self.token_capacity = float(tokens_per_minute)
+        self.available_requests = self.request_capacity
+        self.available_tokens = self.token_capacity
+        self.paused_until = 0.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        # Must be called holding the lock
+        elapsed = now - self.updated
+        self.available_requests = min(self.request_capacity,
+                                      self.available_requests + elapsed * self.requests_per_second)
+        self.available_tokens = min(self.token_capacity, self.available_tokens + elapsed * self.tokens_per_second)
+        self.updated = now
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reserve the capacity for a request.
+
+        :param tokens: Integer holding the estimated number of tokens for the request and response
+        :return: The number of seconds to wait before sending the request
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.available_requests -= 1
+            self.available_tokens -= min(tokens, self.token_capacity)
+            return max(0.0, self.paused_until - now, -self.available_requests / self.requests_per_second,
+                       -self.available_tokens / self.tokens_per_second)
+
+    def pause(self, seconds: float):
+        """
+        Pause all requests for the specified number of seconds.
+
+        :param seconds: Float holding the number of seconds
+        :return: None
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """
+        Align the buckets with the remaining requests and tokens reported by OpenAI.
+
+        :param headers: The HTTP headers of a response
+        :return: None
+        """
+        try:
+            remaining_requests = headers.get('x-ratelimit-remaining-requests')
+            remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+            with self._lock:
+                self._refill(time.monotonic())
+                if remaining_requests is not None:
+                    self.available_requests = min(self.available_requests, float(remaining_requests))
+                if remaining_tokens is not None:
+                    self.available_tokens = min(self.available_tokens, float(remaining_tokens))
+            if remaining_requests is not None and int(remaining_requests) == 0:
+                self.pause(_get_reset_seconds(headers.get('x-ratelimit-reset-requests', '1s')))
+            if remaining_tokens is not None and int(remaining_tokens) == 0:
+                self.pause(_get_reset_seconds(headers.get('x-ratelimit-reset-tokens', '1s')))
+        except (TypeError, ValueError) as e:
+            logging.info(f'Invalid OpenAI rate limit headers: {str(e)}')
+
+
+rate_limiter = RateLimiter(openai_requests_per_minute, openai_tokens_per_minute)
+
+
+def _estimate_tokens(content: str) -> int:
+    """
+    Estimate the number of tokens used by a request (approximately 4 characters per token) and its response.
 
     :param content: String holding the content of the completion request
-    :return: The 'content' response from the API as a Python dictionary
+    :return: Integer holding the estimated number of tokens
     """
-    try:
-        response = client.chat.completions.create(
-            model=model_engine,
-            messages=[
-                {"role": "user", "content": content}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.05,
-            top_p=0.1
-        )
-        if "finish_reason='stop'" not in str(response):
-            logging.error(f'Non-stop finish response, {str(response)}, for content, {content}')
-            return dict()
-    except Exception as e:
-        logging.error(f'OpenAI exception for content, {content}: {str(e)}')
+    return len(content) // 4 + expected_response_tokens
+
+
+def _get_completion_args(content: str) -> dict:
+    """
+    Get the arguments of the chat completion request for the content.
+
+    :param content: String holding the content of the completion request
+    :return: Dictionary holding the request arguments
+    """
+    return {'model': model_engine,
+            'messages': [{"role": "user", "content": content}],
+            'response_format': response_format,
+            'temperature': temperature,
+            'top_p': top_p}
+
+
+def _get_reset_seconds(reset: str) -> float:
+    """
+    Convert a rate limit reset time (such as "1s", "6m0s" or "20ms") to seconds.
+
+    :param reset: String holding the reset time
+    :return: The number of seconds
+    """
+    seconds = 0.0
+    for value, unit in re.findall(r'([0-9.]+)(ms|h|m|s)', reset):
+        seconds += float(value) * {'ms': 0.001, 'h': 3600, 'm': 60, 's': 1}[unit]
+    return seconds
+
+
+def _get_response_dict(response, content: str) -> dict:
+    """
+    Get the JSON content from a chat completion response.
+
+    :param response: The ChatCompletion returned by OpenAI
+    :param content: String holding the content of the completion request
+    :return: The 'content' response as a Python dictionary, or an empty dictionary if invalid
+    """
+    if "finish_reason='stop'" not in str(response):
+        logging.error(f'Non-stop finish response, {str(response)}, for content, {content}')
         return dict()
     try:
-        resp_dict = json.loads(response.choices[0].message.content.replace('\n', ' '))
+        return json.loads(response.choices[0].message.content.replace('\n', ' '))
     except Exception as e:
         logging.error(f'Invalid JSON content ({str(e)}): {response.choices[0].message.content}')
         return dict()
+
+
+def _get_retry_delay(error: Exception, attempt: int) -> Union[float, None]:
+    """
+    Determine whether a request should be retried after an exception, and how long to wait. For a rate
+    limit (429) error, all requests are paused.
+
+    :param error: The exception raised by the OpenAI client
+    :param attempt: Integer holding the number of the attempt that failed (starting from 0)
+    :return: The number of seconds to wait before retrying, or None if the request should not be retried
+    """
+    if attempt >= openai_max_retries:
+        return None
+    backoff = min(60.0, 2.0 ** attempt) + random.uniform(0, 1)
+    if isinstance(error, openai.RateLimitError):
+        if 'insufficient_quota' in str(error):
+            return None
+        headers = error.response.headers
+        delay = backoff
+        if headers.get('retry-after-ms'):
+            delay = float(headers['retry-after-ms']) / 1000
+        elif headers.get('retry-after') and headers['retry-after'].replace('.', '').isdigit():
+            delay = float(headers['retry-after'])
+        elif headers.get('x-ratelimit-reset-tokens') or headers.get('x-ratelimit-reset-requests'):
+            delay = max(_get_reset_seconds(headers.get('x-ratelimit-reset-tokens', '0s')),
+                        _get_reset_seconds(headers.get('x-ratelimit-reset-requests', '0s')))
+        delay = max(delay, 0.1) + random.uniform(0, 0.5)
+        rate_limiter.pause(delay)
+        return delay
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):   # Includes timeouts
+        return backoff
+    return None
+
+
+def get_client() -> OpenAI:
+    """
+    Get the OpenAI client, creating it on first use (so that importing the module does not initialize the client).
+
+    :return: The OpenAI client
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(max_retries=0)    # Retries are handled in access_api, using the rate_limiter
+        return _client
+
+
+def access_api(content: str, use_cache: bool = True) -> dict:
+    """
+    Surrounding the calls to the OpenAI API with rate limiting and retry logic. Successful responses are cached.
+
+    :param content: String holding the content of the completion request
+    :param use_cache: Boolean indicating that a cached response can be returned (if false, the
+                      request is always sent to OpenAI and the response is not cached)
+    :return: The 'content' response from the API as a Python dictionary
+    """
+    cache_key = ResponseCache.make_key(content, model_engine, response_format, temperature, top_p)
+    if use_cache:
+        found, resp_dict = openai_cache.get(cache_key)
+        if found:
+            return resp_dict
+    attempt = 0
+    while True:
+        time.sleep(rate_limiter.reserve(_estimate_tokens(content)))
+        try:
+            raw_response = get_client().chat.completions.with_raw_response.create(**_get_completion_args(content))
+            rate_limiter.update_from_headers(raw_response.headers)
+            response = raw_response.parse()
+            break
+        except Exception as e:
+            delay = _get_retry_delay(e, attempt)
+            if delay is None:
+                logging.error(f'OpenAI exception for content, {content}: {str(e)}')
+                return dict()
+            logging.info(f'OpenAI exception ({str(e)}), retrying in {delay:.1f} seconds')
+            time.sleep(delay)
+            attempt += 1
+    resp_dict = _get_response_dict(response, content)
+    if use_cache and resp_dict:
+        openai_cache.put(cache_key, resp_dict)
     return resp_dict
+
+
+async def access_api_async(content: str, use_cache: bool = True, async_client: AsyncOpenAI = None,
+                           semaphore: asyncio.Semaphore = None) -> dict:
+    """
+    Asyncio version of access_api, using the same rate limiting, retry logic and cache.
+
+    :param content: String holding the content of the completion request
+    :param use_cache: Boolean indicating that a cached response can be returned (if false, the
+                      request is always sent to OpenAI and the response is not cached)
+    :param async_client: An AsyncOpenAI client (if not specified, a client is created for the request)
+    :param semaphore: An optional asyncio Semaphore bounding the number of requests in flight
+    :return: The 'content' response from the API as a Python dictionary
+    """
+    if not async_client:
+        async with AsyncOpenAI(max_retries=0) as new_client:
+            return await access_api_async(content, use_cache, new_client, semaphore)
+    cache_key = ResponseCache.make_key(content, model_engine, response_format, temperature, top_p)
+    if use_cache:
+        found, resp_dict = openai_cache.get(cache_key)
+        if found:
+            return resp_dict
+    semaphore = semaphore if semaphore else asyncio.Semaphore(1)
+    attempt = 0
+    while True:
+        await asyncio.sleep(rate_limiter.reserve(_estimate_tokens(content)))
+        try:
+            async with semaphore:
+                raw_response = \
+                    await async_client.chat.completions.with_raw_response.create(**_get_completion_args(content))
+            rate_limiter.update_from_headers(raw_response.headers)
+            response = raw_response.parse()
+            break
+        except Exception as e:
+            delay = _get_retry_delay(e, attempt)
+            if delay is None:
+                logging.error(f'OpenAI exception for content, {content}: {str(e)}')
+                return dict()
+            logging.info(f'OpenAI exception ({str(e)}), retrying in {delay:.1f} seconds')
+            await asyncio.sleep(delay)
+            attempt += 1
+    resp_dict = _get_response_dict(response, content)
+    if use_cache and resp_dict:
+        openai_cache.put(cache_key, resp_dict)
+    return resp_dict
+
+
+async def _access_api_gather(contents: list, use_cache: bool) -> list:
+    semaphore = asyncio.Semaphore(openai_max_in_flight)
+    async with AsyncOpenAI(max_retries=0) as async_client:
+        return await asyncio.gather(
+            *[access_api_async(content, use_cache, async_client, semaphore) for content in contents])
+
+
+def access_api_batch(contents: list, use_cache: bool = True) -> list:
+    """
+    Send a set of completion requests concurrently using asyncio, with at most openai_max_in_flight
+    requests in flight and within the account's rate limits. Must not be called from a running event loop
+    (use access_api_async instead).
+
+    :param contents: Array of strings holding the contents of the completion requests
+    :param use_cache: Boolean indicating that cached responses can be returned
+    :return: Array of the 'content' responses (Python dictionaries, which are empty if an error occurred),
+             in the same order as the contents
+    """
+    if not contents:
+        return []
+    return asyncio.run(_access_api_gather(contents, use_cache))
@@ -2,20 +2,46 @@
 # Called from get_ontology_mapping.py
 
 import datetime
+import functools
+import inspect
 import logging
 import os
 import re
+import threading
 import time
-from dataclasses import dataclass
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import asdict, dataclass, is_dataclass
 
 import requests
 from typing import Union
 import xml.etree.ElementTree as etree
 
+from dna import local_sources
+from dna.http_sessions import http_connect_timeout, http_get, http_read_timeout
+from dna.rate_limits import source_rate_limiters, sources_max_wait
+from dna.response_cache import ResponseCache
+from dna.subclass_closure import get_closure
 # TODO: Move from hardcoding country and language
 from dna.utilities_and_language_specific import add_unique_to_array, country_qualifier, empty_string, \
     language_tags, space, underscore
 
+# Backend answering the lookups - 'api' (the GeoNames, Wikidata and Wikipedia APIs) or 'local' (see local_sources.py)
+source_backend = os.environ.get('DNA_SOURCE_BACKEND', 'api').lower()
+
+# Caches of the lookups (keyed by the normalized query), where "not found" results are cached for a shorter time
+sources_cache_enabled = os.environ.get('SOURCES_CACHE', 'on').lower() != 'off'
+sources_negative_ttl = float(os.environ.get('SOURCES_CACHE_NEGATIVE_TTL_SECONDS', 24 * 60 * 60))
+geonames_cache = ResponseCache('geonames', ttl=float(os.environ.get('GEONAMES_CACHE_TTL_SECONDS', 90 * 24 * 60 * 60)),
+                               enabled=sources_cache_enabled)
+wikidata_cache = ResponseCache('wikidata', ttl=float(os.environ.get('WIKIDATA_CACHE_TTL_SECONDS', 30 * 24 * 60 * 60)),
+                               enabled=sources_cache_enabled)
+wikipedia_cache = ResponseCache('wikipedia',
+                                ttl=float(os.environ.get('WIKIPEDIA_CACHE_TTL_SECONDS', 30 * 24 * 60 * 60)),
+                                enabled=sources_cache_enabled)
+# Count of the failed requests (timeouts, exceptions, server errors) in the current thread, so that a "not found"
+#    result caused by a failure is not cached
+_request_failures = threading.local()
+
 geonames_user = os.environ.get('GEONAMES_ID')
 geocodes_mapping = {'H': ':WaterFeature',
                     'L': ':DesignatedArea',
@@ -25,6 +51,9 @@ geocodes_mapping = {'H': ':WaterFeature',
                     'U': ':WaterFeature',
                     'V': ':GeographicFeature'}
 geonames_url = 'http://api.geonames.org/search?'
+# GeoNames status codes for exceeding the daily, hourly and weekly limits, and the time that requests are blocked
+geonames_limit_status = {'18': 24 * 60 * 60, '19': 60 * 60, '20': 7 * 24 * 60 * 60}
+sources_max_retries = int(os.environ.get('SOURCES_MAX_RETRIES', 3))   # Retries after a 'too many requests' response
 
 wikibase_bearer = os.environ.get('WDATA_BEARER')
 wikibase_headers = {'Content-Type': 'application/json',
@@ -37,12 +66,15 @@ qid_mapping = {'PERSON': 'Q5, Q214339, Q4164871, Q12737077, Q28640',  # human, r
                'ORG': 'Q43229, Q106668099, Q131085629',               # organization, corporate body, collective agent
                'GPE': 'Q16562419, Q1063239, Q3455524',                # political entity, polity, administrative region
                'LOC': 'Q17334923, Q123349660',                        # physical location, geo-locatable entity
-               'FAC': ':Q27096235',                                   # artificial geographic entity (non-natural)
+               'FAC': 'Q27096235',                                    # artificial geographic entity (non-natural)
                'EVENT': 'Q1190554, Q3505845, Q483247',                # occurrence, state, phenomenon
                'DATE': 'Q26907166',                                   # temporal entity
-               'LAW': 'Q7748, Q1151067,Q1156854',                     # law, rule, policy
+               'LAW': 'Q7748, Q1151067, Q1156854',                    # law, rule, policy
                'PRODUCT': 'Q2424752',                                 # product
                'WORK_OF_ART': 'Q838948, Q2342494'}                    # work of art, collectible
+qid_mapping_roots = [qid for qids in qid_mapping.values() for qid in qids.split(', ')]
+# Indicates whether WDQS (or the local index) is queried for items that are not in the subclass closure
+subclass_fallback = os.environ.get('DNA_SUBCLASS_FALLBACK', 'on').lower() != 'off'
 wikidata_rest_url = 'https://www.wikidata.org/w/rest.php/wikibase/v1/entities/items/'
 
 wdqs_url = 'https://query.wikidata.org/sparql?format=json&query='
@@ -87,6 +119,43 @@ class GeoNamesDetails:
     wiki_link: str          # Wikipedia page link or empty string
 
 
+def _cached_lookup(cache: ResponseCache, result_class: type = None):
+    """
+    Decorator caching the results of a lookup function, keyed by the function name and its (normalized)
+    arguments. Results that are empty (or, for dataclasses, have an empty first field) are cached using the
+    sources_negative_ttl, unless a request failed during the lookup (in which case, the result is not cached).
+    Lookups are not cached when using the local backend.
+
+    :param cache: The ResponseCache instance for the source
+    :param result_class: The dataclass returned by the function (if the function returns a dataclass)
+    :return: The decorator
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if source_backend == 'local':
+                return func(*args, **kwargs)
+            bound_args = signature.bind(*args, **kwargs)
+            bound_args.apply_defaults()
+            key = cache.make_key(func.__name__, [_normalize_query(arg) if isinstance(arg, str) else arg
+                                                 for arg in bound_args.arguments.values()])
+            found, value = cache.get(key)
+            if found:
+                return result_class(**value) if result_class else value
+            failures = _get_request_failures()
+            result = func(*args, **kwargs)
+            if _get_request_failures() > failures:
+                return result
+            value = asdict(result) if is_dataclass(result) else result
+            found = value[next(iter(value))] if result_class else value
+            cache.put(key, value, ttl=None if found else sources_negative_ttl)
+            return result
+        return wrapper
+    return decorator
+
+
 def _call_geonames(request: str, loc_str: str) -> Union[etree.Element, None]:
     """
     Send and process a query to the GeoNames API.
@@ -95,18 +164,21 @@ def _call_geonames(request: str, loc_str: str) -> Union[etree.Element, None]:
     :param loc_str: A string holding the text identifying the location.
     :return: The GeoNames response
     """
-    try:
-        response = requests.get(request)
-    except requests.exceptions.ConnectTimeout:
-        logging.error(f'GeoNames timeout: Query={request}')
-        return None
-    except requests.exceptions.RequestException as e:
-        logging.error(f'GeoNames query error: Query={request} and Exception={str(e)}')
+    response = _send_request('geonames', request)
+    if response is None:
         return None
     try:
         orig_root = etree.fromstring(response.content)
     except Exception as e:
         logging.error(f'etree.fromstring Exception={str(e)} for response, {response.content}')
+        _record_request_failure()
+        return None
+    status = orig_root.find('./status')
+    if status is not None:
+        logging.error(f'GeoNames error: Query={request} and Status={status.get("message")}')
+        if status.get('value') in geonames_limit_status:
+            source_rate_limiters['geonames'].block(geonames_limit_status[status.get('value')])
+        _record_request_failure()
         return None
     toponym_name = _get_xml_value('./geoname/toponymName', orig_root)
     ascii_name = _get_xml_value('./geoname/asciiName', orig_root)
@@ -124,34 +196,25 @@ def _call_geonames(request: str, loc_str: str) -> Union[etree.Element, None]:
     return None
 
 
+@_cached_lookup(wikidata_cache)
 def _call_wdqs(query: str, retry: bool = True) -> Union[dict, None]:
     """
     Processes a query to the Wikidata query service.
 
     :param query: String holding the query.
-    :param retry: Boolean indicating that the request be retried on an exception or 'too many requests' error
+    :param retry: Boolean indicating that the request be retried once on an exception (other than a timeout)
     :return: Either the query results or None if the request was not successful
     """
-    try:
-        response = requests.get(f'{wdqs_url}{query.replace(" ", "%20")}')
-    except requests.exceptions.ConnectTimeout:
-        logging.error(f'Wikidata timeout: Query={query}')
+    response = _send_request('wdqs', f'{wdqs_url}{query.replace(" ", "%20")}', error_retries=1 if retry else 0)
+    if response is None:
         return None
-    except requests.exceptions.RequestException as e:
-        if retry:
-            return _call_wdqs(query, retry=False)
-        else:
-            return None
     if response.status_code == 200:
         if response.json()['results']['bindings']:
             return response.json()
         else:
             return None
-    if response.status_code == 429:     # Too many requests
-        timeout = _get_wikidata_delay(response.headers['retry-after'])
-        logging.info(f'Wikidata timeout: {timeout} seconds')
-        time.sleep(timeout)
-        return _call_wdqs(query)
+    logging.error(f'Wikidata query error: Query={query} and Status={response.status_code}')
+    _record_request_failure()
     return None
 
 
@@ -164,13 +227,14 @@ def _call_wikidata_rest(path_parameters: str) -> Union[str, list]:
     :param path_parameters: String holding the path parameters
     :return: The Wikidata REST API result as defined
     """
-    try:
-        response = requests.get(f'{wikidata_rest_url}{path_parameters}', headers=wikibase_headers)
-    except requests.exceptions as e:
-        logging.error(f'Wikidata REST exception for parameters: {path_parameters}. Exception: {str(e)}')
+    response = _send_request('wikidata', f'{wikidata_rest_url}{path_parameters}', headers=wikibase_headers,
+                             conditional=True)
+    if response is None:
         return empty_string
     if response.status_code == 200:
         return response.json()
+    if response.status_code >= 500:
+        _record_request_failure()
     return empty_string
 
 
@@ -181,13 +245,14 @@ def _call_wikipedia(noun_text: str) -> dict:
     :param noun_text: String holding the noun/concept text
     :return: Dictionary holding the details returned from Wikipedia
     """
-    try:
-        response = requests.get(f'{wikipedia_summary_url}{noun_text}')
-    except requests.exceptions.ConnectTimeout:
-        logging.error(f'Wikipedia description timeout: Noun={noun_text}')
+    if source_backend == 'local':
+        return local_sources.get_wikipedia_summary(noun_text)
+    response = _send_request('wikipedia', f'{wikipedia_summary_url}{noun_text}', conditional=True)
+    if response is None:
         return dict()
-    except requests.exceptions.RequestException as e:
-        logging.error(f'Wikipedia description query exception for noun: {noun_text}. Exception: {str(e)}')
+    if response.status_code >= 500:
+        logging.error(f'Wikipedia description error for noun: {noun_text}. Status: {response.status_code}')
+        _record_request_failure()
         return dict()
     wiki_dict = response.json()
     if 'title' in wiki_dict and 'not found' in wiki_dict['title'].lower():
@@ -218,22 +283,33 @@ def _get_geonames_alt_names(root: etree.Element) -> (list, str):
     return list(names), link
 
 
+def _get_request_failures() -> int:
+    """
+    Get the number of failed requests to the sources in the current thread.
+
+    :return: Integer holding the count of failures
+    """
+    return getattr(_request_failures, 'count', 0)
+
+
 def _get_wikidata_delay(date: str) -> int:
     """
     If too many Wikidata requests are made, then a 'retry after' time limit is set. This method
     calculates the time limit.
 
-    :param date: A string with the 'retry after' time
-    :return: An integer indicating how many seconds to delay
+    :param date: A string with the 'retry after' time (an HTTP date or a number of seconds)
+    :return: An integer indicating how many seconds to delay (5 seconds if the time is not valid)
     """
     try:
-        datetime_obj = datetime.datetime.strptime(date, '%a, %d %b %Y %H:%M:%S GMT')
-        timeout = int((datetime_obj - datetime.datetime.now()).total_seconds())
+        datetime_obj = datetime.datetime.strptime(date, '%a, %d %b %Y %H:%M:%S GMT').\
+            replace(tzinfo=datetime.timezone.utc)
+        timeout = int((datetime_obj - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
     except ValueError:
-        timeout = int(date)
-    return timeout
+        timeout = int(date) if date.strip().isdigit() else 5
+    return max(timeout, 0)
 
 
+@_cached_lookup(wikidata_cache)
 def _get_wikidata_labels(wikidata_id: str, retry: bool = True) -> list:
     """
     Get the labels (labels and aliases) for a Wikidata item using the Wikidata REST API.
@@ -244,6 +320,8 @@ def _get_wikidata_labels(wikidata_id: str, retry: bool = True) -> list:
     """
     if not wikidata_id:
         return []
+    if source_backend == 'local':
+        return local_sources.get_wikidata_labels(wikidata_id)
     labels = []
     for tag in language_tags:
         label = _call_wikidata_rest(f'{wikidata_id}/labels/{tag}')
@@ -303,15 +381,35 @@ def _get_wikipedia_description(noun_text: str, ner_type: str, explicit_link: str
         qid = wiki_dict['wikibase_item']
         if ner_type in qid_mapping:
             for possible_superclass in qid_mapping[ner_type].split(', '):
-                class_query = wdqs_instance_of.replace('?item', f'wd:{qid}').\
-                    replace('poss_super', possible_superclass)
-                resp_json = _call_wdqs(class_query)
-                if resp_json and 'results' in resp_json and 'bindings' in resp_json['results'] and \
-                        len(resp_json['results']['bindings']) > 0:
+                if _is_instance_of(qid, possible_superclass):
                     return wiki_dict
     return dict()
 
 
+def _is_instance_of(qid: str, superclass: str) -> bool:
+    """
+    Check whether a Wikidata item is an instance of a class or any of its subclasses (wdt:P31/wdt:P279*).
+    The precomputed subclass closure is checked first, and then (if the item is not in the closure and
+    subclass_fallback is set) the local index or WDQS is queried.
+
+    :param qid: String holding the Q ID of the Wikidata item
+    :param superclass: String holding the Q ID of the class
+    :return: True if the item is an instance of the class, False otherwise
+    """
+    closure = get_closure()
+    is_instance = closure.is_instance_of(qid, superclass) if closure else None
+    if is_instance is not None:
+        return is_instance
+    if closure and not subclass_fallback:
+        return False
+    if source_backend == 'local':
+        return local_sources.is_instance_of(qid, superclass)
+    class_query = wdqs_instance_of.replace('?item', f'wd:{qid}').replace('poss_super', superclass)
+    resp_json = _call_wdqs(class_query)
+    return bool(resp_json and 'results' in resp_json and 'bindings' in resp_json['results'] and
+                len(resp_json['results']['bindings']) > 0)
+
+
 def _get_xml_value(xpath: str, root: etree.Element) -> str:
     """
     Use the input xpath string to access specific elements in an XML tree.
@@ -328,6 +426,79 @@ def _get_xml_value(xpath: str, root: etree.Element) -> str:
         return empty_string
 
 
+def _normalize_query(query_text: str) -> str:
+    """
+    Normalize the text of a query for use in a cache key, by removing leading/trailing white space and
+    underscores and collapsing internal white space and underscores to a single space. Case is preserved since
+    the sources are (partially) case-sensitive.
+
+    :param query_text: String holding the query text
+    :return: The normalized string
+    """
+    return space.join(query_text.replace(underscore, space).split())
+
+
+def _record_request_failure():
+    """
+    Record that a request to a source failed (due to a timeout, exception or server error) in the current thread.
+
+    :return: None
+    """
+    _request_failures.count = _get_request_failures() + 1
+
+
+def _send_request(source: str, url: str, headers: dict = None, error_retries: int = 0, conditional: bool = False) \
+        -> Union[requests.Response, None]:
+    """
+    Send a GET request to a source, queued by the source's rate limiter. A 'too many requests' response blocks
+    all requests to the source for the retry-after time, and the request is then retried (up to
+    sources_max_retries times). The request and its retries must be sent within sources_max_wait seconds;
+    Otherwise, the request fails (without being sent, if it is still queued).
+
+    :param source: String identifying the source (a key of rate_limits' source_rate_limiters)
+    :param url: String holding the request URL
+    :param headers: Dictionary of the request headers
+    :param error_retries: Number of times that the request is retried on an exception (other than a timeout)
+    :param conditional: Boolean indicating that the response is cached and revalidated using its ETag or
+                        Last-Modified header (see http_sessions' http_get)
+    :return: The response or None if the request failed (in which case, the failure is recorded)
+    """
+    limiter = source_rate_limiters[source]
+    deadline = time.time() + sources_max_wait
+    throttled = 0
+    while True:
+        future = limiter.submit(http_get, url, max_wait=deadline - time.time(), headers=headers,
+                                conditional=conditional)
+        if not future:     # Rejected, since the wait would exceed the deadline
+            break
+        try:
+            # Once sent (by the deadline), the request is limited by the HTTP timeouts
+            response = future.result(timeout=max(deadline - time.time(), 0) + http_connect_timeout +
+                                     http_read_timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            logging.error(f'{source} request not completed within the maximum wait: Request={url}')
+            break
+        except requests.exceptions.Timeout:
+            logging.error(f'{source} timeout: Request={url}')
+            break
+        except requests.exceptions.RequestException as e:
+            if error_retries > 0:
+                error_retries -= 1
+                continue
+            logging.error(f'{source} request exception: Request={url} and Exception={str(e)}')
+            break
+        if response.status_code != 429:    # Too many requests
+            return response
+        limiter.block(_get_wikidata_delay(response.headers.get('retry-after', empty_string)))
+        throttled += 1
+        if throttled > sources_max_retries:
+            logging.error(f'{source} too many requests: Request={url}')
+            break
+    _record_request_failure()
+    return None
+
+
 def get_event_details_from_wikidata(event_text: str) -> EventDetails:
     """
     Get the start and end times and alternate names of an event, if it is known to Wikidata.
@@ -337,13 +508,16 @@ def get_event_details_from_wikidata(event_text: str) -> EventDetails:
     """
     start_time = end_time = empty_string
     description_details = get_wikipedia_description(event_text, 'EVENT')
-    if description_details.wikidata_id:
+    if description_details.wikidata_id and source_backend == 'local':
+        start_time, end_time = local_sources.get_wikidata_times(description_details.wikidata_id)
+    elif description_details.wikidata_id:
         time_query = wdqs_event_time.replace('?item', f'wd:{description_details.wikidata_id}')
         start_time, end_time = _get_wikidata_time(time_query, True)
     return EventDetails(description_details.wiki_desc, description_details.wiki_url,
                         description_details.wikidata_id, start_time, end_time, description_details.labels)
 
 
+@_cached_lookup(geonames_cache, GeoNamesDetails)
 def get_geonames_location(loc_text: str) -> GeoNamesDetails:
     """
     Get the type of location from its text as well as its country and administrative level (if relevant).
@@ -353,7 +527,10 @@ def get_geonames_location(loc_text: str) -> GeoNamesDetails:
     """
     # TODO: Add sleep to meet geonames timing requirements
     name_startswith = False
-    if ',' in loc_text:   # Different query parameters are defined based on ',' or space in the location text
+    if source_backend == 'local':
+        root = local_sources.get_geonames_element(loc_text)
+        request = empty_string
+    elif ',' in loc_text:   # Different query parameters are defined based on ',' or space in the location text
         request = f'{geonames_url}q={loc_text.lower().replace(space, "+").replace(",", "+")}' \
                   f'&style=full&maxRows=1&username={geonames_user}'
     elif space in loc_text:
@@ -363,7 +540,7 @@ def get_geonames_location(loc_text: str) -> GeoNamesDetails:
         name_startswith = True
         request = f'{geonames_url}q={loc_text.lower()}&name_startsWith={loc_text.lower()}' \
                   f'&style=full&maxRows=1&username={geonames_user}'
-    root = _call_geonames(request, loc_text)
+    root = _call_geonames(request, loc_text) if request else root
     if root is None:
         if name_startswith:
             # Try less restrictive search
@@ -408,6 +585,7 @@ def get_geonames_location(loc_text: str) -> GeoNamesDetails:
     return GeoNamesDetails(class_type, country, admin_level, alt_names, wiki_link)
 
 
+@_cached_lookup(wikipedia_cache, DescriptionDetails)
 def get_wikipedia_description(noun: str, ner_type: str, explicit_link: str = empty_string) -> DescriptionDetails:
     """
     Get the first paragraph of the Wikipedia web page for the specified organization, group, ...
@@ -0,0 +1,180 @@
+# Rate limit coordination for the external sources (WDQS, the Wikidata REST API, Wikipedia and GeoNames)
+#    Requests to a source are paced, and when a source responds with 'too many requests', all requests to that
+#    source (in the process, and optionally in all processes sharing the cache directory) wait until the retry-after
+#    time. Requests are queued and sent by the limiter's dispatcher (so that the caller does not sleep), and
+#    requests whose wait would exceed the maximum wait are rejected immediately.
+
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Union
+
+from dna.response_cache import cache_dir
+
+sources_max_wait = float(os.environ.get('SOURCES_MAX_WAIT_SECONDS', 30))
+# Maximum number of requests to a source that are sent concurrently by its dispatcher
+sources_dispatch_workers = int(os.environ.get('SOURCES_DISPATCH_WORKERS', 8))
+# When enabled, retry-after times are shared between processes using a SQLite database in the cache directory
+shared_rate_limits = os.environ.get('SOURCES_SHARED_RATE_LIMITS', 'off').lower() == 'on'
+rate_limits_file = 'rate_limits.sqlite'
+
+create_table = 'CREATE TABLE IF NOT EXISTS rate_limits (source TEXT PRIMARY KEY, blocked_until REAL NOT NULL)'
+
+
+class SourceRateLimiter:
+    """
+    Coordinates the requests to a source, spacing them by a minimum interval and holding them while the
+    source is blocked (after a 'too many requests' response). Callers submit a request, which reserves a time
+    slot and is queued; A dispatcher thread sends the queued requests in order when their slots are reached, and
+    the caller receives a Future of the response (rather than each caller sleeping and retrying independently).
+    """
+
+    def __init__(self, source: str, requests_per_second: float = 0, shared: bool = False):
+        """
+        :param source: String identifying the source (for ex, 'wdqs')
+        :param requests_per_second: Maximum rate of requests to the source (0 indicates no limit)
+        :param shared: Boolean indicating that the blocked time is shared with other processes
+        """
+        self.source = source
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.shared = shared
+        self.blocked_until = 0.0
+        self.next_slot = 0.0
+        self.metrics = {'requests': 0, 'waits': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                        'rejected': 0, 'throttled': 0}
+        self._conn = None
+        self._lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)
+        self._pending = []            # Heap of tuples of the slot, sequence number, Future and request details
+        self._sequence = itertools.count()
+        self._dispatcher = None
+        self._executor = None
+
+    def _get_shared_blocked_until(self) -> float:
+        # Must be called holding the lock
+        try:
+            if not self._conn:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(str(cache_dir / rate_limits_file), timeout=5, check_same_thread=False)
+                self._conn.execute(create_table)
+                self._conn.commit()
+            row = self._conn.execute('SELECT blocked_until FROM rate_limits WHERE source = ?',
+                                     (self.source,)).fetchone()
+            return row[0] if row else 0.0
+        except sqlite3.Error as sql_err:
+            logging.error(f'Shared rate limit ({self.source}) exception: {str(sql_err)}')
+            return 0.0
+
+    def submit(self, function: Callable, *args, max_wait: float = None, **kwargs) -> Union[Future, None]:
+        """
+        Queue a request to the source, which is sent (by calling the function) when its time slot is reached.
+        The caller is not delayed; It waits on the returned Future, if and when it needs the response.
+
+        :param function: The function sending the request (for ex, http_sessions' http_get)
+        :param args: The positional arguments of the function
+        :param max_wait: Maximum number of seconds until the request is sent (if not specified, sources_max_wait)
+        :param kwargs: The keyword arguments of the function
+        :return: A Future providing the function's result (or exception), or None if the wait would exceed the
+                 maximum (the request is rejected)
+        """
+        max_wait = sources_max_wait if max_wait is None else max_wait
+        with self._lock:
+            now = time.time()
+            if self.shared:
+                self.blocked_until = max(self.blocked_until, self._get_shared_blocked_until())
+            slot = max(now, self.blocked_until, self.next_slot)
+            wait = slot - now
+            if wait > max_wait:
+                self.metrics['rejected'] += 1
+                logging.info(f'Rate limit ({self.source}): Request rejected, wait of {wait:.1f} seconds')
+                return None
+            self.next_slot = slot + self.interval
+            self.metrics['requests'] += 1
+            if wait > 0:
+                self.metrics['waits'] += 1
+                self.metrics['wait_seconds'] += wait
+                self.metrics['max_wait_seconds'] = max(self.metrics['max_wait_seconds'], wait)
+            future = Future()
+            heapq.heappush(self._pending, (slot, next(self._sequence), future, function, args, kwargs))
+            if not self._dispatcher:
+                self._executor = ThreadPoolExecutor(max_workers=sources_dispatch_workers,
+                                                    thread_name_prefix=f'{self.source}-requests')
+                self._dispatcher = threading.Thread(target=self._dispatch, name=f'{self.source}-dispatcher',
+                                                    daemon=True)
+                self._dispatcher.start()
+            self._queued.notify()
+        return future
+
+    def _dispatch(self):
+        # Dispatcher thread, sending each queued request when its slot is reached (and the source is not blocked)
+        with self._queued:
+            while True:
+                if not self._pending:
+                    self._queued.wait()
+                    continue
+                delay = max(self._pending[0][0], self.blocked_until) - time.time()
+                if delay > 0:
+                    self._queued.wait(delay)
+                    continue
+                slot, sequence, future, function, args, kwargs = heapq.heappop(self._pending)
+                if future.set_running_or_notify_cancel():     # Not sent if the caller cancelled the request
+                    self._executor.submit(_run_request, future, function, args, kwargs)
+
+    def block(self, seconds: float):
+        """
+        Hold all requests to the source for the specified time (for ex, the retry-after time of a 429 response).
+
+        :param seconds: Number of seconds to block the source
+        :return: None
+        """
+        with self._lock:
+            self.metrics['throttled'] += 1
+            self.blocked_until = max(self.blocked_until, time.time() + max(seconds, 0))
+            if self.shared:
+                try:
+                    self._get_shared_blocked_until()    # Opens the connection if needed
+                    self._conn.execute('INSERT INTO rate_limits VALUES (?, ?) ON CONFLICT(source) DO UPDATE SET '
+                                       'blocked_until = MAX(blocked_until, excluded.blocked_until)',
+                                       (self.source, self.blocked_until))
+                    self._conn.commit()
+                except sqlite3.Error as sql_err:
+                    logging.error(f'Shared rate limit ({self.source}) exception: {str(sql_err)}')
+        logging.info(f'Rate limit ({self.source}): Requests blocked for {seconds:.1f} seconds')
+
+
+def _run_request(future: Future, function: Callable, args: tuple, kwargs: dict):
+    # Send a request (in a dispatcher's executor), setting the result or exception of its Future
+    try:
+        future.set_result(function(*args, **kwargs))
+    except BaseException as request_err:
+        future.set_exception(request_err)
+
+
+source_rate_limiters = {
+    'geonames': SourceRateLimiter('geonames', float(os.environ.get('GEONAMES_REQUESTS_PER_SECOND', 1)),
+                                  shared_rate_limits),
+    'wdqs': SourceRateLimiter('wdqs', float(os.environ.get('WDQS_REQUESTS_PER_SECOND', 5)), shared_rate_limits),
+    'wikidata': SourceRateLimiter('wikidata', float(os.environ.get('WIKIDATA_REQUESTS_PER_SECOND', 10)),
+                                  shared_rate_limits),
+    'wikipedia': SourceRateLimiter('wikipedia', float(os.environ.get('WIKIPEDIA_REQUESTS_PER_SECOND', 20)),
+                                   shared_rate_limits)}
+
+
+def get_rate_limit_metrics() -> dict:
+    """
+    Get the request and wait time metrics (for the current process) of each source.
+
+    :return: Dictionary keyed by the source name, holding dictionaries with the number of requests, the number
+             of requests that waited, the total and maximum wait times (in seconds), the number of requests rejected
+             due to exceeding the maximum wait, and the number of 'too many requests' responses
+    """
+    metrics = dict()
+    for source, limiter in source_rate_limiters.items():
+        with limiter._lock:
+            metrics[source] = dict(limiter.metrics)
+    return metrics
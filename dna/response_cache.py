@@ -0,0 +1,168 @@
+# Persistent, content-addressed cache of responses (for ex, OpenAI completions) stored in a local SQLite database
+#    Entries are keyed by a hash of the request details, and are removed when their time-to-live expires or
+#    (least recently used first) when the maximum number of entries for a namespace is exceeded
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+cache_dir = Path(os.environ.get('DNA_CACHE_DIR', Path(__file__).resolve().parent.parent / 'cache'))
+cache_file = 'responses.sqlite'
+
+create_table = 'CREATE TABLE IF NOT EXISTS responses (namespace TEXT NOT NULL, key TEXT NOT NULL, ' \
+               'value TEXT NOT NULL, created REAL NOT NULL, expires REAL, last_access REAL NOT NULL, ' \
+               'PRIMARY KEY (namespace, key))'
+create_index = 'CREATE INDEX IF NOT EXISTS responses_access ON responses (namespace, last_access)'
+
+
+class ResponseCache:
+    """
+    Cache of JSON-serializable responses for a namespace (such as 'openai'). The cache is thread-safe, and
+    can be shared by processes using the same cache directory. Errors accessing the cache are logged and
+    treated as cache misses, so that processing continues without the cache.
+    """
+
+    def __init__(self, namespace: str, ttl: float = 0, max_entries: int = 0, enabled: bool = True,
+                 db_path: Path = None):
+        """
+        :param namespace: String identifying the type of responses (keys are unique within a namespace)
+        :param ttl: Default number of seconds that an entry is valid (0 indicates no expiration)
+        :param max_entries: Maximum number of entries for the namespace (0 indicates no limit)
+        :param enabled: Boolean indicating whether the cache is used
+        :param db_path: Path of the SQLite database (by default, responses.sqlite in the cache_dir)
+        """
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.db_path = db_path if db_path else cache_dir / cache_file
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Create a content hash from the details of a request (for ex, a prompt and its model parameters).
+
+        :param parts: JSON-serializable values identifying the request
+        :return: String holding the SHA-256 hex digest of the parts
+        """
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # Must be called holding the lock; The database is created on first use
+        if not self._conn:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(create_table)
+            self._conn.execute(create_index)
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str) -> (bool, object):
+        """
+        Get the cached value for a key, if it exists and has not expired.
+
+        :param key: String identifying the request (see make_key)
+        :return: A tuple holding a boolean indicating that the value was found, and the value (or None)
+        """
+        if not self.enabled:
+            return False, None
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._get_connection()
+                row = conn.execute('SELECT value, expires FROM responses WHERE namespace = ? AND key = ?',
+                                   (self.namespace, key)).fetchone()
+                if row and (row[1] is None or row[1] > now):
+                    conn.execute('UPDATE responses SET last_access = ? WHERE namespace = ? AND key = ?',
+                                 (now, self.namespace, key))
+                    conn.commit()
+                    self.hits += 1
+                    return True, json.loads(row[0])
+                self.misses += 1
+        except Exception as cache_err:
+            logging.error(f'Response cache ({self.namespace}) get exception: {str(cache_err)}')
+        return False, None
+
+    def put(self, key: str, value, ttl: float = None):
+        """
+        Add or replace the cached value for a key.
+
+        :param key: String identifying the request (see make_key)
+        :param value: JSON-serializable value to be cached
+        :param ttl: Number of seconds that the entry is valid (if not specified, the cache's default ttl)
+        :return: None
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires = now + ttl if ttl else None
+        try:
+            with self._lock:
+                conn = self._get_connection()
+                conn.execute('INSERT OR REPLACE INTO responses (namespace, key, value, created, expires, '
+                             'last_access) VALUES (?, ?, ?, ?, ?, ?)',
+                             (self.namespace, key, json.dumps(value, ensure_ascii=False), now, expires, now))
+                self._puts += 1
+                if self._puts % 100 == 1:    # Periodically remove expired and least recently used entries
+                    self._evict(conn, now)
+                conn.commit()
+        except Exception as cache_err:
+            logging.error(f'Response cache ({self.namespace}) put exception: {str(cache_err)}')
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        # Must be called holding the lock
+        conn.execute('DELETE FROM responses WHERE namespace = ? AND expires IS NOT NULL AND expires <= ?',
+                     (self.namespace, now))
+        if self.max_entries:
+            conn.execute('DELETE FROM responses WHERE namespace = ? AND key IN (SELECT key FROM responses '
+                         'WHERE namespace = ? ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                         (self.namespace, self.namespace, self.max_entries))
+
+    def evict(self):
+        """
+        Remove the expired entries and, if the maximum number of entries is exceeded, the least recently used.
+
+        :return: None
+        """
+        try:
+            with self._lock:
+                conn = self._get_connection()
+                self._evict(conn, time.time())
+                conn.commit()
+        except Exception as cache_err:
+            logging.error(f'Response cache ({self.namespace}) evict exception: {str(cache_err)}')
+
+    def clear(self):
+        """
+        Remove all the entries for the namespace.
+
+        :return: None
+        """
+        try:
+            with self._lock:
+                conn = self._get_connection()
+                conn.execute('DELETE FROM responses WHERE namespace = ?', (self.namespace,))
+                conn.commit()
+        except Exception as cache_err:
+            logging.error(f'Response cache ({self.namespace}) clear exception: {str(cache_err)}')
+
+    def stats(self) -> dict:
+        """
+        Get the cache statistics (for the current process).
+
+        :return: Dictionary holding the namespace, and the number of hits and misses
+        """
+        return {'namespace': self.namespace, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,165 @@
+# Precomputed closure of Wikidata's instance of/subclass of (wdt:P31/wdt:P279*) relations for a set of root
+#    classes (the Q-ids of query_sources' qid_mapping), used to check an entity's type without querying WDQS
+#    The closure is built from the Wikidata claims in the local sources index (see local_sources.py), and stored as
+#    a sorted array of item numbers and a parallel array of bitsets (where bit n indicates the nth root class)
+#    To build the closure: python -m dna.subclass_closure [--db local_sources.sqlite] [--output subclass_closure.bin]
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+from typing import Union
+
+from dna.local_sources import local_sources_path
+
+closure_path = Path(os.environ.get('DNA_SUBCLASS_CLOSURE', Path(__file__).resolve().parent.parent /
+                                   'cache' / 'subclass_closure.bin'))
+
+
+class SubclassClosure:
+    """
+    Bitsets of the root classes that Wikidata items are instances of (directly or via subclasses).
+    """
+
+    def __init__(self, roots: list, items: array, masks: array):
+        """
+        :param roots: Array of the Q-ids of the root classes, where the index of a root is its bit position
+        :param items: Array of the (sorted) numbers of the Wikidata items (for ex, 5 for Q5)
+        :param masks: Array of the bitsets of the root classes for the corresponding items
+        """
+        self.roots = roots
+        self.root_bits = {root: 1 << index for index, root in enumerate(roots)}
+        self.items = items
+        self.masks = masks
+
+    def get_mask(self, qid: str) -> Union[int, None]:
+        """
+        Get the bitset of the root classes that a Wikidata item is an instance of.
+
+        :param qid: String holding the Q-id of the item
+        :return: Integer holding the bitset, or None if the item is not in the closure
+        """
+        if not qid.startswith('Q') or not qid[1:].isdigit():
+            return None
+        number = int(qid[1:])
+        index = bisect_left(self.items, number)
+        if index < len(self.items) and self.items[index] == number:
+            return self.masks[index]
+        return None
+
+    def is_instance_of(self, qid: str, root: str) -> Union[bool, None]:
+        """
+        Check whether a Wikidata item is an instance of a root class (or one of its subclasses).
+
+        :param qid: String holding the Q-id of the item
+        :param root: String holding the Q-id of the root class
+        :return: True or False, or None if the item or root class is not in the closure
+        """
+        mask = self.get_mask(qid)
+        if mask is None or root not in self.root_bits:
+            return None
+        return bool(mask & self.root_bits[root])
+
+    def save(self, file_path: Path):
+        """
+        Write the closure to a file, as a JSON header line (roots and count of items) followed by the arrays.
+
+        :param file_path: Path of the file
+        :return: None
+        """
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(file_path, 'wb') as closure_file:
+            closure_file.write(json.dumps({'roots': self.roots, 'count': len(self.items)}).encode('utf-8') + b'\n')
+            self.items.tofile(closure_file)
+            self.masks.tofile(closure_file)
+
+    @staticmethod
+    def load(file_path: Path):
+        """
+        Read a closure written by the save method.
+
+        :param file_path: Path of the file
+        :return: An instance of SubclassClosure
+        """
+        with open(file_path, 'rb') as closure_file:
+            header = json.loads(closure_file.readline())
+            items = array('I')
+            items.fromfile(closure_file, header['count'])
+            masks = array('Q')
+            masks.fromfile(closure_file, header['count'])
+        return SubclassClosure(header['roots'], items, masks)
+
+
+_closure = None
+_closure_loaded = False
+_lock = threading.Lock()
+
+
+def build_closure(roots: list, db_path: Path = None) -> SubclassClosure:
+    """
+    Compute the closure for the root classes, from the P31 and P279 claims in the local sources index.
+
+    :param roots: Array of the Q-ids of the root classes (at most 64)
+    :param db_path: Path of the local sources index (by default, local_sources_path)
+    :return: An instance of SubclassClosure
+    """
+    roots = list(dict.fromkeys(roots))
+    if len(roots) > 64:
+        raise ValueError('Subclass closure supports at most 64 root classes')
+    conn = sqlite3.connect(str(db_path if db_path else local_sources_path))
+    subclasses = defaultdict(list)
+    for subclass, superclass in conn.execute("SELECT qid, value FROM wikidata_claims WHERE property = 'P279'"):
+        subclasses[superclass].append(subclass)
+    # Walk down the subclass hierarchy from each root, setting the root's bit for each class
+    class_masks = defaultdict(int)
+    for index, root in enumerate(roots):
+        bit = 1 << index
+        pending = [root]
+        while pending:
+            qid = pending.pop()
+            if class_masks[qid] & bit:
+                continue
+            class_masks[qid] |= bit
+            pending.extend(subclasses.get(qid, []))
+    item_masks = defaultdict(int)
+    for qid, class_qid in conn.execute("SELECT qid, value FROM wikidata_claims WHERE property = 'P31'"):
+        if qid[1:].isdigit():    # Items with no root classes are included, so that their lookup is definitive
+            item_masks[int(qid[1:])] |= class_masks.get(class_qid, 0)
+    conn.close()
+    numbers = sorted(item_masks)
+    return SubclassClosure(roots, array('I', numbers), array('Q', [item_masks[number] for number in numbers]))
+
+
+def get_closure() -> Union[SubclassClosure, None]:
+    """
+    Get the subclass closure, loading it from the closure_path on first use.
+
+    :return: An instance of SubclassClosure or None if the closure is not available
+    """
+    global _closure, _closure_loaded
+    with _lock:
+        if not _closure_loaded:
+            _closure_loaded = True
+            if closure_path.exists():
+                try:
+                    _closure = SubclassClosure.load(closure_path)
+                    logging.info(f'Loaded subclass closure with {len(_closure.items)} items')
+                except (OSError, ValueError, EOFError) as closure_err:
+                    logging.error(f'Subclass closure ({closure_path}) load exception: {str(closure_err)}')
+        return _closure
+
+
+if __name__ == '__main__':
+    from dna.query_sources import qid_mapping_roots
+    parser = argparse.ArgumentParser(description='Build the Wikidata subclass closure for the qid_mapping classes')
+    parser.add_argument('--db', type=Path, default=local_sources_path, help='path of the local sources index')
+    parser.add_argument('--output', type=Path, default=closure_path, help='path of the closure file')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    build_closure(qid_mapping_roots, args.db).save(args.output)
@@ -2,9 +2,12 @@
 # Also includes small, utility methods used across different DNA modules
 
 # import base64
+from collections.abc import Mapping
 from pathlib import Path
 import pickle
-from rdflib import Literal
+import threading
+from typing import Callable
+from unidecode import unidecode
 
 base_dir = Path(__file__).resolve().parent.parent
 dna_dir = base_dir / 'dna'
@@ -27,8 +30,17 @@ meta_graph: str = 'meta'
 owl_thing: str = 'owl:Thing'
 event_and_state_class: str = ':EventAndState'
 
-# Return the RDF encoded string, replacing double quotes with single quotes
-literal = lambda x : Literal(x.replace('"', "'")).n3()
+
+def literal(text: str) -> str:
+    """
+    Return the RDF encoded string, replacing double quotes with single quotes.
+
+    :param text: The string to be encoded
+    :return: The N3 representation of the string as an RDF literal
+    """
+    from rdflib import Literal    # Imported on first use, since importing rdflib is slow
+    return Literal(text.replace('"', "'")).n3()
+
 
 concept_map = {'politic': ':PoliticalIdeology',
                'ideolog': ':PoliticalIdeology',
@@ -81,21 +93,89 @@ ttl_prefixes = ['@prefix : <urn:ontoinsights:dna:> .', '@prefix dna: <urn:ontoin
                 '@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .',
                 '@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .']
 
+
+class LazyResource:
+    """
+    Proxy for a resource (such as the contents of a file in the resources directory) that is loaded on first use,
+    so that importing the module does not pay the cost of loading it.
+    """
+
+    def __init__(self, loader: Callable):
+        """
+        :param loader: Function (with no parameters) returning the resource
+        """
+        self._loader = loader
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        """
+        :return: True if the resource has been loaded, False otherwise
+        """
+        return self._value is not None
+
+    def load(self):
+        """
+        Get the resource, loading it if necessary.
+
+        :return: The resource
+        """
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._loader()
+        return self._value
+
+    def __contains__(self, item) -> bool:
+        return item in self.load()
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+
+class LazyMapping(LazyResource, Mapping):
+    """
+    LazyResource for a dictionary, supporting the (read-only) dictionary methods.
+    """
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+
+def _load_pickle(file_path: Path):
+    with open(file_path, 'rb') as in_file:
+        return pickle.load(in_file)
+
+
+def _fold_name(name: str) -> str:
+    """
+    Normalize a name for case-insensitive and diacritic-insensitive matching (for ex, Adèle becomes adele).
+
+    :param name: String holding the name
+    :return: The folded name
+    """
+    return unidecode(name).casefold()
+
+
+def _load_names(file_path: Path) -> frozenset:
+    with open(file_path, 'r', encoding='utf-8') as in_file:
+        return frozenset(_fold_name(name) for name in in_file.read().split('\n') if name)
+
+
 # A dictionary where the keys are country names and the values are the GeoNames country codes
 geocodes_file = resources_dir / 'countries_mapped_to_geo_codes.pickle'
-with open(geocodes_file, 'rb') as inFile:
-    names_to_geo_dict = pickle.load(inFile)
+names_to_geo_dict = LazyMapping(lambda: _load_pickle(geocodes_file))
 
 # Reused from https://github.com/explosion/coreferee/blob/master/coreferee/lang/common/data/female_names.dat (MIT lic)
 fnames_file = resources_dir / 'female_names.txt'
-with open(fnames_file, 'r') as fnames:
-    fnames_content = fnames.read()
-female_names = fnames_content.split('\n')
+female_names = LazyResource(lambda: _load_names(fnames_file))     # Frozenset of the folded names
 # Reused from https://github.com/explosion/coreferee/blob/master/coreferee/lang/common/data/male_names.dat (MIT lic)
 mnames_file = resources_dir / 'male_names.txt'
-with open(mnames_file, 'r') as mnames:
-    mnames_content = mnames.read()
-male_names = mnames_content.split('\n')
+male_names = LazyResource(lambda: _load_names(mnames_file))       # Frozenset of the folded names
 
 # Future + other prepositions, clause identifiers and marks?
 personal_pronouns = ('I', 'we', 'us', 'they', 'them', 'he', 'she', 'it', 'myself', 'ourselves', 'themselves',
@@ -155,7 +235,10 @@ def check_name_gender(name_str: str) -> str:
     :param name_str: The string representing the noun or proper name
     :return: A string holding the entity's type (with gender if known)
     """
-    gender = empty_string
     names = name_str.split() if space in name_str else [name_str]
-    gender = 'FEMALE' if names[0] in female_names else ('MALE' if names[0] in male_names else empty_string)
+    first_name = _fold_name(names[0]) if names else empty_string
+    gender = 'FEMALE' if first_name in female_names else ('MALE' if first_name in male_names else empty_string)
+    if not gender and '-' in first_name:    # Check the first part of a hyphenated name (for ex, Mary-Kate)
+        first_name = first_name.split('-')[0]
+        gender = 'FEMALE' if first_name in female_names else ('MALE' if first_name in male_names else empty_string)
     return f'{gender}SINGPERSON' if gender else 'SINGPERSON'
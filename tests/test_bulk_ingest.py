@@ -0,0 +1,69 @@
+import io
+import json
+
+from dna import bulk_ingest
+from dna.bulk_ingest import IngestCheckpoint, _get_article_key, ingest_articles, read_articles
+from dna.dedup import NarrativeFingerprint
+
+article = {'title': 'Cheney concedes', 'source': 'AP', 'published': '2022-08-17T00:00:00',
+           'url': 'https://apnews.com/cheney', 'text': 'U.S. Rep. Liz Cheney conceded defeat Tuesday.'}
+
+
+def test_read_articles(tmp_path):
+    (tmp_path / 'articles.jsonl').write_text(json.dumps(article) + '\n\n{"title": \n', encoding='utf-8')
+    (tmp_path / 'articles.csv').write_text('title,source,text\nPrimary,AP,Harriet Hageman won the primary.\n',
+                                           encoding='utf-8')
+    (tmp_path / 'story.txt').write_text('She did not lose.', encoding='utf-8')
+    (tmp_path / 'notes.md').write_text('Not an article', encoding='utf-8')
+    articles = list(read_articles([str(tmp_path)]))
+    assert [location.split('/')[-1] for location, details in articles] == \
+        ['articles.csv:1', 'articles.jsonl:1', 'articles.jsonl:3', 'story.txt']
+    assert articles[0][1]['text'] == 'Harriet Hageman won the primary.'
+    assert articles[1][1] == article
+    assert 'error' in articles[2][1]
+    assert articles[3][1]['title'] == 'story' and articles[3][1]['text'] == 'She did not lose.'
+
+
+def test_read_missing_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_ingest, 'parse_narratives', lambda texts, batch_size, processes: (([], []) for _ in texts))
+    (tmp_path / 'story.txt').write_text('She did not lose.', encoding='utf-8')
+    articles = list(read_articles([str(tmp_path / 'missing.jsonl'), str(tmp_path / 'story.txt')]))
+    assert articles[0] == (str(tmp_path / 'missing.jsonl'), {'error': 'Input path not found'})
+    assert articles[1][1]['text'] == 'She did not lose.'      # The remaining inputs are read
+    results_file = io.StringIO()
+    checkpoint = IngestCheckpoint(str(tmp_path / 'checkpoint.sqlite'))
+    counts = ingest_articles('foo', articles[:1], checkpoint, results_file)
+    checkpoint.close()
+    assert counts['skipped'] == 1
+    assert json.loads(results_file.getvalue())['error'] == 'Input path not found'
+
+
+def test_checkpoint(tmp_path):
+    key = _get_article_key(article)
+    assert key == _get_article_key(dict(article))
+    assert key != _get_article_key({**article, 'text': 'Liz Cheney conceded defeat.'})
+    checkpoint = IngestCheckpoint(str(tmp_path / 'checkpoint.sqlite'))
+    assert not checkpoint.is_ingested(key)
+    checkpoint.record(key, 'abcd1234')
+    checkpoint.close()
+    checkpoint = IngestCheckpoint(str(tmp_path / 'checkpoint.sqlite'))     # Re-run
+    assert checkpoint.is_ingested(key)
+    checkpoint.close()
+
+
+def test_in_flight_duplicates(tmp_path, monkeypatch):
+    # A duplicate of an article that is not yet ingested (and so, not in the dedup index) is not ingested
+    monkeypatch.setattr(bulk_ingest, 'check_duplicate', lambda metadata, text, repo: (NarrativeFingerprint(text), None))
+    monkeypatch.setattr(bulk_ingest, 'parse_narratives', lambda texts, batch_size, processes: (([], []) for _ in texts))
+    monkeypatch.setattr(bulk_ingest, '_ingest_article',
+                        lambda repo, details, number, parse_results, fingerprint: {'status': 'ingested',
+                                                                                    'narrativeId': details['title']})
+    articles = [('a.jsonl:1', article), ('a.jsonl:2', {**article, 'title': 'Copy', 'text': article['text'].upper()}),
+                ('a.jsonl:3', {**article, 'title': 'Other', 'text': 'Harriet Hageman won the primary.'})]
+    checkpoint = IngestCheckpoint(str(tmp_path / 'checkpoint.sqlite'))
+    results_file = io.StringIO()
+    counts = ingest_articles('foo', articles, checkpoint, results_file, workers=2)
+    checkpoint.close()
+    assert counts['ingested'] == 2 and counts['duplicate'] == 1
+    results = {result['location']: result for result in map(json.loads, results_file.getvalue().splitlines())}
+    assert results['a.jsonl:2'] == {**results['a.jsonl:2'], 'status': 'duplicate', 'duplicateOfLocation': 'a.jsonl:1'}
@@ -0,0 +1,70 @@
+from dna.corrections_cache import _get_corrections_version, _repo_nouns, flush_with_corrections, \
+    invalidate_corrections, nouns_preload, record_corrections
+from dna.database import WriteBuffer, add_remove_data, clear_data, query_turtle
+from dna.database_queries import query_manual_corrections
+from dna.nouns_index import NounsDictionary
+from dna.utilities_and_language_specific import dna_prefix, ttl_prefixes
+
+test_repo = 'test-corrections'
+cheney_ttl = ' '.join(ttl_prefixes) + ' :Liz_Cheney a :Person, :Correction ; rdfs:label "Liz Cheney" .'
+hageman_ttl = ' '.join(ttl_prefixes) + ' :Harriet_Hageman a :Person, :Correction ; rdfs:label "Harriet Hageman" .'
+trump_ttl = ' '.join(ttl_prefixes) + ' :Donald_Trump a :Person, :Correction ; rdfs:label "Donald Trump" .'
+
+
+def test_query_turtle():
+    bindings = query_turtle(cheney_ttl, query_manual_corrections)
+    assert {binding['type']['value'] for binding in bindings} == \
+        {'urn:ontoinsights:dna:Person', 'urn:ontoinsights:dna:Correction'}
+    assert all(binding['label']['value'] == 'Liz Cheney' for binding in bindings)
+
+
+def test_nouns_preload_cached():
+    clear_data(test_repo)
+    invalidate_corrections(test_repo, True)
+    assert not add_remove_data('add', cheney_ttl, test_repo)
+    record_corrections(test_repo, cheney_ttl)
+    nouns_dict = nouns_preload(test_repo)
+    assert isinstance(nouns_dict, NounsDictionary)
+    assert nouns_dict['Liz Cheney'] == ('PERSON', ':Liz_Cheney')
+    assert test_repo in _repo_nouns
+    nouns_dict['Cheney'] = ('PERSON', ':Liz_Cheney')     # Updates to the returned dictionary are not cached
+    assert 'Cheney' not in nouns_preload(test_repo)
+
+
+def test_record_corrections():
+    nouns_preload(test_repo)
+    assert not add_remove_data('add', hageman_ttl, test_repo)
+    record_corrections(test_repo, hageman_ttl)
+    assert 'Harriet Hageman' in _repo_nouns[test_repo][1]     # Updated incrementally
+    assert nouns_preload(test_repo)['Harriet Hageman'] == ('PERSON', ':Harriet_Hageman')
+
+
+def test_flush_with_corrections():
+    nouns_preload(test_repo)
+    version = _get_corrections_version(test_repo)
+    write_buffer = WriteBuffer()
+    write_buffer.add(trump_ttl, test_repo)
+    assert not flush_with_corrections(test_repo, write_buffer)
+    new_version = _get_corrections_version(test_repo)     # Updated in the same transaction
+    assert new_version[f'{dna_prefix}{test_repo}'] != version[f'{dna_prefix}{test_repo}']
+    assert _repo_nouns[test_repo][0] == new_version and 'Donald Trump' in _repo_nouns[test_repo][1]
+
+
+def test_flush_with_corrections_failure():
+    nouns_preload(test_repo)
+    version = _get_corrections_version(test_repo)
+    write_buffer = WriteBuffer()
+    write_buffer.add(trump_ttl.replace('Donald', 'Melania'), test_repo)
+    write_buffer.add_update('prefix : <urn:ontoinsights:dna:> INSERT DATA {:foo :bar')    # Invalid, so rolled back
+    assert flush_with_corrections(test_repo, write_buffer)
+    assert _get_corrections_version(test_repo) == version     # Neither the corrections nor the version were added
+    assert test_repo not in _repo_nouns
+    assert 'Melania Trump' not in nouns_preload(test_repo)
+
+
+def test_invalidate_corrections():
+    nouns_preload(test_repo)
+    clear_data(test_repo)
+    invalidate_corrections(test_repo, True)
+    assert test_repo not in _repo_nouns
+    assert 'Liz Cheney' not in nouns_preload(test_repo)
@@ -2,7 +2,8 @@ import pytest
 import os
 from database import datetime
 
-from dna.database import add_remove_data, clear_data, construct_graph, query_database
+from dna.database import add_remove_data, clear_data, connection_pool, construct_graph, parse_turtle, \
+    query_database, WriteBuffer
 from dna.database_queries import construct_kg, delete_repo_metadata, query_repo_graphs
 from dna.utilities_and_language_specific import dna_prefix, empty_string
 
@@ -10,6 +11,8 @@ test_repo = 'test-repo'
 test_graph = 'testGraph'
 full_test_graph = f'<{dna_prefix}{test_repo}_{test_graph}>'
 triples = ':testS :testP :testO ; rdfs:label "text" .'
+prefixed_triples = '@prefix : <urn:ontoinsights:dna:> . @prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> . ' \
+                   ':testS :testP :testO ; rdfs:label "text" .'
 class_triples = '@prefix dna: <urn:ontoinsights:dna:> :testS a dna:EventAndState ; rdfs:label "text" .'
 query = 'select (count(*) as ?cnt) where { GRAPH ?g {?s ?p ?o} }'
 graph_query = query.replace('?g', full_test_graph)
@@ -80,6 +83,33 @@ def test_clear_data_from_graph():
     assert new_cnt == 0
 
 
+def test_write_buffer():
+    write_buffer = WriteBuffer()
+    write_buffer.add(prefixed_triples, test_repo, test_graph)
+    write_buffer.add(prefixed_triples, test_repo, f'{test_graph}2')
+    assert query_database('select', graph_query)[0]['cnt']['value'] == '0'    # Nothing written before the flush
+    assert not write_buffer.flush()
+    assert query_database('select', graph_query)[0]['cnt']['value'] == '2'
+    second_query = query.replace('?g', f'<{dna_prefix}{test_repo}_{test_graph}2>')
+    assert query_database('select', second_query)[0]['cnt']['value'] == '2'
+    clear_data(test_repo, test_graph)
+    clear_data(test_repo, f'{test_graph}2')
+
+
+def test_write_buffer_rollback():
+    write_buffer = WriteBuffer()
+    write_buffer.add(prefixed_triples, test_repo, test_graph)
+    write_buffer.add(':invalid :turtle', test_repo, f'{test_graph}2')
+    assert write_buffer.flush()      # Error message returned
+    assert query_database('select', graph_query)[0]['cnt']['value'] == '0'    # First graph's add was rolled back
+
+
+def test_parse_turtle():
+    ntriples, numb_triples = parse_turtle(f'{prefixed_triples} :testS :testP :testO .')   # Duplicate triple
+    assert numb_triples == 2
+    assert '<urn:ontoinsights:dna:testS> <urn:ontoinsights:dna:testP> <urn:ontoinsights:dna:testO> .' in ntriples
+
+
 def test_delete_repo():
     # Delete metadata for the repository in dna db's default graph
     query_database('update', delete_repo_metadata.replace('?repo', f':{test_repo}'))
@@ -104,3 +134,11 @@ def test_remove_tests():
         for binding in graph_bindings:
             # Delete the graph
             clear_data(repo, binding['g']['value'].split(f'{repo}_')[1])
+
+
+def test_connection_reuse():
+    created = connection_pool.created
+    for index in range(0, 3):
+        query_database('select', graph_query)
+    assert connection_pool.created - created <= 1
+    assert 0 < connection_pool.idle_count() <= connection_pool.size
@@ -0,0 +1,108 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from dna.dedup import DedupIndex, NarrativeFingerprint, normalize_text
+
+story = 'U.S. Rep. Liz Cheney conceded defeat Tuesday in the Republican primary in Wyoming, an outcome that was ' \
+        'a priority for former President Donald Trump as he urged GOP voters to reject one of his most prominent ' \
+        'critics on Capitol Hill. Cheney\'s loss was widely expected. Harriet Hageman, a Trump-endorsed ' \
+        'attorney, won the primary. Cheney said that she would do whatever it takes to keep Trump out of the ' \
+        'Oval Office. The congresswoman has been the vice chair of the House committee investigating the ' \
+        'January 6 attack on the Capitol.'
+other_story = 'The United Nations Security Council demands an immediate ceasefire between Israel and the ' \
+              'Palestinian group Hamas in the Gaza Strip and the release of all hostages as the United States ' \
+              'abstains from the vote.'
+
+
+def test_normalize_text():
+    assert normalize_text('  Rep. Liz\nCHENEY, conceded!') == 'rep liz cheney conceded'
+
+
+def test_similarity():
+    fingerprint = NarrativeFingerprint(story)
+    assert fingerprint.get_similarity(NarrativeFingerprint(story.upper()).signature) == 1.0
+    assert fingerprint.get_similarity(NarrativeFingerprint(f'{story} (Reporting by AP staff.)').signature) > 0.8
+    assert fingerprint.get_similarity(NarrativeFingerprint(other_story).signature) < 0.2
+
+
+def test_dedup_index(tmp_path):
+    dedup_index = DedupIndex(tmp_path / 'dedup.sqlite')
+    dedup_index.add('foo', 'narr1', NarrativeFingerprint(story))
+    dedup_index.add('foo', 'narr2', NarrativeFingerprint(other_story))
+    assert dedup_index.find_match('foo', NarrativeFingerprint(f'  {story}\n')) == ('narr1', 1.0, True)    # Exact
+    narr_id, similarity, exact = dedup_index.find_match('foo',
+                                                        NarrativeFingerprint(f'{story} (Reporting by AP staff.)'))
+    assert narr_id == 'narr1' and 0.8 <= similarity < 1.0 and not exact    # Near-duplicate
+    assert dedup_index.find_match('foo', NarrativeFingerprint('Harriet Hageman won the primary.')) == (None, 0.0, False)
+    assert dedup_index.find_match('bar', NarrativeFingerprint(story)) == (None, 0.0, False)    # Other repository
+    dedup_index.remove('foo', 'narr1')
+    assert dedup_index.find_match('foo', NarrativeFingerprint(story)) == (None, 0.0, False)
+    dedup_index.remove('foo')
+    assert dedup_index.find_match('foo', NarrativeFingerprint(other_story)) == (None, 0.0, False)
+
+
+def test_long_near_duplicate(tmp_path):
+    # The estimated similarity of a long text that differs by one word is 1.0, but it is not an exact duplicate
+    dedup_index = DedupIndex(tmp_path / 'dedup.sqlite')
+    words = [f'word{number}' for number in range(800)]
+    dedup_index.add('foo', 'narr1', NarrativeFingerprint(' '.join(words)))
+    words[37] = 'changed'
+    assert dedup_index.find_match('foo', NarrativeFingerprint(' '.join(words))) == ('narr1', 1.0, False)
+
+
+def test_reserve(tmp_path):
+    dedup_index = DedupIndex(tmp_path / 'dedup.sqlite')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda number: dedup_index.reserve('foo', NarrativeFingerprint(story),
+                                                                       f'narr{number}'), range(8)))
+    assert results.count(None) == 1     # Only 1 of the concurrent duplicates is reserved
+    reserved_id = f'narr{results.index(None)}'
+    assert all(result == reserved_id for result in results if result)
+    assert dedup_index.reserve('bar', NarrativeFingerprint(story), 'narr8') is None      # Other repository
+    dedup_index.release('foo', NarrativeFingerprint(story))      # For ex, the ingest failed
+    assert dedup_index.reserve('foo', NarrativeFingerprint(story), 'narr9') is None
+    dedup_index.add('foo', 'narr9', NarrativeFingerprint(story))
+    dedup_index.release('foo', NarrativeFingerprint(story))
+    assert dedup_index.reserve('foo', NarrativeFingerprint(story), 'narr10') == 'narr9'     # In the index
+
+
+def test_concurrent_duplicate_submits(tmp_path, monkeypatch):
+    pytest.importorskip('flask')
+    pytest.importorskip('openai')
+    from dna import app_functions
+    from dna.app_functions import BackgroundAndNarrativeResults, Metadata, process_parsed_narrative
+    dedup_index = DedupIndex(tmp_path / 'dedup.sqlite')
+    monkeypatch.setattr(app_functions, 'dedup_index', dedup_index)
+    monkeypatch.setattr(app_functions, 'dedup_enabled', True)
+    started = threading.Event()
+    proceed = threading.Event()
+
+    def add_parsed_narrative(metadata, narr, repo, sentence_classes, quotation_classes, progress, fingerprint,
+                             graph_uuid):
+        started.set()
+        proceed.wait(10)
+        if 'failed' in metadata.title:
+            raise ValueError('Ingest failed')
+        dedup_index.add(repo, graph_uuid, fingerprint)
+        return BackgroundAndNarrativeResults({'repository': repo, 'narrativeDetails': {'narrativeId': graph_uuid}},
+                                             '', 201)
+
+    monkeypatch.setattr(app_functions, '_add_parsed_narrative', add_parsed_narrative)
+
+    def submit(title: str):
+        return process_parsed_narrative(Metadata(title, '2022-08-17', 'AP', 'https://apnews.com', 10), story,
+                                        'foo', [], [])
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(submit, 'failed')
+        assert started.wait(10)
+        started.clear()
+        assert submit('second').resp_dict['duplicateOf']    # The first is still being ingested
+        proceed.set()
+        with pytest.raises(ValueError):
+            future.result()
+        future = executor.submit(submit, 'third')      # Ingested, since the failed ingest released its reservation
+        narr_id = future.result().resp_dict['narrativeDetails']['narrativeId']
+    assert submit('fourth').resp_dict == {'repository': 'foo', 'duplicateOf': narr_id}
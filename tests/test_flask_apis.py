@@ -1,5 +1,6 @@
 import json
 import pytest
+import time
 from datetime import datetime, timedelta
 from dna.app import app
 
@@ -17,6 +18,7 @@ def test_app():
 
 @pytest.fixture()
 def client():
+    app.config.update({"TESTING": True})     # The ingest job workers are not started by each request
     return app.test_client()
 
 
@@ -353,10 +355,21 @@ def test_graphs_put_bad_triples(client):
     resp = client.put('/dna/v1/repositories/narratives/graphs', content_type='application/json',
                       query_string={'repository': 'foo', 'narrativeId': narrative_ids[0]},
                       data=req_data)
-    assert resp.status_code == 500
+    assert resp.status_code == 400
     json_data = resp.get_json()
-    assert 'error' in json_data
-    assert "Invalid triples" in json_data['error']
+    assert json_data['error'] == 'invalid'
+    assert 'detail' in json_data
+
+
+def test_graphs_put_malformed_turtle(client):
+    req_data = json.dumps({'triples': ['@prefix : <urn:ontoinsights:dna:> .', ':foo :bar "unterminated ;']})
+    resp = client.put('/dna/v1/repositories/narratives/graphs', content_type='application/json',
+                      query_string={'repository': 'foo', 'narrativeId': narrative_ids[0]},
+                      data=req_data)
+    assert resp.status_code == 400
+    json_data = resp.get_json()
+    assert json_data['error'] == 'invalid'
+    assert 'not valid Turtle' in json_data['detail']
 
 
 def test_end_to_end(client):
@@ -381,6 +394,35 @@ def test_end_to_end(client):
     assert 'narrativeDetails' in json_data
 
 
+def test_narratives_post_async(client):
+    req_data = json.dumps({
+        "title": "An Async Title",
+        "source": "internal",
+        "text": "Harriet Hageman won the primary. She did not lose."
+    })
+    resp = client.post('/dna/v1/repositories/narratives', content_type='application/json',
+                       query_string={'repository': 'foo', 'async': 'true'}, data=req_data)
+    assert resp.status_code == 202
+    job_id = resp.get_json()['jobId']
+    assert resp.headers['Location'] == f'/dna/v1/jobs/{job_id}'
+    for i in range(120):
+        resp = client.get(f'/dna/v1/jobs/{job_id}')
+        assert resp.status_code == 200
+        if resp.get_json()['status'] in ('completed', 'failed'):
+            break
+        time.sleep(5)
+    json_data = resp.get_json()
+    assert json_data['status'] == 'completed'
+    assert [stage['stage'] for stage in json_data['stages']] == ['parsing', 'metadata', 'graph', 'loading']
+    assert 'narrativeId' in json_data['narrativeDetails']
+
+
+def test_jobs_get_nonexistent(client):
+    resp = client.get('/dna/v1/jobs/foo')
+    assert resp.status_code == 404
+    assert 'error' in resp.get_json()
+
+
 def test_repositories_cleanup(client):
     resp = client.delete('/dna/v1/repositories', query_string={'repository': 'foo'})
     assert resp.status_code == 200
@@ -0,0 +1,81 @@
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from dna import http_sessions
+from dna.http_sessions import get_session, http_get
+from dna.response_cache import ResponseCache
+
+url = 'https://en.wikipedia.org/api/rest_v1/page/summary/Joe_Biden'
+content = b'{"title": "Joe Biden"}'
+
+
+class FakeSession:
+    # Records the request headers, and returns the responses in order
+    def __init__(self, responses: list):
+        self.responses = responses
+        self.requests = []
+
+    def get(self, request_url: str, headers: dict = None, timeout=None) -> requests.Response:
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+def _get_response(status_code: int, headers: dict = None, body: bytes = b'') -> requests.Response:
+    response = requests.Response()
+    response.url = url
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers if headers else dict())
+    response.encoding = 'utf-8'
+    response._content = body
+    return response
+
+
+def _use_session(monkeypatch, tmp_path, responses: list) -> FakeSession:
+    session = FakeSession(responses)
+    monkeypatch.setattr(http_sessions, 'get_session', lambda request_url: session)
+    monkeypatch.setattr(http_sessions, 'http_cache', ResponseCache('http', db_path=tmp_path / 'responses.sqlite'))
+    return session
+
+
+def test_session_per_host(monkeypatch):
+    monkeypatch.setattr(http_sessions, '_sessions', dict())
+    session = get_session(url)
+    assert get_session('https://en.wikipedia.org/w/api.php?action=query') is session
+    assert get_session('https://www.wikidata.org/w/rest.php/wikibase/v1/entities/items/Q6279') is not session
+    assert get_session('http://en.wikipedia.org/wiki/Joe_Biden') is not session      # Different scheme
+    assert len(http_sessions._sessions) == 3
+
+
+def test_conditional_request(monkeypatch, tmp_path):
+    session = _use_session(monkeypatch, tmp_path, [
+        _get_response(200, {'Content-Type': 'application/json', 'ETag': '"v1"',
+                            'Last-Modified': 'Tue, 16 Aug 2022 10:00:00 GMT', 'X-Request-Id': '1'}, content),
+        _get_response(304)])
+    response = http_get(url, {'User-Agent': 'dna'}, conditional=True)
+    assert response.status_code == 200 and session.requests[0] == {'User-Agent': 'dna'}
+    response = http_get(url, {'User-Agent': 'dna'}, conditional=True)
+    assert session.requests[1] == {'User-Agent': 'dna', 'If-None-Match': '"v1"',
+                                   'If-Modified-Since': 'Tue, 16 Aug 2022 10:00:00 GMT'}
+    # The response is rebuilt from the cache, with only the content headers
+    assert response.status_code == 200 and response.content == content and response.json() == {'title': 'Joe Biden'}
+    assert response.url == url and response.headers['content-type'] == 'application/json'
+    assert 'X-Request-Id' not in response.headers
+
+
+def test_cache_key(monkeypatch, tmp_path):
+    # Responses are cached per URL and request headers, and only if conditional or they have validators
+    session = _use_session(monkeypatch, tmp_path, [
+        _get_response(200, {'ETag': '"v1"'}, content), _get_response(200, {'ETag': '"v2"'}, content),
+        _get_response(200, {'ETag': '"v3"'}, content), _get_response(200, dict(), content),
+        _get_response(200, dict(), content)])
+    http_get(url, {'Accept': 'application/json'}, conditional=True)
+    http_get(url, {'Accept': 'text/html'}, conditional=True)       # Different headers
+    http_get(url, {'Accept': 'application/json'})                   # Not conditional
+    assert session.requests[1] == {'Accept': 'text/html'} and session.requests[2] == {'Accept': 'application/json'}
+    other_url = f'{url}_Jr.'
+    http_get(other_url, conditional=True)                            # No ETag or Last-Modified header
+    http_get(other_url, conditional=True)
+    assert session.requests[4] == dict()
+    assert http_sessions.http_cache.get(ResponseCache.make_key(url, {'Accept': 'application/json'}))[1]['etag'] == \
+        '"v1"'
+    assert http_sessions.http_cache.get(ResponseCache.make_key(other_url, None)) == (False, None)
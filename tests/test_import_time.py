@@ -0,0 +1,60 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+base_dir = Path(__file__).resolve().parent.parent
+
+
+def _import_module(module: str, statement: str = 'pass') -> (str, list):
+    """
+    Import a module in a new interpreter using -X importtime, and report the slowest imports.
+
+    :param module: String holding the module name
+    :param statement: Python statement executed after the import (its output is returned)
+    :return: A tuple holding the output of the statement, and an array of tuples of the cumulative import
+             time (in microseconds) and name of each imported module (slowest first)
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}; {statement}'],
+                            cwd=base_dir, capture_output=True, text=True, check=True)
+    import_times = []
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            import_times.append((int(cumulative_us), name.strip()))
+    import_times.sort(reverse=True)
+    print(f'\nSlowest imports for {module} (cumulative microseconds):')
+    for cumulative_us, name in import_times[:10]:
+        print(f'{cumulative_us:>10} {name}')
+    return result.stdout.strip(), import_times
+
+
+def test_utilities_import():
+    pytest.importorskip('unidecode')
+    output, import_times = _import_module(
+        'dna.utilities_and_language_specific as u', 'print(u.names_to_geo_dict.loaded, u.female_names.loaded)')
+    assert output == 'False False'
+    assert 'rdflib' not in [name for cumulative_us, name in import_times]
+
+
+def test_nlp_import():
+    pytest.importorskip('spacy')
+    pytest.importorskip('openai')
+    output, import_times = _import_module('dna.nlp', 'print(dna.nlp._nlp is None)')
+    assert output == 'True'
+    assert 'spacy' not in [name for cumulative_us, name in import_times]
+
+
+def test_openai_import():
+    pytest.importorskip('openai')
+    output, import_times = _import_module('dna.query_openai', 'print(dna.query_openai._client is None)')
+    assert output == 'True'
+
+
+def test_app_import():
+    pytest.importorskip('flask')
+    pytest.importorskip('openai')
+    output, import_times = _import_module(
+        'dna.app, threading', 'print([thread.name for thread in threading.enumerate() if thread.name != "MainThread"])')
+    assert output == '[]'      # The ingest job workers are not started on import
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from dna import local_sources
+
+country_info = '#ISO\tISO3\tISO-Numeric\tfips\tCountry\nUS\tUSA\t840\tUS\tUnited States\n'
+geonames = '5128638\tNew York\tNew York\tNY,Nueva York\t43.0\t-75.5\tA\tADM1\tUS\t\tNY\t\t\t\t19274244\n' \
+           '5128581\tNew York City\tNew York City\tNew York,NYC\t40.7\t-74.0\tP\tPPL\tUS\t\tNY\t\t\t\t8804190\n'
+alternate_names = '1\t5128638\tlink\thttps://en.wikipedia.org/wiki/New_York_(state)\t\t\t\t\t\t\n' \
+                  '2\t5128638\ten\tEmpire State\t\t\t\t\t\t\n'
+wikipedia_summary = {'type': 'standard', 'title': 'Joe Biden', 'extract': 'Joseph Robinette Biden Jr. is ...',
+                     'wikibase_item': 'Q6279',
+                     'content_urls': {'desktop': {'page': 'https://en.wikipedia.org/wiki/Joe_Biden'}}}
+wikidata = [{'id': 'Q6279', 'labels': {'en': {'value': 'Joe Biden'}},
+             'aliases': {'en': [{'value': 'Joseph Biden'}]},
+             'claims': {'P31': [{'mainsnak': {'datavalue': {'value': {'id': 'Q5'}}}}]}},
+            {'id': 'Q5', 'claims': {'P279': [{'mainsnak': {'datavalue': {'value': {'id': 'Q215627'}}}}]}},
+            {'id': 'Q178561', 'claims': {'P31': [{'mainsnak': {'datavalue': {'value': {'id': 'Q198'}}}}],
+                                         'P580': [{'mainsnak': {'datavalue': {'value': {
+                                             'time': '+1939-09-01T00:00:00Z'}}}}]}}]
+
+
+@pytest.fixture
+def local_index(tmp_path, monkeypatch):
+    files = {'countryInfo.txt': country_info, 'allCountries.txt': geonames, 'alternateNamesV2.txt': alternate_names,
+             'wikipedia.jsonl': json.dumps(wikipedia_summary),
+             'wikidata.json': '[\n' + ',\n'.join([json.dumps(entity) for entity in wikidata]) + '\n]\n'}
+    for file_name, content in files.items():
+        (tmp_path / file_name).write_text(content, encoding='utf-8')
+    db_path = tmp_path / 'local_sources.sqlite'
+    local_sources.build_index(db_path, str(tmp_path / 'countryInfo.txt'), str(tmp_path / 'allCountries.txt'),
+                              str(tmp_path / 'alternateNamesV2.txt'), str(tmp_path / 'wikipedia.jsonl'),
+                              str(tmp_path / 'wikidata.json'))
+    monkeypatch.setattr(local_sources, 'local_sources_path', db_path)
+    monkeypatch.setattr(local_sources, '_conn', None)
+    yield db_path
+    local_sources._conn.close()
+
+
+def test_geonames(local_index):
+    root = local_sources.get_geonames_element('New York')
+    assert root.find('./geoname/toponymName').text == 'New York'   # Primary name preferred over alternate
+    assert root.find('./geoname/fcode').text == 'ADM1'
+    assert root.find('./geoname/countryName').text == 'United States'
+    assert root.find('./geoname/alternateName[@lang="link"]').text.endswith('New_York_(state)')
+    assert local_sources.get_geonames_element('nyc').find('./geoname/toponymName').text == 'New York City'
+    assert local_sources.get_geonames_element('New York City, United States') is not None
+    assert local_sources.get_geonames_element('New York City, Canada') is None
+    assert local_sources.get_geonames_element('Atlantis') is None
+
+
+def test_wikipedia(local_index):
+    assert local_sources.get_wikipedia_summary('Joe_Biden') == wikipedia_summary
+    assert local_sources.get_wikipedia_summary('Unknown_Person') == dict()
+
+
+def test_wikidata(local_index):
+    assert local_sources.get_wikidata_labels('Q6279') == ['Joe Biden', 'Joseph Biden']
+    assert local_sources.is_instance_of('Q6279', 'Q5')
+    assert local_sources.is_instance_of('Q6279', 'Q215627')      # Via the subclass closure
+    assert not local_sources.is_instance_of('Q6279', 'Q198')
+    assert local_sources.get_wikidata_times('Q178561') == ('1939-09-01T00:00:00Z', '')
+
+
+def test_rebuild(local_index):
+    # Rebuilding the index from the same files does not duplicate rows
+    files = local_index.parent
+    local_sources.build_index(local_index, str(files / 'countryInfo.txt'), str(files / 'allCountries.txt'),
+                              str(files / 'alternateNamesV2.txt'), str(files / 'wikipedia.jsonl'),
+                              str(files / 'wikidata.json'))
+    assert local_sources.get_wikidata_labels('Q6279') == ['Joe Biden', 'Joseph Biden']
+    assert local_sources._execute('SELECT count(*) FROM geonames_names', ())[0][0] == 6
+    assert len(local_sources.get_geonames_element('New York').findall('./geoname/alternateName')) == 2
@@ -1,6 +1,6 @@
 import pytest
 from dna.sentence_classes import Sentence, Quotation
-from dna.nlp import parse_narrative
+from dna.nlp import parse_narrative, parse_narratives
 
 sent_no_quotations = \
     'U.S. Rep. Liz Cheney conceded defeat Tuesday in the Republican primary in Wyoming, ' \
@@ -160,3 +160,15 @@ def test_multiple_possible_speakers():
            'It has been said that the long arc of history bends toward justice and freedom. That’s true, but only ' \
            'if we make it bend'
     assert quotation_classes[0].attribution == 'Ms. Cheney'
+
+
+def test_parse_narratives():
+    narratives = [sent_no_quotations, sent_multiple_sentences, text_multiple_complete_quotes]
+    results = list(parse_narratives(narratives, batch_size=2))
+    assert len(results) == 3
+    for narrative, (sentence_classes, quotation_classes) in zip(narratives, results):
+        expected_sentences, expected_quotations = parse_narrative(narrative)
+        assert [sentence.text for sentence in sentence_classes] == [sentence.text for sentence in expected_sentences]
+        assert [[entity.text for entity in sentence.entities] for sentence in sentence_classes] == \
+               [[entity.text for entity in sentence.entities] for sentence in expected_sentences]
+        assert [quote.text for quote in quotation_classes] == [quote.text for quote in expected_quotations]
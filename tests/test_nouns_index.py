@@ -0,0 +1,89 @@
+import copy
+import pickle
+import random
+
+from dna.nouns_index import NounsDictionary
+
+labels = ['Liz Cheney', 'Cheney', 'Harriet Hageman', 'Biden-Harris campaign', 'campaign', 'Wyoming', 'GOP',
+          'Donald Trump', 'Trump', 'Rep. Liz Cheney', 'Republican Party', 'Democratic campaign', 'US', 'Jan']
+queries = ['Rep. Liz Cheney', 'challenger Harriet Hageman', 'campaign', 'Cheney', 'Trump administration', 'US',
+           'Party', 'amp', 'the Wyoming GOP', 'Harris', 'n', 'January', 'Hageman', 'Joe Biden', '']
+
+
+def _scan_in(nouns_dict: dict, text: str):
+    return next((noun for noun in nouns_dict.keys() if noun in text), None)
+
+
+def _scan_containing(nouns_dict: dict, text: str):
+    return next((noun for noun in nouns_dict.keys() if text in noun), None)
+
+
+def _check_lookups(nouns_dict: NounsDictionary):
+    for query in queries:
+        assert nouns_dict.find_key_in(query) == _scan_in(nouns_dict, query)
+        assert nouns_dict.find_key_containing(query) == _scan_containing(nouns_dict, query)
+
+
+def test_lookups_match_scans():
+    nouns_dict = NounsDictionary()
+    for label in labels:     # Incremental insertion
+        nouns_dict[label] = 'PERSON', f':{label}'
+        _check_lookups(nouns_dict)
+    assert nouns_dict.find_key_in('Rep. Liz Cheney') == 'Liz Cheney'     # First inserted match
+    assert nouns_dict.find_key_containing('campaign') == 'Biden-Harris campaign'
+
+
+def test_lookups_after_updates():
+    nouns_dict = NounsDictionary((label, ('PERSON', f':{label}')) for label in labels)
+    nouns_dict['Liz Cheney'] = 'PERSON', ':Cheney'     # Existing key retains its position
+    _check_lookups(nouns_dict)
+    del nouns_dict['Liz Cheney']
+    nouns_dict.pop('campaign')
+    nouns_dict.setdefault('Liz Cheney', ('PERSON', ':Liz'))
+    nouns_dict.popitem()
+    _check_lookups(nouns_dict)
+    nouns_dict.clear()
+    assert nouns_dict.find_key_in('Rep. Liz Cheney') is None
+    assert nouns_dict.find_key_containing('Cheney') is None
+
+
+def test_merges_are_indexed():
+    nouns_dict = NounsDictionary((label, ('PERSON', f':{label}')) for label in labels[:7])
+    nouns_dict |= {label: ('PERSON', f':{label}') for label in labels[7:]}
+    assert nouns_dict.find_key_in('former President Donald Trump') == 'Donald Trump'
+    _check_lookups(nouns_dict)
+    nouns_dict |= [('Kamala Harris', ('PERSON', ':Kamala_Harris'))]     # Iterable of key/value pairs
+    assert nouns_dict.find_key_containing('Kamala') == 'Kamala Harris'
+    for merged in (nouns_dict | {'Joe Biden': ('PERSON', ':Joe_Biden')},
+                   {'Joe Biden': ('PERSON', ':Joe_Biden')} | nouns_dict):
+        assert isinstance(merged, NounsDictionary) and merged.find_key_in('President Joe Biden') == 'Joe Biden'
+        _check_lookups(merged)
+    assert nouns_dict.find_key_in('President Joe Biden') is None     # Not updated by |
+    assert nouns_dict.setdefault('Wyoming', ('GPE', ':Wyoming')) == ('PERSON', ':Wyoming')
+    assert nouns_dict.setdefault('Casper', ('GPE', ':Casper')) == ('GPE', ':Casper')
+    assert nouns_dict.find_key_in('Casper, Wyoming') == 'Wyoming'     # Inserted earlier
+    assert nouns_dict.pop('Wyoming') == ('PERSON', ':Wyoming')
+    assert nouns_dict.find_key_in('Casper, Wyoming') == 'Casper'
+    assert nouns_dict.pop('Wyoming', None) is None
+    _check_lookups(nouns_dict)
+
+
+def test_copies_are_indexed():
+    nouns_dict = NounsDictionary((label, ('PERSON', f':{label}')) for label in labels)
+    for nouns_copy in (copy.copy(nouns_dict), copy.deepcopy(nouns_dict), nouns_dict.copy(),
+                       pickle.loads(pickle.dumps(nouns_dict))):
+        assert isinstance(nouns_copy, NounsDictionary) and nouns_copy == nouns_dict
+        _check_lookups(nouns_copy)
+
+
+def test_random_lookups_match_scans():
+    rand = random.Random(7)
+    words = ['ab', 'abc', 'b', 'ca', 'bca', 'abca', 'cab']
+    nouns_dict = NounsDictionary()
+    for i in range(300):
+        nouns_dict[' '.join(rand.choices(words, k=rand.randint(1, 3)))] = 'ORG', f':{i}'
+        if i % 7 == 0:
+            del nouns_dict[rand.choice(list(nouns_dict))]
+        query = ''.join(rand.choices(words, k=rand.randint(1, 4)))
+        assert nouns_dict.find_key_in(query) == _scan_in(nouns_dict, query)
+        assert nouns_dict.find_key_containing(query) == _scan_containing(nouns_dict, query)
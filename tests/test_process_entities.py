@@ -0,0 +1,64 @@
+import pytest
+
+from dna import process_entities, query_sources
+from dna.process_entities import _get_noun_ttl, _normalize_entity_text, prefetch_entities
+from dna.sentence_classes import Entity
+
+sentence = 'Joe Biden and Kamala Harris campaigned in Pennsylvania.'
+
+
+def test_normalize_entity_text():
+    assert _normalize_entity_text('the U.S. Supreme Court') == 'US Supreme Court'
+    assert _normalize_entity_text("Biden's") == 'Biden'
+    assert _normalize_entity_text('former President Biden') == 'President Biden'
+
+
+def test_normalize_trailing_conjunction():
+    # The conjunction is removed using its own length (previously, the length of the last article tested was used)
+    assert _normalize_entity_text('Biden or') == 'Biden'         # Was 'Bide'
+    assert _normalize_entity_text('a Congress and') == 'Congress'     # Was 'Congress a'
+    assert _normalize_entity_text('The Senate and') == 'Senate'
+
+
+def test_normalize_empty_entity_text():
+    # Text that is empty after normalization is skipped (previously, an IndexError was raised)
+    assert _normalize_entity_text('.') == ''
+    assert _normalize_entity_text('the ...') == ''
+
+
+def test_noun_ttl_from_prefetched_entries(monkeypatch, tmp_path):
+    # Only the results of the (cached) source lookups are prefetched
+    for cache in (query_sources.wikipedia_cache, query_sources.wikidata_cache):
+        monkeypatch.setattr(cache, 'db_path', tmp_path / 'responses.sqlite')
+        monkeypatch.setattr(cache, '_conn', None)
+        monkeypatch.setattr(cache, 'enabled', True)
+    monkeypatch.setattr(query_sources, 'source_backend', 'api')
+    monkeypatch.setattr(process_entities, 'source_backend', 'api')
+    monkeypatch.setattr(process_entities, 'sources_cache_enabled', True)
+    requested = []
+
+    def get_wikipedia_description(noun_text: str, ner_type: str, explicit_link: str) -> dict:
+        requested.append(noun_text)
+        return {'type': 'standard', 'wikibase_item': f'Q{len(requested)}', 'extract': f'{noun_text} is a politician',
+                'content_urls': {'desktop': {'page': f'https://en.wikipedia.org/wiki/{noun_text}'}}}
+
+    monkeypatch.setattr(query_sources, '_get_wikipedia_description', get_wikipedia_description)
+    monkeypatch.setattr(query_sources, '_call_wikidata_rest', lambda path_parameters: [])
+    entities = [Entity('Joe Biden', 'MALESINGPERSON', []), Entity('Kamala Harris', 'FEMALESINGPERSON', [])]
+    prefetch_entities([(sentence, entities)], dict())
+    assert sorted(requested) == ['Joe_Biden', 'Kamala_Harris']
+    noun_type, noun_iri, noun_ttl = _get_noun_ttl(sentence, 'Joe Biden', entities[0], dict())
+    assert len(requested) == 2      # Served from the cache
+    assert noun_iri == ':Joe_Biden' and any('Joe_Biden is a politician' in ttl for ttl in noun_ttl)
+
+
+@pytest.mark.parametrize('cache_enabled, backend', [(False, 'api'), (True, 'local')])
+def test_no_prefetch(monkeypatch, cache_enabled, backend):
+    # The results would not be cached, and so the entities are not prefetched
+    monkeypatch.setattr(process_entities, 'sources_cache_enabled', cache_enabled)
+    monkeypatch.setattr(process_entities, 'source_backend', backend)
+    prefetched = []
+    monkeypatch.setattr(process_entities, '_prefetch_entity_details', lambda *args: prefetched.append(args))
+    prefetch_entities([(sentence, [Entity('Joe Biden', 'MALESINGPERSON', []),
+                                   Entity('Kamala Harris', 'FEMALESINGPERSON', [])])], dict())
+    assert not prefetched
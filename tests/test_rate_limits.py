@@ -0,0 +1,47 @@
+import time
+
+from dna import rate_limits
+from dna.rate_limits import SourceRateLimiter
+
+
+def test_pacing():
+    limiter = SourceRateLimiter('test', requests_per_second=20)
+    start = time.time()
+    futures = [limiter.submit(time.time) for i in range(3)]
+    sent_times = [future.result(timeout=5) for future in futures]
+    assert sent_times == sorted(sent_times)
+    assert sent_times[2] - start >= 0.09       # Second and third requests are spaced by 0.05 seconds
+    assert limiter.metrics['requests'] == 3
+    assert limiter.metrics['waits'] == 2
+
+
+def test_saturated_limiter_does_not_sleep():
+    limiter = SourceRateLimiter('test', requests_per_second=2)
+    limiter.block(0.5)
+    start = time.time()
+    futures = [limiter.submit(time.time, max_wait=5) for i in range(4)]
+    assert time.time() - start < 0.1           # Queued, without waiting for the 2 seconds of slots
+    assert not any(future.done() for future in futures)
+    assert futures[1].cancel()                 # A cancelled request is not sent
+    sent_times = [futures[index].result(timeout=5) for index in (0, 2, 3)]
+    assert sent_times[0] - start >= 0.45 and sent_times[2] - sent_times[0] >= 0.95
+
+
+def test_block(tmp_path):
+    limiter = SourceRateLimiter('test')
+    limiter.block(10)
+    assert limiter.submit(time.time, max_wait=1) is None   # Rejected immediately rather than waiting 10 seconds
+    assert limiter.metrics['rejected'] == 1
+    assert limiter.metrics['throttled'] == 1
+    limiter.block(0.1)                                      # Shorter block does not shorten the existing one
+    assert limiter.submit(time.time, max_wait=1) is None
+
+
+def test_shared_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_limits, 'cache_dir', tmp_path)
+    limiter1 = SourceRateLimiter('test', shared=True)
+    limiter2 = SourceRateLimiter('test', shared=True)
+    assert limiter2.submit(time.time, max_wait=0).result(timeout=5)
+    limiter1.block(10)
+    assert limiter2.submit(time.time, max_wait=1) is None
+    assert SourceRateLimiter('other', shared=True).submit(time.time, max_wait=0).result(timeout=5)
@@ -0,0 +1,58 @@
+import time
+
+from dna.response_cache import ResponseCache
+
+response = {'grade_level': 8, 'rhetorical_devices': []}
+
+
+def test_key():
+    key = ResponseCache.make_key('prompt text', 'gpt-4o', 0.05)
+    assert key == ResponseCache.make_key('prompt text', 'gpt-4o', 0.05)
+    assert key != ResponseCache.make_key('prompt text', 'gpt-4o', 0.1)
+    assert key != ResponseCache.make_key('prompt text', 'gpt-4o-mini', 0.05)
+
+
+def test_get_put(tmp_path):
+    cache = ResponseCache('test', db_path=tmp_path / 'responses.sqlite')
+    key = ResponseCache.make_key('prompt text')
+    assert cache.get(key) == (False, None)
+    cache.put(key, response)
+    assert cache.get(key) == (True, response)
+    assert cache.stats() == {'namespace': 'test', 'hits': 1, 'misses': 1}
+
+
+def test_namespaces(tmp_path):
+    cache1 = ResponseCache('test1', db_path=tmp_path / 'responses.sqlite')
+    cache2 = ResponseCache('test2', db_path=tmp_path / 'responses.sqlite')
+    cache1.put('key', response)
+    assert cache2.get('key') == (False, None)
+    cache2.clear()
+    assert cache1.get('key') == (True, response)
+
+
+def test_ttl(tmp_path):
+    cache = ResponseCache('test', ttl=0.1, db_path=tmp_path / 'responses.sqlite')
+    cache.put('key1', response)
+    cache.put('key2', response, ttl=0)     # Does not expire
+    time.sleep(0.2)
+    assert cache.get('key1') == (False, None)
+    assert cache.get('key2') == (True, response)
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResponseCache('test', max_entries=2, db_path=tmp_path / 'responses.sqlite')
+    for key in ('key1', 'key2', 'key3'):
+        cache.put(key, response)
+        time.sleep(0.01)
+    cache.get('key1')                      # key2 is now the least recently used
+    cache.evict()
+    assert cache.get('key1')[0]
+    assert not cache.get('key2')[0]
+    assert cache.get('key3')[0]
+
+
+def test_disabled(tmp_path):
+    cache = ResponseCache('test', enabled=False, db_path=tmp_path / 'responses.sqlite')
+    cache.put('key', response)
+    assert cache.get('key') == (False, None)
+    assert not (tmp_path / 'responses.sqlite').exists()
@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from dna import process_sentences
+from dna.process_sentences import get_sentence_prompt_futures
+from dna.response_cache import ResponseCache
+
+sentences = ['U.S. Rep. Liz Cheney conceded defeat Tuesday in the Republican primary in Wyoming.',
+             'Harriet Hageman, a Trump-endorsed attorney, won the primary.',
+             'Cheney said that she would do whatever it takes to keep Trump out of the Oval Office.']
+
+
+def test_cached_sentences_not_batched(tmp_path, monkeypatch):
+    monkeypatch.setattr(process_sentences, 'sentence_cache',
+                        ResponseCache('sentences', db_path=tmp_path / 'responses.sqlite'))
+    batches = []
+
+    def get_results_batched(sentence_texts: list) -> list:
+        batches.append(sentence_texts)
+        results = [{'grade_level': len(sentence_text), 'rhetorical_devices': []} for sentence_text in sentence_texts]
+        process_sentences._cache_sentence_results(sentence_texts, results)
+        return results
+
+    monkeypatch.setattr(process_sentences, 'get_sentence_prompt_results_batched', get_results_batched)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first_results = [future.result() for future in get_sentence_prompt_futures(sentences[:2], executor)]
+        # A near-duplicate, where only the new sentence is sent (whitespace differences are ignored)
+        near_duplicate = [f'  {sentences[0]}', sentences[2], sentences[1]]
+        results = [future.result() for future in get_sentence_prompt_futures(near_duplicate, executor)]
+    assert batches == [sentences[:2], [sentences[2]]]
+    assert results == [first_results[0], {'grade_level': len(sentences[2]), 'rhetorical_devices': []},
+                       first_results[1]]
@@ -0,0 +1,26 @@
+import json
+
+from dna.local_sources import build_index
+from dna.subclass_closure import SubclassClosure, build_closure
+
+wikidata = [{'id': 'Q6279', 'claims': {'P31': [{'mainsnak': {'datavalue': {'value': {'id': 'Q5'}}}}]}},
+            {'id': 'Q7188', 'claims': {'P31': [{'mainsnak': {'datavalue': {'value': {'id': 'Q327333'}}}}]}},
+            {'id': 'Q327333', 'claims': {'P279': [{'mainsnak': {'datavalue': {'value': {'id': 'Q43229'}}}}]}},
+            {'id': 'Q42', 'claims': {'P31': [{'mainsnak': {'datavalue': {'value': {'id': 'Q7725634'}}}}]}}]
+roots = ['Q5', 'Q43229', 'Q1190554']
+
+
+def test_closure(tmp_path):
+    (tmp_path / 'wikidata.json').write_text('\n'.join([json.dumps(entity) for entity in wikidata]), encoding='utf-8')
+    build_index(tmp_path / 'local_sources.sqlite', wikidata=str(tmp_path / 'wikidata.json'))
+    closure = build_closure(roots, tmp_path / 'local_sources.sqlite')
+    closure.save(tmp_path / 'subclass_closure.bin')
+    closure = SubclassClosure.load(tmp_path / 'subclass_closure.bin')
+    assert closure.get_mask('Q6279') == 0b001
+    assert closure.is_instance_of('Q6279', 'Q5')
+    assert not closure.is_instance_of('Q6279', 'Q43229')
+    assert closure.is_instance_of('Q7188', 'Q43229')        # Via subclass, government agency
+    assert closure.get_mask('Q42') == 0                      # Item is known, but is not an instance of a root class
+    assert closure.is_instance_of('Q42', 'Q5') is False
+    assert closure.is_instance_of('Q99999', 'Q5') is None    # Unknown item
+    assert closure.is_instance_of('Q6279', 'Q2424752') is None    # Unknown root class
@@ -0,0 +1,18 @@
+from dna.utilities_and_language_specific import check_name_gender, female_names, male_names
+
+
+def test_names_loaded_as_frozensets():
+    assert isinstance(female_names.load(), frozenset)
+    assert isinstance(male_names.load(), frozenset)
+
+
+def test_check_name_gender():
+    assert check_name_gender('Liz Cheney') == 'FEMALESINGPERSON'
+    assert check_name_gender('Donald Trump') == 'MALESINGPERSON'
+    assert check_name_gender('Cheney') == 'SINGPERSON'
+
+
+def test_check_name_gender_folded():
+    assert check_name_gender('ADÈLE Haenel') == 'FEMALESINGPERSON'     # Case and diacritics are ignored
+    assert check_name_gender('Adele Haenel') == 'FEMALESINGPERSON'
+    assert check_name_gender('Mary-Kate Olsen') == 'FEMALESINGPERSON'  # First part of a hyphenated name
@@ -0,0 +1,101 @@
+# Compare the throughput and named entity agreement of spaCy models on a set of narratives
+#    Usage: python tools/benchmark_spacy_models.py [--models en_core_web_trf en_core_web_lg en_core_web_sm]
+#           [--files tests/resources/*.txt] [--repeat 3]
+#    The first model is the reference for the entity agreement (precision, recall and F1 of the entity spans
+#    and types), where only the entity types used by DNA (ner_types, excluding TIME) are compared
+
+import argparse
+import glob
+import time
+from pathlib import Path
+
+import spacy
+
+from dna.nlp import entities_disabled, narrative_disabled
+from dna.utilities_and_language_specific import ner_types
+
+default_files = str(Path(__file__).resolve().parent.parent / 'tests' / 'resources' / '*.txt')
+
+
+def get_entity_spans(doc) -> set:
+    """
+    Get the character offsets and types of the named entities in a Doc.
+
+    :param doc: The spaCy Doc
+    :return: Set of tuples of the start and end offsets, and the type, of each entity
+    """
+    return {(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents
+            if ent.label_ in ner_types and ent.label_ != 'TIME'}
+
+
+def benchmark_model(model: str, texts: list, repeat: int) -> (dict, list):
+    """
+    Measure the load time and throughput of a model, using the same disabled components as parse_narrative
+    (for narratives) and get_entities (for sentences).
+
+    :param model: String holding the model name
+    :param texts: Array of strings holding the narratives
+    :param repeat: Number of times that the narratives are parsed (the fastest time is reported)
+    :return: A tuple holding a dictionary of the timings and an array of the entity spans for each narrative
+    """
+    start = time.perf_counter()
+    nlp = spacy.load(model)
+    load_seconds = time.perf_counter() - start
+    narrative_disable = [name for name in narrative_disabled if name in nlp.pipe_names]
+    entities_disable = [name for name in entities_disabled if name in nlp.pipe_names]
+    narrative_seconds = sentence_seconds = float('inf')
+    docs = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        docs = list(nlp.pipe(texts, disable=narrative_disable))
+        narrative_seconds = min(narrative_seconds, time.perf_counter() - start)
+    sentences = [sentence.text for doc in docs for sentence in doc.sents]
+    for i in range(repeat):
+        start = time.perf_counter()
+        list(nlp.pipe(sentences, disable=entities_disable))
+        sentence_seconds = min(sentence_seconds, time.perf_counter() - start)
+    number_chars = sum(len(text) for text in texts)
+    return {'model': model, 'load_seconds': load_seconds,
+            'narratives_per_second': len(texts) / narrative_seconds,
+            'chars_per_second': number_chars / narrative_seconds,
+            'sentences_per_second': len(sentences) / sentence_seconds if sentences else 0.0}, \
+        [get_entity_spans(doc) for doc in docs]
+
+
+def get_agreement(reference: list, candidate: list) -> (float, float, float):
+    """
+    Compute the precision, recall and F1 of the candidate entities against the reference entities.
+
+    :param reference: Array of sets of the reference entity spans (one set per narrative)
+    :param candidate: Array of sets of the candidate entity spans (one set per narrative)
+    :return: A tuple holding the precision, recall and F1 scores
+    """
+    matched = sum(len(ref & cand) for ref, cand in zip(reference, candidate))
+    number_candidate = sum(len(cand) for cand in candidate)
+    number_reference = sum(len(ref) for ref in reference)
+    precision = matched / number_candidate if number_candidate else 1.0
+    recall = matched / number_reference if number_reference else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the throughput and entity agreement of spaCy models')
+    parser.add_argument('--models', nargs='+', default=['en_core_web_trf', 'en_core_web_lg', 'en_core_web_sm'],
+                        help='spaCy models to compare (the first is the reference for entity agreement)')
+    parser.add_argument('--files', nargs='+', default=[default_files], help='narrative text files (or patterns)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per model')
+    args = parser.parse_args()
+    file_names = sorted({file_name for pattern in args.files for file_name in glob.glob(pattern)})
+    narratives = [Path(file_name).read_text(encoding='utf-8').replace('\n', ' ') for file_name in file_names]
+    print(f'{len(narratives)} narratives, {sum(len(text) for text in narratives)} characters')
+    print(f'{"model":<20}{"load s":>8}{"narr/s":>9}{"chars/s":>10}{"sent/s":>9}'
+          f'{"precision":>11}{"recall":>8}{"F1":>7}')
+    reference_spans = None
+    for model_name in args.models:
+        results, entity_spans = benchmark_model(model_name, narratives, args.repeat)
+        reference_spans = entity_spans if reference_spans is None else reference_spans
+        precision, recall, f1 = get_agreement(reference_spans, entity_spans)
+        print(f'{model_name:<20}{results["load_seconds"]:>8.1f}{results["narratives_per_second"]:>9.2f}'
+              f'{results["chars_per_second"]:>10.0f}{results["sentences_per_second"]:>9.1f}'
+              f'{precision:>11.3f}{recall:>8.3f}{f1:>7.3f}')